@@ -5,13 +5,24 @@ Author - Chukwuemeka Osaretin Ike
 
 Description:
 '''
-import itertools
+import contextlib
 import numpy as np
 
+from functools import lru_cache
 from math import pi, floor
-from scipy import signal
 from scipy.fft import fft
 from scipy.linalg import expm
+from time import monotonic
+from typing import Tuple
+
+import cache_utils
+import checkpoint_utils
+import evolution_utils
+import filter_utils
+import parallel_utils
+import profiling_utils
+import search_utils
+import simulation_utils
 
 
 INT_MAX = 2147483647
@@ -35,68 +46,50 @@ class ObserverBasedFilter:
     _order = 3
     _stateLength = (2 * _order + 1)
 
-    # Create the autonomous A matrix given specific size. Currently hardcoded to dt=1/60
-    # TODO: Make this better
-    Ac = np.zeros([_stateLength, _stateLength])
-    for k in range(_order):
-        i = (1 + k) * 2
-        k = k + 1 #handles the one off error
-        Ac[i - 2:i, i - 2:i] = [[0, 1], [float(-(k * _omg) ** 2), 0]]
-    _A_auto = expm(Ac*1/60)
-    
     # Optimization hyperparameters
     _mu = 100
     _rho = 2
     _lambda = 50
     _max_iterations = 25
 
+    # Spectral cost of simulated outputs: 'fft' computes the full spectrum,
+    # 'parseval' only the bins the cost needs (see filter_utils.CostPlan)
+    _spectralCost = 'fft'
+
     # Bounds on the filter params used for optimization
     _LB = -5
     _lStart = 0
     _rEnd = 8
     _mid = (_lStart+_rEnd)/2
 
+    # Warm start around a previous optimal gain
+    _warmStartIterations = 10       # Generations when starting from a prior
+    _warmStartRandomShare = 0.2     # Share of the population drawn at random
+    _warmStartSpread = 0.5          # Std. dev. of the log-scale perturbations
+
+    # Multi-resolution optimization
+    _coarseShare = 0.8              # Share of the generations run on decimated data
+
+    # Output buffer reused by the simulations of an optimization, and the optional
+    # profiling_utils.OptimizationStats collector of one
+    _outputs = None
+    _stats = None
+
     def estimateAverageDailyPhase(self, xHat1: np.ndarray, xHat2: np.ndarray, numDays: int, numDataPointsPerDay: int) -> np.ndarray:
-        '''Computes the frequency spectrum of the input [y] sampled according to [t].
+        '''Computes the average daily phase difference of each day from day 1.
 
         Args:
-            xHat (np.ndarray) - filter state 1 and 2 
+            xHat (np.ndarray) - filter state 1 and 2, with time along the last axis. Leading
+                axes are kept, so many users' states can be stacked and processed together
             numDays (int) - number of days 
             numDataPointsPerDay (int) - number of data points per day - 1440 for 1-minute intervals
         Returns:
             averageDailyPhase (np.ndarray) - array of average daily phase difference from day 1 in hours
         '''
+        return filter_utils.estimateAverageDailyPhase(xHat1, xHat2, numDays, numDataPointsPerDay, self._omg)
 
-        x1 = xHat1
-        x2 = xHat2
-        # print(xHat1)
-        # print(xHat2.shape)
-        theta = np.mod(-np.arctan2(x2, self._omg*x1) + pi/2, 2*pi) - pi
-        # print(theta.shape)
-
-        averageDailyPhase = np.zeros([1, numDays])
-        day1RangeStart = 0
-        day1RangeEnd = numDataPointsPerDay
-
-        for i in range(0, numDays):
-            day2RangeStart = (numDataPointsPerDay*i)
-            day2RangeEnd = (numDataPointsPerDay*(i+1))
-            # print(day2RangeStart, day2RangeEnd)
-            # print((theta[0,day2RangeStart:day2RangeEnd]))
-            # print(np.unwrap(theta[day2RangeStart:day2RangeEnd]))
-            # print((np.unwrap(theta[day2RangeStart:day2RangeEnd])).shape)
-            # print(np.unwrap(theta[day1RangeStart:day1RangeEnd]) - np.unwrap(theta[day2RangeStart:day2RangeEnd]))
-            # print((np.unwrap(theta[day1RangeStart:day1RangeEnd]) - np.unwrap(theta[day2RangeStart:day2RangeEnd])).shape)
-            # print((1/self._omg)*np.mean( np.unwrap(theta[day1RangeStart:day1RangeEnd]) - np.unwrap(theta[day2RangeStart:day2RangeEnd]), axis=1))
-
-            averageDailyPhase[0, i] = (1/self._omg)*np.mean( np.unwrap(theta[0, day1RangeStart:day1RangeEnd]) - np.unwrap(theta[0, day2RangeStart:day2RangeEnd]), axis=0)
-
-        averageDailyPhase = np.mod(12+averageDailyPhase, 24) - 12
-        # print(xHat1.shape)
-        # print(averageDailyPhase)
-        return averageDailyPhase
-
-    def simulateDynamics(self, t:np.ndarray, y: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray, D: np.ndarray) -> np.ndarray:
+    def simulateDynamics(self, t:np.ndarray, y: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray, D: np.ndarray,
+                         out: np.ndarray = None, yHatOnly: bool = False, backend: str = None) -> np.ndarray:
         '''Simulates the system dynamics on the input data [y].
 
         Args:
@@ -106,40 +99,140 @@ class ObserverBasedFilter:
             B (np.ndarray) - discrete-time B matrix
             C (np.ndarray) - discrete-time C matrix
             D (np.ndarray) - discrete-time D matrix
+            out (np.ndarray) - optional (stateLength+1, len(y)) array to write the output into,
+                of any float dtype, or (len(y),) with yHatOnly
+            yHatOnly (bool) - keep only the current state and return just yHat
+            backend (str) - simulation backend (see simulation_utils). Defaults to the
+                SENSE_SIMULATION_BACKEND environment variable
         Returns:
             filterOutput(np.ndarray) - contains [xHat; yHat]:
                 xHat (np.ndarray) - filter state estimates 
                 yHat (np.ndarray) - filter output
         '''
-        xHat = np.zeros([self._stateLength, len(y)])
-        xHat[self._stateLength-1, 0] = 70
+        xHat0 = np.zeros(self._stateLength)
+        xHat0[self._stateLength-1] = 70
 
-        for j in range(1, len(y)):
-            # TODO: Make sure this is as efficient as possible
-            # The reshapes are all to make sure it's the right dimension
-            # Update the current state based on previous filter state and previous input
-            if y[j-1] == 0:
-                xHat[:,j] = np.reshape(np.matmul(self._A_auto,xHat[:,j-1]).T, (self._stateLength))
-            else:
-                xHat[:,j] = np.reshape(np.reshape(np.matmul(A,xHat[:,j-1]).T, (self._stateLength,1)) + (B*y[j-1]), (self._stateLength))
-        
-        # Multiply the whole history of filter states by the C matrix to give us the output history
-        yHat = np.matmul(C, xHat)
+        return self._simulateFrom(xHat0, y, A, B, C, self.autonomousDynamics(t), out, yHatOnly, backend)
+
+    def advanceDynamics(self, t:np.ndarray, y: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray, D: np.ndarray,
+                        lastState: np.ndarray, lastY: float) -> np.ndarray:
+        '''Continues a simulation from its final state over newly arrived data [y].
+
+        Gives the same outputs as simulating the old and new data together, while only
+        simulating the new data
+
+        Args:
+            t (np.ndarray) - time values (in hours from first entry) for the new data
+            y (np.ndarray) - new biometric data values
+            A (np.ndarray) - discrete-time A matrix
+            B (np.ndarray) - discrete-time B matrix
+            C (np.ndarray) - discrete-time C matrix
+            D (np.ndarray) - discrete-time D matrix
+            lastState (np.ndarray) - final xHat column of the previous simulation
+            lastY (float) - last biometric data value of the previous simulation
+        Returns:
+            filterOutput(np.ndarray) - contains [xHat; yHat] for the new data
+        '''
+        y = np.append(float(lastY), np.asarray(y, dtype=float))
+        xHat0 = np.reshape(np.asarray(lastState, dtype=float), (-1))
 
-        return np.append(xHat, yHat, axis=0)
+        return self._simulateFrom(xHat0, y, A, B, C, self.autonomousDynamics(t))[:, 1:]
 
-    def optimizeFilter(self, t:np.ndarray, y: np.ndarray) -> np.ndarray:
-        '''Optimizes the filter given input time and value data
+    def _simulateFrom(self, xHat0: np.ndarray, y: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray,
+                      A_auto: np.ndarray, out: np.ndarray = None, yHatOnly: bool = False,
+                      backend: str = None) -> np.ndarray:
+        '''Simulates the system dynamics on [y] from the state [xHat0] at y[0].
+
+        Args:
+            xHat0 (np.ndarray) - filter state at the first data value
+            y (np.ndarray) - biometric data values
+            A (np.ndarray) - discrete-time A matrix
+            B (np.ndarray) - discrete-time B matrix
+            C (np.ndarray) - discrete-time C matrix
+            A_auto (np.ndarray) - discrete-time A matrix used across gaps in the data
+            out (np.ndarray) - optional array to write the output into
+            yHatOnly (bool) - keep only the current state and return just yHat
+            backend (str) - simulation backend name
+        Returns:
+            filterOutput(np.ndarray) - contains [xHat; yHat], or yHat alone
+        '''
+        # Data runs use (A, B) with input y[j-1] and gaps run on A_auto, which the segment
+        # engine fast-forwards from cached matrix powers instead of stepping through
+        y = np.asarray(y, dtype=float)
+        u = np.zeros(len(y))
+        u[1:] = y[:-1]
+        if yHatOnly:
+            return simulation_utils.simulateOutput(xHat0, A, B, A_auto, u, u != 0, C, out, backend)
+
+        xHat = simulation_utils.simulate(xHat0, A, B, A_auto, u, u != 0, backend)
+
+        # Multiply the whole history of filter states by the C matrix to give us the output history,
+        # writing both in place
+        if out is None:
+            out = np.empty([self._stateLength+1, len(y)])
+        out[:-1] = xHat
+        np.matmul(C, xHat, out=out[-1:])
+
+        return out
+
+    def optimizeFilter(self, t:np.ndarray, y: np.ndarray, workers: int = None, seed: int = None,
+                       prior: np.ndarray = None, randomShare: float = None, maxIterations: int = None,
+                       stoppingRules: evolution_utils.StoppingRules = None, report: dict = None,
+                       stats: profiling_utils.OptimizationStats = None,
+                       decimation: int = None, screening: evolution_utils.Screening = None,
+                       optimizer: search_utils.Optimizer = None, maxEvaluations: int = None,
+                       deadlineSeconds: float = None, checkpoint: checkpoint_utils.Checkpoint = None,
+                       resumeFrom: str = None) -> np.ndarray:
+        '''Optimizes the filter given input time and value data. The search can stop early at
+        a generation boundary, on the stopping rules, the evaluation budget or the deadline,
+        and returns the best gain found so far
 
         Args:
             t (np.ndarray) - time (in hours from first entry) values for the data
             y (np.ndarray) - biometric data values
+            workers (int) - number of processes to evaluate candidates across. The
+                candidates are evaluated in this process if None
+            seed (int) - seed for the random number generator, for repeatable runs
+            prior (np.ndarray) - previous optimal gain matrix to warm start around
+            randomShare (float) - share of a warm-started population drawn at random
+            maxIterations (int) - number of generations. Defaults to _max_iterations,
+                or _warmStartIterations when warm starting, for the default search, and to
+                no limit for an optimizer
+            stoppingRules (evolution_utils.StoppingRules) - convergence rules that can end
+                the optimization before maxIterations
+            report (dict) - if given, filled with the number of generations run and members
+                evaluated, the reason the optimization stopped, the best cost, the data it was
+                computed on as 'costResolution' ('full', or 'coarse' when the deadline left no
+                time for the full data) and the elapsed time
+            stats (profiling_utils.OptimizationStats) - if given, collects the time spent in
+                each stage, candidate counts and the costs of each generation
+            decimation (int) - if above 1, the first _coarseShare of the generations run on
+                the data decimated by this factor, and the rest refine the population on the
+                full data
+            screening (evolution_utils.Screening) - if given, the offspring of each generation
+                are screened on the most recent days of data before the full evaluation
+            optimizer (search_utils.Optimizer) - search engine, or the name of one in
+                search_utils.OPTIMIZERS, to run instead of the (mu+lambda) loop. It searches
+                the same log scale within its own evaluation budget
+            maxEvaluations (int) - evaluation budget, overriding the optimizer's. Unlimited for
+                the default search if None
+            deadlineSeconds (float) - wall-clock limit on the search. A generation only starts
+                if it is expected to finish within it. With decimation, the best coarse member
+                is returned if the population can't be evaluated on the full data in time
+            checkpoint (checkpoint_utils.Checkpoint) - if given, saves the state of the search
+                every few generations. It is removed once the search finishes, unless the
+                deadline stopped it
+            resumeFrom (str) - checkpoint of a run with the same data and options to continue
+                from, with the same result as if the run had never stopped. The search starts
+                over if there is no file there, or if it is from another filter or other data
+                or options
         Returns:
             L (np.ndarray) - optimal gain matrix
         '''
+        start = monotonic()
 
         # Random number generator for randomizing the combinations of population members
-        rng = np.random.default_rng()
+        rng = np.random.default_rng(seed)
 
         # # For testing a specific L against MATLAB values - correct as of 01/17/2022
         # L = np.array([[0], [.0086], [.0339]])
@@ -149,86 +242,296 @@ class ObserverBasedFilter:
         # print(np.absolute(np.linalg.eig(A)[0]) > 1)
         # print(self._checkStability(A))
 
-        # Create initial population for optimization
-        population = self._initializePopulation()
-        cost = np.zeros([self._mu, 1])
-        # avgCost = np.zeros([self._max_iterations, 1])
-        newGen = np.zeros([self._lambda, population.shape[1]])
-        newCost = np.zeros([self._lambda, 1])
-
-        # Generate sequential combinations of [1:mu]
-        combinations = np.array(list(itertools.combinations(range(0, self._mu ), self._rho)))
-
-        # Compute the original spectrum for calculating costs of filter outputs
-        originalSpectrum, f, _ = self._computeSpectrum(t, y)
-
-        # Compute costs of the initial population
-        for member in range(0, self._mu):
-            L = population[member, :].reshape(self._stateLength, 1)
-            A, B, C, D = self.createStateSpace(t, L)
-
-            # Only simulateDynamics if the system is stable
-            if not self._checkStability(A):
-                cost[member] = INT_MAX
-                continue
-            
-            # Simulate the system's dynamics and retain yHat
-            out = self.simulateDynamics(t, y, A, B, C, D)
-            # print(out.shape)
-            yHat = out[-1,:]
-
-            # Compute the output spectrum and corresponding cost
-            filteredSpectrum, _, _ = self._computeSpectrum(t, yHat)
-            filteredSpectrum = filteredSpectrum.reshape(originalSpectrum.shape)
-            cost[member] = self._computeCost(originalSpectrum, filteredSpectrum, f)
-        
-        # Run the optimization for _max_iterations
-        for iteration in range(0, self._max_iterations):
-            # Randomize the rows of combinations
-            # Noah's was repeating integers (bad because it would randomly give certain elements more weight than they might deserve)
-            # labels = np.random.randint(1, len(combinations), len(combinations)) 
-            labels = rng.choice(len(combinations), len(combinations), replace=False)
-
-            # Create _lambda new offspring and calculate their costs
-            for j in range(self._lambda):
-                # Create offspring with a random pair from combinations
-                newGen[j, :] = np.mean(population[combinations[labels[j], :], :], axis=0).reshape(1,self._stateLength)
-
-                # Create the state space with the new offspring
-                L = newGen[j, :].reshape(self._stateLength, 1)
-                A, B, C, D = self.createStateSpace(t, L)
-                
-                # Only simulateDynamics if the system is stable
-                if not self._checkStability(A):
-                    newCost[j] = INT_MAX
-                    continue
-                
-                # Simulate the system's dynamics and retain yHat
-                out = self.simulateDynamics(t, y, A, B, C, D)
-                yHat = out[-1,:]
-
-                # Compute the output spectrum and corresponding cost
-                filteredSpectrum, _, _ = self._computeSpectrum(t, yHat)
-                filteredSpectrum = filteredSpectrum.reshape(originalSpectrum.shape)
-                newCost[j] = self._computeCost(originalSpectrum, filteredSpectrum, f)
-            
-            # Append the newGen and newCost to allow us work on one array each
-            population = np.append(population, newGen, axis=0)
-            cost = np.append(cost, newCost)
-
-            # Remove the lambda highest costs from both cost and population
-            maxIndex = np.argpartition(cost, -self._lambda)[-self._lambda:]
-            
-            cost = np.delete(cost, maxIndex)
-            population = np.delete(population, maxIndex, axis=0)
-
-            # # Take the average cost - useful when trying to visualize
-            # avgCost[iteration] = np.mean(cost)
+        # Create initial population for optimization, around the prior if there is one
+        if prior is None:
+            population = self._initializePopulation(rng)
+        else:
+            population = self._initializeWarmPopulation(prior, rng, randomShare)
+
+        optimizer = search_utils.getOptimizer(optimizer)
+        if maxEvaluations is None and optimizer is not None:
+            maxEvaluations = optimizer.maxEvaluations
+        if maxIterations is None and optimizer is None:
+            maxIterations = self._max_iterations if prior is None else self._warmStartIterations
+
+        t = np.asarray(t, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        # Continue from the phase the checkpoint was saved in, if there is one. A
+        # checkpoint of another filter, other data or other options is ignored
+        isMultiResolution = decimation is not None and decimation > 1
+        fingerprint = cache_utils.optimizationKey(self, t, y, {
+            'seed': seed, 'prior': prior, 'randomShare': randomShare,
+            'maxIterations': maxIterations, 'stoppingRules': stoppingRules,
+            'decimation': decimation, 'screening': screening,
+            'optimizer': optimizer, 'maxEvaluations': maxEvaluations,
+        })
+        resume = None if resumeFrom is None else checkpoint_utils.loadCheckpoint(resumeFrom)
+        if resume is not None and resume['context'].get('fingerprint') != fingerprint:
+            resume = None
+        phase = None if resume is None else resume['phase']
+
+        # Set before the evaluators so worker processes get their own empty copy
+        self._stats = stats
+
+        # One pool of worker processes for every phase and data window
+        with parallel_utils.WorkerPool(self, workers) as pool:
+            # Run most generations on decimated data first, where each one is about
+            # [decimation] times cheaper. L is a continuous-time gain, so the same
+            # members apply at the coarser dt
+            coarseReport = {}
+            coarseCost = None
+            if isMultiResolution:
+                coarseIterations, maxIterations = search_utils.splitBudget(maxIterations,
+                                                                           self._coarseShare)
+                coarseEvaluations, maxEvaluations = search_utils.splitBudget(maxEvaluations,
+                                                                             self._coarseShare)
+                if phase == 'full':
+                    # The coarse generations had finished before the checkpoint
+                    coarseReport = resume['context']['coarseReport']
+                else:
+                    coarseDeadline = None
+                    if deadlineSeconds is not None:
+                        coarseDeadline = evolution_utils.Deadline(self._coarseShare*deadlineSeconds)
+                    if checkpoint is not None:
+                        checkpoint.setPhase('coarse', {'fingerprint': fingerprint})
+                    tCoarse, yCoarse = filter_utils.decimate(t, y, decimation)
+                    population, coarseCost = self._evolve(tCoarse, yCoarse, population, rng,
+                                                          coarseIterations, pool, stoppingRules,
+                                                          coarseReport, stats, screening,
+                                                          optimizer, coarseEvaluations,
+                                                          coarseDeadline, checkpoint,
+                                                          resume if phase == 'coarse' else None)
+
+            deadline = None
+            if deadlineSeconds is not None:
+                deadline = evolution_utils.Deadline(deadlineSeconds - (monotonic() - start))
+            runReport = {} if report is None else report
+            if (deadline is not None and coarseCost is not None
+                    and not self._evaluationFits(t, y, population, pool, decimation, deadline)):
+                # No time left to evaluate the population on the full data, so return the
+                # best coarse member, which needs no conversion as L is the same at any dt
+                cost = coarseCost
+                runReport.update({'generations': 0, 'evaluations': 0, 'stopReason': 'deadline',
+                                  'bestCost': coarseReport['bestCost'], 'costResolution': 'coarse'})
+            else:
+                if checkpoint is not None:
+                    checkpoint.setPhase('full', {'fingerprint': fingerprint,
+                                                'coarseReport': coarseReport})
+                population, cost = self._evolve(t, y, population, rng, maxIterations, pool,
+                                                stoppingRules, runReport, stats, screening,
+                                                optimizer, maxEvaluations, deadline,
+                                                checkpoint, resume if phase == 'full' else None)
+                runReport['costResolution'] = 'full'
+        if coarseReport:
+            runReport['coarseGenerations'] = coarseReport['generations']
+            runReport['coarseBestCost'] = coarseReport['bestCost']
+            runReport['generations'] += coarseReport['generations']
+            runReport['evaluations'] += coarseReport['evaluations']
+        runReport['elapsedSeconds'] = monotonic() - start
+
+        # A search stopped by the deadline can still be resumed to refine it
+        if checkpoint is not None and runReport['stopReason'] != 'deadline':
+            checkpoint.clear()
+
+        # Release the simulation output buffer, the stats collector and the
+        # cached powers of the gap dynamics
+        self._outputs = None
+        self._stats = None
+        simulation_utils.clearPowerCache()
 
         # Return the best gain in the final population as L
         idx = np.argmin(cost)
         return population[idx, :].reshape(1, self._stateLength) # Returning this shape to ease Kotlin PyObject conversion
             
+    def _evolve(self, t: np.ndarray, y: np.ndarray, population: np.ndarray, rng: np.random.Generator,
+                maxIterations: int, pool: parallel_utils.WorkerPool, stoppingRules: evolution_utils.StoppingRules,
+                report: dict, stats: profiling_utils.OptimizationStats,
+                screening: evolution_utils.Screening = None, optimizer: search_utils.Optimizer = None,
+                maxEvaluations: int = None, deadline: evolution_utils.Deadline = None,
+                checkpoint: checkpoint_utils.Checkpoint = None,
+                resume: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+            Runs the evolution loop, or [optimizer], on one series of data
+            Args:
+                pool (parallel_utils.WorkerPool) - worker processes of the optimization, shared
+                    by the evaluators of every data window
+                screening (evolution_utils.Screening) - screens the offspring on the most
+                    recent windows of the data before evaluating them on all of it
+                optimizer (search_utils.Optimizer) - search engine to run instead of the
+                    evolution loop
+                maxEvaluations (int) - evaluation budget
+                deadline (evolution_utils.Deadline) - wall-clock limit
+                checkpoint (checkpoint_utils.Checkpoint) - saves the state of the search every
+                    few generations
+                resume (dict) - state loaded from a checkpoint to continue from
+            Returns:
+                population (np.ndarray) - final population
+                cost (np.ndarray) - cost of each member of the final population
+        '''
+        # One evaluator for the data and each screening window, shortest first
+        windows = [] if screening is None else screening.windowLengths(t[1] - t[0], len(y))
+        with contextlib.ExitStack() as stack:
+            evaluators = []
+            for length in windows + [len(y)]:
+                tWindow, yWindow = t[-length:], y[-length:]
+
+                # Compute the original spectrum for calculating costs of filter outputs
+                with profiling_utils.stage(stats, 'originalSpectrum'):
+                    originalSpectrum, f, _ = self._computeSpectrum(tWindow, yWindow)
+                evaluators.append(stack.enter_context(parallel_utils.PopulationEvaluator(
+                    self, pool, t=tWindow, y=yWindow, originalSpectrum=originalSpectrum, f=f
+                )).evaluate)
+
+            evaluateOffspring = None
+            if screening is not None:
+                evaluateOffspring = screening.wrap(evaluators[:-1], evaluators[-1], stats,
+                                                   [length/len(y) for length in windows])
+
+            if optimizer is not None:
+                return optimizer.optimize(evaluators[-1], population, self._searchSpace(), rng,
+                                          maxIterations, maxEvaluations, stoppingRules, report,
+                                          stats, evaluateOffspring, deadline, checkpoint, resume)
+
+            return evolution_utils.evolve(
+                evaluators[-1], population, rng, self._lambda, self._rho,
+                maxIterations, stoppingRules, self._toLogScale, report, stats, evaluateOffspring,
+                maxEvaluations, deadline, checkpoint, resume
+            )
+
+    def _evaluationFits(self, t: np.ndarray, y: np.ndarray, population: np.ndarray,
+                        pool: parallel_utils.WorkerPool, decimation: int,
+                        deadline: evolution_utils.Deadline) -> bool:
+        '''Whether evaluating the population on the full data fits before the deadline
+
+        The decimated data can have no gaps where the full data does, so the time of the
+        coarse generations says little about the full ones. Members are instead timed on
+        the most recent 1/decimation^2, then 1/decimation, of the data, each time only if
+        the last one predicts it fits, and the time is scaled up to the full population
+        and length.
+
+        Args:
+            t (np.ndarray) - time (in hours from first entry) for the data
+            y (np.ndarray) - biometric data
+            population (np.ndarray) - gains L, one per row
+            pool (parallel_utils.WorkerPool) - worker processes of the optimization
+            decimation (int) - decimation factor of the coarse phase
+            deadline (evolution_utils.Deadline) - wall-clock limit
+        Returns:
+            fits (bool) - whether the evaluation is expected to finish in time
+        '''
+        # Probes of (members, samples), each started only if the last one predicts it fits:
+        # one member, to bound the population's, then the population on the shorter and the
+        # longer window
+        shortLength = max(2, len(y)//decimation**2)
+        probes = [(1, shortLength), (len(population), shortLength),
+                  (len(population), max(2, len(y)//decimation))]
+        seconds = 0
+        for members, length in probes:
+            if not deadline.allows(seconds*members*length/(len(population)*len(y))):
+                return False
+            start = monotonic()
+            tWindow, yWindow = t[-length:], y[-length:]
+            originalSpectrum, f, _ = self._computeSpectrum(tWindow, yWindow)
+            with parallel_utils.PopulationEvaluator(self, pool, t=tWindow, y=yWindow,
+                                                    originalSpectrum=originalSpectrum,
+                                                    f=f) as evaluator:
+                evaluator.evaluate(population[:members])
+            # Estimated time of the population on the full data
+            seconds = (monotonic() - start)*len(population)*len(y)/(members*length)
+
+        return deadline.allows(seconds)
+
+    def _evaluatePopulation(self, t: np.ndarray, y: np.ndarray, population: np.ndarray,
+                            originalSpectrum: np.ndarray, f: np.ndarray) -> np.ndarray:
+        '''
+            Computes the cost of every gain in the population. The stable members are
+            simulated together and their output spectra come from one FFT call. If the
+            data has no gaps, the spectra come from each member's transfer function instead
+            Args:
+                t (np.ndarray) - time (in hours from first entry) values for the data
+                y (np.ndarray) - biometric data values
+                population (np.ndarray) - gains to evaluate, one per row
+                originalSpectrum (np.ndarray) - frequency spectrum of the original signal
+                f (np.ndarray) - frequency values corresponding to originalSpectrum
+            Returns:
+                cost (np.ndarray) - cost of each member, INT_MAX for unstable members
+        '''
+        stats = self._stats
+        cost = np.full(len(population), float(INT_MAX))
+
+        # Discretize every member and keep the stable ones
+        with profiling_utils.stage(stats, 'discretization'):
+            A, B, C, D = self.createStateSpaceBatch(t, population)
+        with profiling_utils.stage(stats, 'stability'):
+            isStable = filter_utils.checkStabilityBatch(A)
+        if stats is not None:
+            stats.count('evaluated', len(population))
+            stats.count('unstable', len(population) - np.count_nonzero(isStable))
+
+        if not np.any(isStable):
+            return cost
+
+        y = np.asarray(y, dtype=float)
+        u = np.zeros(len(y))
+        u[1:] = y[:-1]
+        x0 = np.zeros(self._stateLength)
+        x0[self._stateLength-1] = 70
+        members = np.flatnonzero(isStable)
+        isComputed = np.zeros(len(members), dtype=bool)
+        costPlan = self._createCostPlan(len(t), t[1] - t[0])
+
+        # Without gaps every member is time invariant, so its output spectrum comes
+        # straight from its transfer function on the FFT grid without simulating
+        if np.all(u[1:] != 0):
+            with profiling_utils.stage(stats, 'transferFunction'):
+                Y, isComputed = filter_utils.computeOutputDFT(A[members], B[members], C, x0, u)
+            with profiling_utils.stage(stats, 'cost'):
+                filteredSpectra = filter_utils.singleSidedSpectrum(
+                    Y[isComputed, 0:len(originalSpectrum)], len(y)
+                )
+                cost[members[isComputed]] = costPlan.computeCost(originalSpectrum, filteredSpectra)
+
+        # Simulate the remaining members' dynamics together and compute the cost of yHat
+        if not np.all(isComputed):
+            simulated = members[~isComputed]
+            if self._outputs is None:
+                self._outputs = simulation_utils.OutputBuffer()
+            with profiling_utils.stage(stats, 'simulation'):
+                yHat = simulation_utils.simulateSwitchedBatch(
+                    x0, A[simulated], B[simulated], self.autonomousDynamics(t), u, u != 0, C,
+                    out=self._outputs.get((len(simulated), len(u)))
+                )
+            cost[simulated] = self._computeOutputCost(t, yHat, originalSpectrum, costPlan)
+
+        return cost
+
+    def _computeOutputCost(self, t: np.ndarray, yHat: np.ndarray, originalSpectrum: np.ndarray,
+                           costPlan: filter_utils.CostPlan) -> np.ndarray:
+        '''
+            Computes the cost of filter outputs with the selected spectral cost
+            Args:
+                t (np.ndarray) - time (in hours from first entry) values for the data
+                yHat (np.ndarray) - filter output, or one output per row
+                originalSpectrum (np.ndarray) - frequency spectrum of the original signal
+                costPlan (filter_utils.CostPlan) - plan for the cost on this frequency grid
+            Returns:
+                cost (np.ndarray) - cost of each output
+        '''
+        # The transforms are timed apart from the weighted sums of the cost
+        if self._spectralCost == 'parseval':
+            with profiling_utils.stage(self._stats, 'fft'):
+                power = costPlan.partialDFTPower(yHat)
+            with profiling_utils.stage(self._stats, 'cost'):
+                return costPlan.computeSignalCost(originalSpectrum, yHat, power)
+        elif self._spectralCost != 'fft':
+            raise ValueError(f"Unknown spectral cost '{self._spectralCost}'")
+
+        with profiling_utils.stage(self._stats, 'fft'):
+            filteredSpectrum, _, _ = self._computeSpectrum(t, yHat)
+        with profiling_utils.stage(self._stats, 'cost'):
+            return costPlan.computeCost(originalSpectrum, filteredSpectrum)
+
     def createStateSpace(self, t:np.ndarray, L: np.ndarray):
         '''Creates discrete-time state space given the time vector and gain matrix.
 
@@ -241,44 +544,138 @@ class ObserverBasedFilter:
                 C (np.ndarray) - discrete-time C matrix
                 D (np.ndarray) - discrete-time D matrix
         '''
-        
-        L = np.array(L).reshape(self._stateLength, 1)       # Ensure L is an np array of correct dimension
+        A, B, C, D = self.createStateSpaceBatch(t, np.reshape(L, (1, self._stateLength)))
+
+        return A[0], B[0].reshape(self._stateLength, 1), C, D
+
+    def createStateSpaceBatch(self, t: np.ndarray, L: np.ndarray):
+        '''Creates the discrete-time state spaces of a stack of gains at once.
+
+            Each member's continuous system (Ac - L Cc, L, Cc, 0) is discretized with a zero-order
+            hold, like scipy's StateSpace.to_discrete, through the exponential of the augmented
+            matrix [[Ac - L Cc, L], [0, 0]]*dt. The gain-independent parts are cached per (order, dt)
+            and all the exponentials are taken in one batched call
+
+            Args:
+                t (np.ndarray) - time (in hours from first entry) values for the data
+                L (np.ndarray) - gains, one per row
+            Returns:
+                A (np.ndarray) - (numMembers, s, s) discrete-time A matrices
+                B (np.ndarray) - (numMembers, s) discrete-time B vectors
+                C (np.ndarray) - discrete-time C matrix shared by every member
+                D (np.ndarray) - discrete-time D matrix shared by every member
+        '''
+        dt = float(t[1] - t[0])    # Sampling time for discretization
+        augmented, Cc, _ = self._stateSpaceTemplate(self._order, dt)
+        L = np.reshape(np.asarray(L, dtype=float), (-1, self._stateLength))
+        s = self._stateLength
+
+        # Fill each member's gain into the augmented matrix
+        M = np.empty((len(L),) + augmented.shape)
+        M[:] = augmented
+        M[:, :s, :s] -= dt*L[:, :, None]*Cc
+        M[:, :s, s] = dt*L
+
+        discrete = filter_utils.expmBatch(M)
 
-        Ac = np.zeros([self._stateLength, self._stateLength])
-        Cc = np.zeros([1, self._stateLength])
-        Dc = 0
+        return discrete[:, :s, :s], discrete[:, :s, s], Cc.copy(), np.zeros([1, 1])
+
+    def autonomousDynamics(self, t: np.ndarray) -> np.ndarray:
+        '''Returns the discrete-time dynamics the filter runs across gaps in the data.
+
+            Args:
+                t (np.ndarray) - time (in hours from first entry) values for the data
+            Returns:
+                A_auto (np.ndarray) - discrete-time autonomous A matrix
+        '''
+        return self._stateSpaceTemplate(self._order, float(t[1] - t[0]))[2]
+
+    @classmethod
+    @lru_cache(maxsize=8)
+    def _stateSpaceTemplate(cls, order: int, dt: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            Builds the gain-independent parts of the state space for one (order, dt). The
+            arrays are shared between calls, so they are made read-only
+            Args:
+                order (int) - number of harmonics in the filter
+                dt (float) - sampling time
+            Returns:
+                augmented (np.ndarray) - [[Ac, 0], [0, 0]]*dt, to fill the gain into
+                Cc (np.ndarray) - continuous-time C matrix
+                A_auto (np.ndarray) - discrete-time autonomous A matrix, expm(Ac*dt)
+        '''
+        stateLength = 2*order + 1
+        Ac = np.zeros([stateLength, stateLength])
+        Cc = np.zeros([1, stateLength])
 
         # Populate State matrices in slices.
-        for k in range(self._order):
+        for k in range(order):
             i = (1 + k) * 2
             k = k + 1 #handles the one off error
-            Ac[i - 2:i, i - 2:i] = [[0, 1], [float(-(k * self._omg) ** 2), 0]]
-            Cc[0][i-1] = (2 * self._zeta) / (k * self._omg)
+            Ac[i - 2:i, i - 2:i] = [[0, 1], [float(-(k * cls._omg) ** 2), 0]]
+            Cc[0][i-1] = (2 * cls._zeta) / (k * cls._omg)
 
         # Assign edge values.
-        Cc[0][len(Cc[0])-1] = 1
+        Cc[0][stateLength-1] = 1
 
-        A = (Ac - L*Cc)
-        B = L
-        C = Cc
-        D = Dc
+        augmented = np.zeros([stateLength+1, stateLength+1])
+        augmented[:stateLength, :stateLength] = Ac*dt
+        A_auto = expm(Ac*dt)
 
-        # Uses the "scipy" library and converts the continuous matrixes into a SS
-        #   -Then takes the continuous system and decritizes it (NOTE: method for c2d may not match model)
-        dt = t[1] - t[0]    # Sampling time for discretization
-        discSystem = signal.StateSpace(A, B, C, D).to_discrete(dt)
+        for array in (augmented, Cc, A_auto):
+            array.setflags(write=False)
 
-        # Return the discrete system because we're only using discrete for the app 
-        return discSystem.A, discSystem.B, discSystem.C, discSystem.D
+        return augmented, Cc, A_auto
 
-    def _initializePopulation(self):
+    def _initializePopulation(self, rng: np.random.Generator = None):
         '''
             Creates the initial population using a log scale sampling (detailed in README and paper)
+            Args:
+                rng (np.random.Generator) - random number generator to sample with
+            Returns:
+                population (np.ndarray) - the initial population to use in the filter optimization
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+
+        N = (self._rEnd-self._lStart)*rng.random((self._mu, self._stateLength)) + self._lStart
+
+        return self._fromLogScale(N)
+
+    def _initializeWarmPopulation(self, prior: np.ndarray, rng: np.random.Generator = None,
+                                  randomShare: float = None):
+        '''
+            Creates a population concentrated around a previous optimal gain. The prior
+            itself is kept, most members perturb it on the same log scale the random
+            population is drawn on, and a share of the members is drawn at random for diversity
+            Args:
+                prior (np.ndarray) - previous optimal gain matrix
+                rng (np.random.Generator) - random number generator to sample with
+                randomShare (float) - share of the population drawn at random
             Returns:
                 population (np.ndarray) - the initial population to use in the filter optimization
         '''
-        N = (self._rEnd-self._lStart)*np.random.rand(self._mu, self._stateLength) + self._lStart
+        if rng is None:
+            rng = np.random.default_rng()
+        if randomShare is None:
+            randomShare = self._warmStartRandomShare
+
+        prior = np.reshape(np.asarray(prior, dtype=float), (-1))
+        numRandom = int(round(self._mu*randomShare))
+        numWarm = self._mu - numRandom
+
+        N = self._toLogScale(prior) + self._warmStartSpread*rng.standard_normal((numWarm, self._stateLength))
+        warm = self._fromLogScale(np.clip(N, self._lStart, self._rEnd))
+        if numWarm > 0:
+            warm[0] = prior
+
+        return np.append(warm, self._initializePopulation(rng)[:numRandom], axis=0)
 
+    def _fromLogScale(self, N: np.ndarray) -> np.ndarray:
+        '''
+            Maps log-scale samples to gains. Samples above _mid give positive gains, those
+            below give negative ones, and those near _mid give zero
+        '''
         diff = 0.5 
 
         population = np.zeros(N.shape)
@@ -286,13 +683,31 @@ class ObserverBasedFilter:
         population[N < self._mid-diff] = -10**(self._mid - N[N < self._mid-diff] + self._LB)
         
         return population
+
+    def _toLogScale(self, L: np.ndarray) -> np.ndarray:
+        '''
+            Maps gains back to the log scale of _fromLogScale
+        '''
+        N = np.full(np.shape(L), float(self._mid))
+        N[L > 0] = np.log10(L[L > 0]) + self._mid - self._LB
+        N[L < 0] = self._mid + self._LB - np.log10(-L[L < 0])
+
+        return N
     
+    def _searchSpace(self) -> search_utils.SearchSpace:
+        '''
+            Gets the log-scale box the gains are sampled in
+        '''
+        return search_utils.SearchSpace(self._fromLogScale, self._toLogScale,
+                                        np.full(self._stateLength, float(self._lStart)),
+                                        np.full(self._stateLength, float(self._rEnd)))
+
     def _computeSpectrum(self, t: np.ndarray, y: np.ndarray) -> np.ndarray:
         '''
             Computes the frequency spectrum of the input [y] sampled according to [t]
             Args:
                 t (np.ndarray) - time values for the data
-                y (np.ndarray) - biometric data values
+                y (np.ndarray) - biometric data values, or one signal per row
             Returns:
                 P (np.ndarray) - Single-sided frequency spectrum of the data
                 f (np.ndarray) - Frequency values corresponding to [P]
@@ -301,10 +716,8 @@ class ObserverBasedFilter:
         T = t[1] - t[0]
         Fs = 1/T
         lent = len(t)
-        Y = fft(y)
-        P2 = abs(Y / lent)
-        P = P2[0:floor(lent/2)]
-        P[1:len(P)-1] = 2*P[1:len(P)-1]
+        Y = fft(y, axis=-1)
+        P = filter_utils.singleSidedSpectrum(Y[..., 0:floor(lent/2)], lent)
         f = Fs*np.arange(0, floor(lent/2))/lent
 
         return P, f, lent
@@ -318,6 +731,7 @@ class ObserverBasedFilter:
                 f (np.ndarray) - frequency values corresponding to originalSpectrum
             Returns:
                 cost (float) - the cost of the filteredSpectrum - discrepancy from originalSpectrum
+            The optimization evaluates the same cost through _createCostPlan
         '''
         N1 = np.argmin(abs(f - (1/24)))
         N2 = np.argmin(abs(f - (0.0289)))
@@ -331,6 +745,31 @@ class ObserverBasedFilter:
 
         return J_harmo + J_noise
     
+    @classmethod
+    @lru_cache(maxsize=8)
+    def _createCostPlan(cls, lent: int, dt: float) -> filter_utils.CostPlan:
+        '''
+            Creates the plan that evaluates _computeCost on one frequency grid, so the
+            harmonic bins are found once per optimization instead of once per member
+            Args:
+                lent (int) - length of the time vector
+                dt (float) - sampling time
+            Returns:
+                plan (filter_utils.CostPlan) - bin weights matching _computeCost
+        '''
+        f = (1/dt)*np.arange(0, floor(lent/2))/lent
+        N1 = np.argmin(abs(f - (1/24)))
+        N2 = np.argmin(abs(f - (0.0289)))
+        NN = N1 - N2
+
+        plan = filter_utils.CostPlan(floor(lent/2), lent)
+        plan.addHarmonicBand(0, NN)
+        plan.addHarmonicBand(N1-NN, N1+NN+1)
+        plan.addNoiseBand(NN+1, N1-NN)
+        plan.addOriginalBand(N1+NN+1, None)
+
+        return plan
+
     def _checkStability(self, A) -> bool:
         '''
             Checks if the dynamics are stable by making sure the eigenvalues are in the 
@@ -341,7 +780,4 @@ class ObserverBasedFilter:
                 isStable (bool) - whether the dynamics are stable or not
         '''
         # If any eigenvalue magnitude is greater than 1, not stable
-        if np.sum(np.absolute(np.linalg.eig(A)[0]) > 1) > 0:
-            return False
-        else:
-            return True
\ No newline at end of file
+        return bool(filter_utils.checkStabilityBatch(np.reshape(A, (1,) + np.shape(A)))[0])
\ No newline at end of file
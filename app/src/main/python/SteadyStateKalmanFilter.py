@@ -5,12 +5,19 @@ Author - Chukwuemeka Osaretin Ike
 
 Description:
 '''
-import itertools
+import cache_utils
+import checkpoint_utils
+import contextlib
 import numpy as np
+import evolution_utils
 import filter_utils
+import parallel_utils
+import profiling_utils
+import search_utils
+import simulation_utils
 
 from scipy import signal
-from scipy.linalg import solve_discrete_are
+from time import monotonic
 from typing import Tuple
 
 
@@ -33,6 +40,17 @@ class SteadyStateKalmanFilter:
     _lambda = 50
     _rho = 2
 
+    # Spectral cost of simulated outputs: 'fft' computes the full spectrum,
+    # 'parseval' only the bins the cost needs (see filter_utils.CostPlan).
+    _spectralCost = 'fft'
+
+    # Riccati solver of the population evaluation: 'scipy' solves each member
+    # with solve_discrete_are, 'doubling' the whole population at once (see
+    # filter_utils.solveDiscreteAREBatch). 'scipy' is the default because
+    # doubling accepts some members solve_discrete_are fails on and moves
+    # some costs by ~1e-6, so it does not reproduce the original results.
+    _riccatiSolver = 'scipy'
+
     # Bounds on the parameters used for optimization.
     _qLB = -5      # Q lower bound - 10^qLB.
     _qLEnd = 0     # Q lower end.
@@ -40,24 +58,122 @@ class SteadyStateKalmanFilter:
     _rLB = 1e2     # R lower bound.
     _rUB = 1e8     # R upper bound.
 
-    def initializePopulation(self) -> Tuple[np.ndarray]:
+    # Warm start around a previous optimum.
+    _warmStartIterations = 10    # Generations when starting from a prior.
+    _warmStartRandomShare = 0.2  # Share of the population drawn at random.
+    _warmStartSpread = 0.5       # Std. dev. of the log-scale perturbations.
+
+    # Multi-resolution optimization.
+    _coarseShare = 0.8  # Share of the generations run on decimated data.
+
+    # Output buffer reused by the simulations of an optimization, and the
+    # optional profiling_utils.OptimizationStats collector of one.
+    _outputs = None
+    _stats = None
+
+    def initializePopulation(self, rng: np.random.Generator = None) -> Tuple[np.ndarray]:
         '''Creates the initial Q and R populations for the optimization.
+        Args:
+            rng: random number generator to sample with.
         Returns:
             Q_pop: population of Q covariance matrices.
             R_pop: population of R covariance values.
         '''
         qSize = self._stateLength**2
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        N = (self._qREnd-self._qLEnd)*rng.random((self._mu, qSize)) + self._qLEnd
+        Q_pop = self._qFromLogScale(N)
+
+        R_pop = (self._rLB + (self._rUB - self._rLB)*rng.random((self._mu, 1)))
+
+        return Q_pop, R_pop
+
+    def initializeWarmPopulation(self, prior: np.ndarray, rng: np.random.Generator = None,
+                                 randomShare: float = None) -> Tuple[np.ndarray]:
+        '''Creates Q and R populations concentrated around a previous optimum.
+
+        The prior itself is kept, most members perturb it on the same log scale
+        the random population is drawn on, and a share of the members is drawn
+        at random for diversity.
+        Args:
+            prior: previous optimal [Q | R] parameters.
+            rng: random number generator to sample with.
+            randomShare: share of the population drawn at random.
+        Returns:
+            Q_pop: population of Q covariance matrices.
+            R_pop: population of R covariance values.
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        if randomShare is None:
+            randomShare = self._warmStartRandomShare
+
+        prior = np.reshape(np.asarray(prior, dtype=float), (-1))
+        numRandom = int(round(self._mu*randomShare))
+        numWarm = self._mu - numRandom
+
+        # Perturb Q on its log scale and R by a log-normal factor.
+        N = self._qToLogScale(prior[:-1]) +\
+            self._warmStartSpread*rng.standard_normal((numWarm, len(prior)-1))
+        Q_warm = self._qFromLogScale(np.clip(N, self._qLEnd, self._qREnd))
+        R_warm = np.clip(
+            prior[-1]*10**(self._warmStartSpread*rng.standard_normal((numWarm, 1))),
+            self._rLB, self._rUB
+        )
+        if numWarm > 0:
+            Q_warm[0] = prior[:-1]
+            R_warm[0] = prior[-1]
+
+        Q_pop, R_pop = self.initializePopulation(rng)
+
+        return (np.append(Q_warm, Q_pop[:numRandom], axis=0),
+                np.append(R_warm, R_pop[:numRandom], axis=0))
+
+    def _qFromLogScale(self, N: np.ndarray) -> np.ndarray:
+        '''Maps log-scale samples to Q values.
+
+        Samples above the middle of [qLEnd, qREnd] give positive values,
+        those below give negative ones, and those near the middle give zero.
+        '''
         mid = (self._qREnd + self._qLEnd)/2
         diff = 0.5
 
-        N = (self._qREnd-self._qLEnd)*np.random.rand(self._mu, qSize) + self._qLEnd
-        Q_pop = np.zeros(N.shape)
-        Q_pop[N > mid+diff] = 10**(N[N > mid+diff] - mid + self._qLB)
-        Q_pop[N < mid-diff] = -10**(mid - N[N < mid-diff] + self._qLB)
+        Q = np.zeros(N.shape)
+        Q[N > mid+diff] = 10**(N[N > mid+diff] - mid + self._qLB)
+        Q[N < mid-diff] = -10**(mid - N[N < mid-diff] + self._qLB)
 
-        R_pop = (self._rLB + (self._rUB - self._rLB)*np.random.rand(self._mu, 1))
+        return Q
 
-        return Q_pop, R_pop
+    def _qToLogScale(self, Q: np.ndarray) -> np.ndarray:
+        '''Maps Q values back to the log scale of [_qFromLogScale].'''
+        mid = (self._qREnd + self._qLEnd)/2
+        N = np.full(np.shape(Q), mid)
+        N[Q > 0] = np.log10(Q[Q > 0]) + mid - self._qLB
+        N[Q < 0] = mid + self._qLB - np.log10(-Q[Q < 0])
+
+        return N
+
+    def _searchCoordinates(self, population: np.ndarray) -> np.ndarray:
+        '''Maps [Q | R] members to the log scales they are sampled on.'''
+        return np.append(
+            self._qToLogScale(population[:, :-1]), np.log10(population[:, -1:]), axis=1
+        )
+
+    def _fromSearchCoordinates(self, N: np.ndarray) -> np.ndarray:
+        '''Maps log-scale coordinates back to [Q | R] members.'''
+        return np.append(self._qFromLogScale(N[:, :-1]), 10**N[:, -1:], axis=1)
+
+    def _searchSpace(self) -> search_utils.SearchSpace:
+        '''Gets the log-scale box the [Q | R] members are sampled in.'''
+        qSize = self._stateLength**2
+        return search_utils.SearchSpace(
+            self._fromSearchCoordinates, self._searchCoordinates,
+            np.append(np.full(qSize, float(self._qLEnd)), np.log10(self._rLB)),
+            np.append(np.full(qSize, float(self._qREnd)), np.log10(self._rUB))
+        )
 
     def createStateSpace(self, t: np.ndarray) -> Tuple[np.ndarray]:
         '''Creates discrete-time state space given the time vector.
@@ -90,7 +206,8 @@ class SteadyStateKalmanFilter:
         return discSystem.A, discSystem.B, discSystem.C, discSystem.D
 
     def simulateDynamics(self, A: np.ndarray, C: np.ndarray,
-                         L: np.ndarray, y: np.ndarray
+                         L: np.ndarray, y: np.ndarray, out: np.ndarray = None,
+                         yHatOnly: bool = False, backend: str = None
         ) -> np.ndarray:
         '''Simulates the system dynamics on the input data [y].
         Args:
@@ -98,126 +215,496 @@ class SteadyStateKalmanFilter:
             C: discrete-time C matrix.
             L (np.ndarray) - gain matrix 
             y: biometric data values.
+            out: optional (stateLength+1, len(y)) array to write the
+                output into, of any float dtype, or (len(y),) with yHatOnly.
+            yHatOnly: keep only the current state and return just yHat.
+            backend: simulation backend (see simulation_utils). Defaults to
+                the SENSE_SIMULATION_BACKEND environment variable.
         Returns:
             filterOutput(np.ndarray) - contains [xHat; yHat]:
                 xHat (np.ndarray) - filter state estimates 
                 yHat (np.ndarray) - filter output
         '''
-        inputLength = len(y)
-        xHat = np.zeros([self._stateLength, inputLength])
-        xHat[-1, 0] = np.mean(y) # Set the first bias term to the mean y value.
-
-        # Run the system step-by-step. If a y value is zero, run autonomously.
-        for i in range(1, inputLength):
-            # The reshapes are all to make sure it's the right shape.
-            if y[i] == 0:
-                xHat[:, i] = np.reshape(np.dot(A, xHat[:, i-1]), (self._stateLength))
-            else:
-                xHat[:, i] = np.reshape(np.dot((A - np.dot(L, C)), xHat[:, i-1]), (-1)) +\
-                      np.reshape(L*y[i-1], (-1))
+        y = np.asarray(y, dtype=float)
+        return self._simulateFrom(A, C, L, self._initialState(y), y, out, yHatOnly, backend)
 
-        # Multiply the filter state evolution by the C matrix to give us the output.
-        yHat = np.matmul(C, xHat)
+    def advanceDynamics(self, A: np.ndarray, C: np.ndarray, L: np.ndarray,
+                        lastState: np.ndarray, lastY: float, y: np.ndarray
+        ) -> np.ndarray:
+        '''Continues a simulation from its final state over newly arrived data.
 
-        return np.append(xHat, yHat, axis=0)
+        Gives the same outputs as simulating the old and new data together,
+        while only simulating the new data.
+        Args:
+            A: discrete-time A matrix.
+            C: discrete-time C matrix.
+            L (np.ndarray) - gain matrix 
+            lastState: final xHat column of the previous simulation.
+            lastY: last biometric data value of the previous simulation.
+            y: new biometric data values.
+        Returns:
+            filterOutput(np.ndarray) - contains [xHat; yHat] for the new data.
+        '''
+        y = np.append(float(lastY), np.asarray(y, dtype=float))
+        xHat0 = np.reshape(np.asarray(lastState, dtype=float), (-1))
 
+        return self._simulateFrom(A, C, L, xHat0, y)[:, 1:]
 
-    def optimizeFilter(self, time: np.ndarray, y: np.ndarray) -> np.ndarray:
+    def _simulateFrom(self, A: np.ndarray, C: np.ndarray, L: np.ndarray,
+                      xHat0: np.ndarray, y: np.ndarray, out: np.ndarray = None,
+                      yHatOnly: bool = False, backend: str = None) -> np.ndarray:
+        '''Simulates the system dynamics on [y] from the state [xHat0] at y[0].
+        Args:
+            A: discrete-time A matrix.
+            C: discrete-time C matrix.
+            L (np.ndarray) - gain matrix 
+            xHat0: filter state at the first data value.
+            y: biometric data values.
+            out: optional array to write the output into.
+            yHatOnly: keep only the current state and return just yHat.
+            backend: simulation backend name.
+        Returns:
+            filterOutput(np.ndarray) - contains [xHat; yHat], or yHat alone.
+        '''
+        # Run the system one run of data or gap at a time. If a y value is
+        # zero, run autonomously; otherwise apply the gain to the previous y.
+        u = np.zeros(len(y))
+        u[1:] = y[:-1]
+        if yHatOnly:
+            return simulation_utils.simulateOutput(
+                xHat0, A - np.dot(L, C), L, A, u, y, C, out, backend
+            )
+
+        xHat = simulation_utils.simulate(
+            xHat0, A - np.dot(L, C), L, A, u, y, backend
+        )
+
+        # Write the states and, through the C matrix, the output in place.
+        if out is None:
+            out = np.empty([self._stateLength+1, len(y)])
+        out[:-1] = xHat
+        np.matmul(C, xHat, out=out[-1:])
+
+        return out
+
+    def optimizeFilter(self, time: np.ndarray, y: np.ndarray,
+                       workers: int = None, seed: int = None,
+                       prior: np.ndarray = None, randomShare: float = None,
+                       maxIterations: int = None,
+                       stoppingRules: evolution_utils.StoppingRules = None,
+                       report: dict = None,
+                       stats: profiling_utils.OptimizationStats = None,
+                       decimation: int = None,
+                       screening: evolution_utils.Screening = None,
+                       optimizer: search_utils.Optimizer = None,
+                       maxEvaluations: int = None,
+                       deadlineSeconds: float = None,
+                       checkpoint: checkpoint_utils.Checkpoint = None,
+                       resumeFrom: str = None) -> np.ndarray:
         '''Optimizes the filter given input time and biometric data.
 
+        The search can stop early at a generation boundary, on the stopping
+        rules, the evaluation budget or the deadline, and returns the best
+        member found so far.
+
         Args:
             time: time (in hours from first entry) for the data.
             y: biometric data.
+            workers: number of processes to evaluate candidates across. The
+                candidates are evaluated in this process if None.
+            seed: seed for the random number generator, for repeatable runs.
+            prior: previous optimal [Q | R] parameters to warm start around.
+            randomShare: share of a warm-started population drawn at random.
+            maxIterations: number of generations. Defaults to _max_iterations,
+                or _warmStartIterations when warm starting, for the default
+                search, and to no limit for an optimizer.
+            stoppingRules: convergence rules that can end the optimization
+                before maxIterations.
+            report: if given, filled with the number of generations run and
+                members evaluated, the reason the optimization stopped, the
+                best cost, the data it was computed on as 'costResolution'
+                ('full', or 'coarse' when the deadline left no time for the
+                full data) and the elapsed time.
+            stats: if given, collects the time spent in each stage, candidate
+                counts and the costs of each generation.
+            decimation: if above 1, the first _coarseShare of the generations
+                run on the data decimated by this factor, and the rest refine
+                the population on the full data.
+            screening: if given, the offspring of each generation are screened
+                on the most recent days of data before the full evaluation.
+            optimizer: search engine, or the name of one in
+                search_utils.OPTIMIZERS, to run instead of the (mu+lambda)
+                loop. It searches the same log scales within its own
+                evaluation budget.
+            maxEvaluations: evaluation budget, overriding the optimizer's.
+                Unlimited for the default search if None.
+            deadlineSeconds: wall-clock limit on the search. A generation only
+                starts if it is expected to finish within it. With decimation,
+                the best coarse member is returned if the population can't be
+                evaluated on the full data in time.
+            checkpoint: if given, saves the state of the search every few
+                generations. It is removed once the search finishes, unless
+                the deadline stopped it.
+            resumeFrom: checkpoint of a run with the same data and options to
+                continue from, with the same result as if the run had never
+                stopped. The search starts over if there is no file there, or
+                if it is from another filter or other data or options.
         Returns:
-            L: optimal gain matrix
+            filterParams: optimal [Q | R] parameters.
         '''
-        # Random number generator for randomizing the combinations of population members.
-        rng = np.random.default_rng()
-        Q_pop, R_pop = self.initializePopulation()
-
-        Cost = np.zeros([self._mu, 1])
-        # avgCost = np.zeros([self._max_iterations, 1])
-        newQGen = np.zeros([self._lambda, Q_pop.shape[1]])
-        newRGen = np.zeros([self._lambda, 1])
-        newCost = np.zeros([self._lambda, 1])
-
-        # Generate sequential combinations of [1:mu]
-        combinations = np.array(list(itertools.combinations(range(0, self._mu ), self._rho)))
-        # print(combinations.shape)
-
-        # Compute the original spectrum for calculating costs of filter outputs.
-        originalSpectrum, f, _ = filter_utils.computeSpectrum(time, y)
-
-        A, B, C, D = self.createStateSpace(time)
-
-        # Compute costs of the initial population.
-        for member in range(self._mu):
-            Q = Q_pop[member, :].reshape(self._stateLength, -1)
-            Q = np.matmul(Q, Q.T)
-            R = R_pop[member]
-
-            try:
-                P = solve_discrete_are(A.T, C.T, Q, R)
-            except:
-                Cost[member] = INT_MAX
-                continue
-            # print(member)
-
-            if P.size == 0:
-                Cost[member] = INT_MAX
-                continue
-            L = np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + R)
-            out = self.simulateDynamics(A, C, L, y)
-            yHat = out[-1, :]
-
-            # Compute the spectrum and corresponding cost.
-            filteredSpectrum, _, _ = filter_utils.computeSpectrum(time, yHat)
-            Cost[member] = filter_utils.computeCost(originalSpectrum, filteredSpectrum, f, self._order)
-        
-        # Run the optimization for _max_iterations.
-        for iteration in range(self._max_iterations):
-            # Randomize the rows of combinations
-            labels = rng.choice(len(combinations), len(combinations), replace=False)
-
-            # Create _lambda new offspring and calculate their costs
-            for j in range(self._lambda):
-                # Create offspring with a random pair from combinations.
-                newQGen[j, :] = np.mean(Q_pop[combinations[labels[j], :], :], axis=0).reshape(1, -1)
-                newRGen[j] = np.mean(R_pop[combinations[labels[j], :]], axis=0).reshape(1, -1)
-
-                Q = newQGen[j, :].reshape(self._stateLength, -1)
-                Q = np.matmul(Q, Q.T)
-                R = newRGen[j]
-
-                try:
-                    P = solve_discrete_are(A.T, C.T, Q, R)
-                except:
-                    newCost[j] = INT_MAX
-                    continue
-
-                L = np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + R)
-                out = self.simulateDynamics(A, C, L, y)
-                yHat = out[-1, :]
-
-                # Compute the spectrum and corresponding cost.
-                filteredSpectrum, _, _ = filter_utils.computeSpectrum(time, yHat)
-                newCost[j] = filter_utils.computeCost(originalSpectrum, filteredSpectrum, f, self._order)
-            
-            # Append the newGen and newCost to allow us work on one array each.
-            Q_pop = np.append(Q_pop, newQGen, axis=0)
-            R_pop = np.append(R_pop, newRGen, axis=0)
-            Cost = np.append(Cost, newCost)
-
-            # Remove the lambda highest costs from both cost and population.
-            maxIndex = np.argpartition(Cost, -self._lambda)[-self._lambda:]
-            
-            Cost = np.delete(Cost, maxIndex)
-            Q_pop = np.delete(Q_pop, maxIndex, axis=0)
-            R_pop = np.delete(R_pop, maxIndex, axis=0)
-
-            # # Take the average cost - useful when trying to visualize.
-            # avgCost[iteration] = np.mean(cost)
+        start = monotonic()
+
+        # Random number generator for the population and for randomizing the
+        # combinations of population members.
+        rng = np.random.default_rng(seed)
+        if prior is None:
+            Q_pop, R_pop = self.initializePopulation(rng)
+        else:
+            Q_pop, R_pop = self.initializeWarmPopulation(prior, rng, randomShare)
+
+        optimizer = search_utils.getOptimizer(optimizer)
+        if maxEvaluations is None and optimizer is not None:
+            maxEvaluations = optimizer.maxEvaluations
+        if maxIterations is None and optimizer is None:
+            maxIterations = self._max_iterations if prior is None else self._warmStartIterations
+
+        # Work on each member's [Q | R] values as one row.
+        population = np.append(Q_pop, R_pop, axis=1)
+
+        time = np.asarray(time, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        # Continue from the phase the checkpoint was saved in, if there is one. A
+        # checkpoint of another filter, other data or other options is ignored.
+        isMultiResolution = decimation is not None and decimation > 1
+        fingerprint = cache_utils.optimizationKey(self, time, y, {
+            'seed': seed, 'prior': prior, 'randomShare': randomShare,
+            'maxIterations': maxIterations, 'stoppingRules': stoppingRules,
+            'decimation': decimation, 'screening': screening,
+            'optimizer': optimizer, 'maxEvaluations': maxEvaluations,
+        })
+        resume = None if resumeFrom is None else checkpoint_utils.loadCheckpoint(resumeFrom)
+        if resume is not None and resume['context'].get('fingerprint') != fingerprint:
+            resume = None
+        phase = None if resume is None else resume['phase']
+
+        # Set before the evaluators so worker processes get their own empty copy.
+        self._stats = stats
+
+        # One pool of worker processes for every phase and data window.
+        with parallel_utils.WorkerPool(self, workers) as pool:
+            # Run most generations on decimated data first, where each one is
+            # about [decimation] times cheaper.
+            coarseReport = {}
+            coarseCost = None
+            if isMultiResolution:
+                coarseIterations, maxIterations = search_utils.splitBudget(
+                    maxIterations, self._coarseShare
+                )
+                coarseEvaluations, maxEvaluations = search_utils.splitBudget(
+                    maxEvaluations, self._coarseShare
+                )
+                if phase == 'full':
+                    # The coarse generations had finished before the checkpoint.
+                    coarseReport = resume['context']['coarseReport']
+                else:
+                    coarseDeadline = None
+                    if deadlineSeconds is not None:
+                        coarseDeadline = evolution_utils.Deadline(self._coarseShare*deadlineSeconds)
+                    if checkpoint is not None:
+                        checkpoint.setPhase('coarse', {'fingerprint': fingerprint})
+                    tCoarse, yCoarse = filter_utils.decimate(time, y, decimation)
+                    population, coarseCost = self._evolve(
+                        tCoarse, yCoarse, population, rng, coarseIterations, pool,
+                        stoppingRules, coarseReport, stats, screening,
+                        lambda members: self._coarseParameters(members, decimation),
+                        optimizer, coarseEvaluations, coarseDeadline,
+                        checkpoint, resume if phase == 'coarse' else None
+                    )
+
+            deadline = None
+            if deadlineSeconds is not None:
+                deadline = evolution_utils.Deadline(deadlineSeconds - (monotonic() - start))
+            runReport = {} if report is None else report
+            if (deadline is not None and coarseCost is not None
+                    and not self._evaluationFits(time, y, population, pool, decimation, deadline)):
+                # No time left to evaluate the population on the full data, so
+                # return the best coarse member. The population is kept in
+                # full-data [Q | R] values, converted by _coarseParameters only
+                # to evaluate it, so it needs no conversion back.
+                Cost = coarseCost
+                runReport.update({'generations': 0, 'evaluations': 0,
+                                  'stopReason': 'deadline',
+                                  'bestCost': coarseReport['bestCost'],
+                                  'costResolution': 'coarse'})
+            else:
+                if checkpoint is not None:
+                    checkpoint.setPhase('full', {'fingerprint': fingerprint,
+                                                'coarseReport': coarseReport})
+                population, Cost = self._evolve(
+                    time, y, population, rng, maxIterations, pool, stoppingRules,
+                    runReport, stats, screening, optimizer=optimizer, maxEvaluations=maxEvaluations,
+                    deadline=deadline, checkpoint=checkpoint,
+                    resume=resume if phase == 'full' else None
+                )
+                runReport['costResolution'] = 'full'
+        if coarseReport:
+            runReport['coarseGenerations'] = coarseReport['generations']
+            runReport['coarseBestCost'] = coarseReport['bestCost']
+            runReport['generations'] += coarseReport['generations']
+            runReport['evaluations'] += coarseReport['evaluations']
+        runReport['elapsedSeconds'] = monotonic() - start
+
+        # A search stopped by the deadline can still be resumed to refine it.
+        if checkpoint is not None and runReport['stopReason'] != 'deadline':
+            checkpoint.clear()
+
+        # Release the simulation output buffer, the stats collector and the
+        # cached powers of the gap dynamics.
+        self._outputs = None
+        self._stats = None
+        simulation_utils.clearPowerCache()
 
         # Return the best performer in the final population.
         idx = np.argmin(Cost)
-        return np.append(Q_pop[idx, :].reshape(1, -1), R_pop[idx].reshape(1, 1), axis=1)
\ No newline at end of file
+        return population[idx, :].reshape(1, -1)
+
+    def _evolve(self, time: np.ndarray, y: np.ndarray, population: np.ndarray,
+                rng: np.random.Generator, maxIterations: int,
+                pool: parallel_utils.WorkerPool,
+                stoppingRules: evolution_utils.StoppingRules, report: dict,
+                stats: profiling_utils.OptimizationStats,
+                screening: evolution_utils.Screening = None,
+                toModel=None, optimizer: search_utils.Optimizer = None,
+                maxEvaluations: int = None,
+                deadline: evolution_utils.Deadline = None,
+                checkpoint: checkpoint_utils.Checkpoint = None,
+                resume: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''Runs the evolution loop, or [optimizer], on one series of data.
+
+        Args:
+            pool: worker processes of the optimization, shared by the
+                evaluators of every data window.
+            screening: screens the offspring on the most recent windows of
+                the data before evaluating them on all of it.
+            toModel: maps the population to the [Q | R] parameters evaluated on
+                this data, if they differ.
+            optimizer: search engine to run instead of the evolution loop.
+            maxEvaluations: evaluation budget.
+            deadline: wall-clock limit.
+            checkpoint: saves the state of the search every few generations.
+            resume: state loaded from a checkpoint to continue from.
+        Returns:
+            population: final population.
+            Cost: cost of each member of the final population.
+        '''
+        # One evaluator for the data and each screening window, shortest first.
+        windows = [] if screening is None else screening.windowLengths(time[1] - time[0], len(y))
+        with contextlib.ExitStack() as stack:
+            evaluators = []
+            for length in windows + [len(y)]:
+                tWindow, yWindow = time[-length:], y[-length:]
+
+                # Compute the original spectrum for calculating costs of filter outputs.
+                with profiling_utils.stage(stats, 'originalSpectrum'):
+                    originalSpectrum, f, _ = filter_utils.computeSpectrum(tWindow, yWindow)
+                evaluator = stack.enter_context(parallel_utils.PopulationEvaluator(
+                    self, pool, t=tWindow, y=yWindow, originalSpectrum=originalSpectrum, f=f
+                ))
+                if toModel is None:
+                    evaluators.append(evaluator.evaluate)
+                else:
+                    evaluators.append(lambda members, evaluator=evaluator:
+                                      evaluator.evaluate(toModel(members)))
+
+            evaluate = evaluators[-1]
+            evaluateOffspring = None
+            if screening is not None:
+                evaluateOffspring = screening.wrap(evaluators[:-1], evaluate, stats,
+                                                   [length/len(y) for length in windows])
+
+            if optimizer is not None:
+                return optimizer.optimize(
+                    evaluate, population, self._searchSpace(), rng, maxIterations,
+                    maxEvaluations, stoppingRules, report, stats, evaluateOffspring, deadline,
+                    checkpoint, resume
+                )
+
+            return evolution_utils.evolve(
+                evaluate, population, rng, self._lambda, self._rho,
+                maxIterations, stoppingRules, self._searchCoordinates, report, stats,
+                evaluateOffspring, maxEvaluations, deadline, checkpoint, resume
+            )
+
+    def _evaluationFits(self, time: np.ndarray, y: np.ndarray, population: np.ndarray,
+                        pool: parallel_utils.WorkerPool, decimation: int,
+                        deadline: evolution_utils.Deadline) -> bool:
+        '''Whether evaluating [population] on the full data fits before [deadline].
+
+        The decimated data can have no gaps where the full data does, so the
+        time of the coarse generations says little about the full ones. The
+        members are instead timed on the most recent 1/[decimation]^2, then
+        1/[decimation], of the data, each time only if the last one predicts
+        it fits, and the time is scaled up to the full population and length.
+        Args:
+            time: time (in hours from first entry) for the data.
+            y: biometric data.
+            population: [Q | R] members, one per row.
+            pool: worker processes of the optimization.
+            decimation: decimation factor of the coarse phase.
+            deadline: wall-clock limit.
+        Returns:
+            fits: whether the evaluation is expected to finish in time.
+        '''
+        # Probes of (members, samples), each started only if the last one
+        # predicts it fits: one member, to bound the population's, then the
+        # population on the shorter and the longer window.
+        shortLength = max(2, len(y)//decimation**2)
+        probes = [(1, shortLength), (len(population), shortLength),
+                  (len(population), max(2, len(y)//decimation))]
+        seconds = 0
+        for members, length in probes:
+            if not deadline.allows(seconds*members*length/(len(population)*len(y))):
+                return False
+            start = monotonic()
+            tWindow, yWindow = time[-length:], y[-length:]
+            originalSpectrum, f, _ = filter_utils.computeSpectrum(tWindow, yWindow)
+            with parallel_utils.PopulationEvaluator(
+                self, pool, t=tWindow, y=yWindow, originalSpectrum=originalSpectrum, f=f
+            ) as evaluator:
+                evaluator.evaluate(population[:members])
+            # Estimated time of the population on the full data.
+            seconds = (monotonic() - start)*len(population)*len(y)/(members*length)
+
+        return deadline.allows(seconds)
+
+    def _coarseParameters(self, population: np.ndarray, decimation: int) -> np.ndarray:
+        '''Converts [Q | R] members to their equivalent on decimated data.
+
+        Over [decimation] samples, about [decimation] times the process noise
+        builds up, while averaging the samples divides the measurement noise
+        variance by [decimation].
+        Args:
+            population: [Q | R] members, one per row.
+            decimation: decimation factor of the data.
+        Returns:
+            coarsePopulation: [Q | R] members for the decimated data.
+        '''
+        coarsePopulation = population.copy()
+        coarsePopulation[:, :-1] *= np.sqrt(decimation)
+        coarsePopulation[:, -1] /= decimation
+
+        return coarsePopulation
+
+    def _evaluatePopulation(self, t: np.ndarray, y: np.ndarray, population: np.ndarray,
+                            originalSpectrum: np.ndarray, f: np.ndarray) -> np.ndarray:
+        '''Computes the cost of every [Q | R] member in the population.
+
+        If the data has no gaps, the output spectra come from each member's
+        transfer function instead of a simulation.
+
+        Args:
+            t: time (in hours from first entry) for the data.
+            y: biometric data.
+            population: [Q | R] members to evaluate, one per row.
+            originalSpectrum: freq spectrum of the original signal.
+            f: frequency values corresponding to originalSpectrum.
+        Returns:
+            cost: cost of each member, INT_MAX where the DARE has no solution
+                or the filter dynamics are unstable.
+        '''
+        stats = self._stats
+        cost = np.full(len(population), float(INT_MAX))
+        with profiling_utils.stage(stats, 'createStateSpace'):
+            A, B, C, D = self.createStateSpace(t)
+            costPlan = filter_utils.createCostPlan(len(t), t[1] - t[0], self._order)
+
+        # Solve every member's DARE at once and compute the gains.
+        with profiling_utils.stage(stats, 'dare'):
+            M = population[:, :-1].reshape(len(population), self._stateLength, -1)
+            Q = np.matmul(M, np.swapaxes(M, 1, 2))
+            R = population[:, -1].reshape(-1, 1, 1)
+            P, isSolved = filter_utils.solveDiscreteAREBatch(
+                A.T, C.T, Q, R, self._riccatiSolver
+            )
+
+            PCt = np.matmul(P, C.T)
+            L = np.matmul(A, PCt)[:, :, 0]/(np.matmul(C, PCt)[:, :, 0] + R[:, :, 0])
+            L[~isSolved] = 0
+        numSolved = np.count_nonzero(isSolved)
+
+        # Reject members whose filter dynamics are unstable before simulating.
+        with profiling_utils.stage(stats, 'stability'):
+            isSolved[isSolved] = filter_utils.checkStabilityBatch(A - L[isSolved, :, None]*C)
+
+        members = np.flatnonzero(isSolved)
+        isComputed = np.zeros(len(members), dtype=bool)
+        if stats is not None:
+            stats.count('evaluated', len(population))
+            stats.count('unsolved', len(population) - numSolved)
+            stats.count('unstable', numSolved - len(members))
+
+        # Without gaps the filter is time invariant, so the output spectrum
+        # comes straight from its transfer function without simulating.
+        y = np.asarray(y, dtype=float)
+        if len(members) > 0 and np.all(y[1:] != 0):
+            u = np.zeros(len(y))
+            u[1:] = y[:-1]
+            with profiling_utils.stage(stats, 'transferFunction'):
+                Y, isComputed = filter_utils.computeOutputDFT(
+                    A - L[members, :, None]*C, L[members], C, self._initialState(y), u
+                )
+            with profiling_utils.stage(stats, 'cost'):
+                filteredSpectra = filter_utils.singleSidedSpectrum(Y[isComputed], len(y))
+                cost[members[isComputed]] = costPlan.computeCost(originalSpectrum, filteredSpectra)
+
+        # Otherwise simulate the output alone into the reusable buffer and
+        # compute its cost.
+        if self._outputs is None:
+            self._outputs = simulation_utils.OutputBuffer()
+        yHat = self._outputs.get(len(y))
+        for i in np.flatnonzero(~isComputed):
+            with profiling_utils.stage(stats, 'simulation'):
+                self.simulateDynamics(A, C, L[members[i]].reshape(-1, 1), y, out=yHat, yHatOnly=True)
+            cost[members[i]] = self._computeOutputCost(t, yHat, originalSpectrum, costPlan)
+
+        return cost
+
+    def _computeOutputCost(self, t: np.ndarray, yHat: np.ndarray,
+                           originalSpectrum: np.ndarray,
+                           costPlan: filter_utils.CostPlan) -> np.ndarray:
+        '''Computes the cost of filter outputs with the selected spectral cost.
+
+        Args:
+            t: time (in hours from first entry) for the data.
+            yHat: filter output, or one output per row.
+            originalSpectrum: freq spectrum of the original signal.
+            costPlan: plan for the cost on this frequency grid.
+        Returns:
+            cost: cost of each output.
+        '''
+        # The transforms are timed apart from the weighted sums of the cost.
+        if self._spectralCost == 'parseval':
+            with profiling_utils.stage(self._stats, 'fft'):
+                power = costPlan.partialDFTPower(yHat)
+            with profiling_utils.stage(self._stats, 'cost'):
+                return costPlan.computeSignalCost(originalSpectrum, yHat, power)
+        elif self._spectralCost != 'fft':
+            raise ValueError(f"Unknown spectral cost '{self._spectralCost}'")
+
+        with profiling_utils.stage(self._stats, 'fft'):
+            filteredSpectrum, _, _ = filter_utils.computeSpectrum(t, yHat)
+        with profiling_utils.stage(self._stats, 'cost'):
+            return costPlan.computeCost(originalSpectrum, filteredSpectrum)
+
+    def _initialState(self, y: np.ndarray) -> np.ndarray:
+        '''Creates the initial filter state for the data [y].
+        Args:
+            y: biometric data values.
+        Returns:
+            xHat0: initial state with the bias term set to the mean y value.
+        '''
+        xHat0 = np.zeros(self._stateLength)
+        xHat0[-1] = np.mean(y)
+
+        return xHat0
@@ -0,0 +1,247 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Persistent cache of optimization results. A result is keyed on a
+hash of the data, the filter class and its hyperparameters, and the options of
+the run, so a retried or repeated optimization on unchanged data returns the
+stored parameters without searching again. Entries are small JSON files on
+local disk, evicted least recently used first.
+'''
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+from typing import Callable
+
+
+# Environment variable with the cache directory. Set it to an empty string to
+# turn the cache off.
+CACHE_VARIABLE = 'SENSE_OPTIMIZATION_CACHE'
+
+# Default directory under HOME, which is the app's files directory on Android.
+DEFAULT_DIRECTORY = os.path.join('~', '.sense', 'optimizationCache')
+
+# Entries kept before evicting the least recently used.
+DEFAULT_MAX_ENTRIES = 128
+
+# Bump when a change to the optimization changes its results, so older entries
+# are no longer hit.
+CACHE_VERSION = 2
+
+
+class OptimizationCache:
+    '''Size-bounded, least recently used cache of optimization results on disk.
+
+    Each entry is one JSON file named by its key. Reading an entry touches its
+    file, so the modification times order the entries by last use.
+    '''
+
+    def __init__(self, directory: str, maxEntries: int = DEFAULT_MAX_ENTRIES):
+        self.directory = os.path.expanduser(directory)
+        self.maxEntries = maxEntries
+
+    def key(self, filterObject, t: np.ndarray, y: np.ndarray, options: dict) -> str:
+        '''Computes the key of an optimization (see optimizationKey).'''
+        return optimizationKey(filterObject, t, y, options)
+
+    def get(self, key: str) -> dict:
+        '''Gets the entry for [key], or None if there is no readable one.'''
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._remove(path)
+            return None
+
+        return entry
+
+    def put(self, key: str, params: np.ndarray, report: dict):
+        '''Stores the optimal parameters and the report of an optimization.
+
+        Args:
+            key: key of the optimization.
+            params: optimal parameters.
+            report: report of the optimization, with the final 'bestCost'.
+        '''
+        params = np.asarray(params, dtype=float)
+        entry = {
+            'params': params.ravel().tolist(),
+            'shape': list(params.shape),
+            'cost': _plain(report.get('bestCost')),
+            'report': {name: _plain(value) for name, value in report.items()},
+            'created': time.time(),
+        }
+
+        # Write to a temporary file first so readers never see a partial entry.
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temporaryPath = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporaryPath, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temporaryPath, path)
+
+        self._evict()
+
+    def clear(self):
+        '''Removes every entry.'''
+        for path, _ in self._entries():
+            self._remove(path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def _entries(self) -> list:
+        '''Gets (path, last use) of every entry, least recently used first.'''
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((path, os.path.getmtime(path)))
+            except OSError:
+                continue
+
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def _evict(self):
+        entries = self._entries()
+        for path, _ in entries[:max(0, len(entries) - self.maxEntries)]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def optimizationKey(filterObject, t: np.ndarray, y: np.ndarray, options: dict) -> str:
+    '''Computes the key of an optimization, the same for runs with the same result.
+
+    Args:
+        filterObject: filter being optimized. Its class name and the plain
+            values among its class and instance attributes (order,
+            population sizes, bounds, spectral cost, ...) are part of the
+            key.
+        t: time values of the data.
+        y: biometric data values.
+        options: other arguments that change the result, like the seed.
+    Returns:
+        key (str) - hex digest identifying the optimization
+    '''
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        'version': CACHE_VERSION,
+        'filter': type(filterObject).__name__,
+        'hyperparameters': _hyperparameters(filterObject),
+        'options': {name: _plain(value) for name, value in options.items()},
+    }, sort_keys=True).encode())
+    for values in (t, y):
+        values = np.ascontiguousarray(values, dtype=float)
+        digest.update(str(values.shape).encode())
+        digest.update(values.tobytes())
+
+    return digest.hexdigest()
+
+def defaultCache() -> OptimizationCache:
+    '''Gets the cache in the directory set by CACHE_VARIABLE, DEFAULT_DIRECTORY
+    if unset, or None if it is set to an empty string.
+    '''
+    directory = os.environ.get(CACHE_VARIABLE, DEFAULT_DIRECTORY)
+    if not directory:
+        return None
+
+    return OptimizationCache(directory)
+
+def cachedOptimization(optimize: Callable[[dict], np.ndarray], filterObject,
+                       t: np.ndarray, y: np.ndarray, options: dict,
+                       cache: OptimizationCache = None, report: dict = None,
+                       stats=None) -> np.ndarray:
+    '''Runs an optimization through the cache.
+
+    On a hit, the stored parameters are returned and [report] is filled from
+    the stored report. Otherwise the optimization runs and its result is
+    stored. Either way, report['cacheHit'] tells which happened.
+
+    Args:
+        optimize: runs the optimization, filling the report it is given.
+        filterObject: filter being optimized.
+        t: time values of the data.
+        y: biometric data values.
+        options: other arguments that change the result, for the key.
+        cache: cache to use. The optimization just runs if None.
+        report: if given, filled with the report of the optimization.
+        stats: profiling_utils.OptimizationStats, counting 'cacheHits'.
+    Returns:
+        params (np.ndarray) - optimal filter parameters
+    '''
+    if cache is None:
+        return optimize(report)
+
+    key = cache.key(filterObject, t, y, options)
+    entry = cache.get(key)
+    if entry is not None:
+        if report is not None:
+            report.update(entry['report'])
+            report['cacheHit'] = True
+        if stats is not None:
+            stats.count('cacheHits')
+        return np.array(entry['params'], dtype=float).reshape(entry['shape'])
+
+    runReport = {} if report is None else report
+    params = optimize(runReport)
+    try:
+        # A run cut short by its deadline depends on the device's speed, so it
+        # is not stored under the same key as a full run.
+        if runReport.get('stopReason') != 'deadline':
+            cache.put(key, params, runReport)
+    except OSError:
+        # The result is still good if it can't be stored.
+        pass
+    runReport['cacheHit'] = False
+
+    return params
+
+def _hyperparameters(filterObject) -> dict:
+    '''Gets the plain class and instance attributes of a filter, its
+    hyperparameters. A setting changed on the instance overrides its class's.
+    '''
+    values = {}
+    for namespace in [vars(cls) for cls in reversed(type(filterObject).__mro__)] +\
+            [vars(filterObject)]:
+        for name, value in namespace.items():
+            if isinstance(value, (bool, int, float, str)) and not name.startswith('__'):
+                values[name] = value
+
+    return values
+
+def _plain(value):
+    '''Converts [value] to JSON-serializable values, arrays to nested lists.'''
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(name): _plain(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    # Objects like StoppingRules are keyed on their attributes.
+    return {'type': type(value).__name__, 'values': _plain(vars(value))}
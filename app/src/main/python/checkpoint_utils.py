@@ -0,0 +1,116 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Checkpoints of a running optimization. Every few generations the
+population, its costs, the random number generator state and the generation
+counter are written to one compressed .npz file, so an optimization killed by
+the OS mid-run can resume where it stopped instead of starting over. A resumed
+run continues with exactly the same random draws as an uninterrupted one.
+'''
+import json
+import os
+import numpy as np
+
+
+# Generations between checkpoints.
+DEFAULT_INTERVAL = 1
+
+
+class Checkpoint:
+    '''Periodic checkpoint of an optimization, kept in one file.
+
+    Each save replaces the previous checkpoint. The optimization tags its
+    checkpoints with the phase it is in (the 'coarse' generations on decimated
+    data or the 'full' ones on all of it), with any context the later phases
+    need, like the report of the coarse phase.
+
+    Args:
+        path: file to write the checkpoint to.
+        interval: generations between checkpoints.
+    '''
+
+    def __init__(self, path: str, interval: int = DEFAULT_INTERVAL):
+        self.path = os.path.expanduser(path)
+        self.interval = interval
+        self.phase = None
+        self.context = {}
+
+    def setPhase(self, phase: str, context: dict = None):
+        '''Tags the following checkpoints with [phase] and [context].'''
+        self.phase = phase
+        self.context = {} if context is None else context
+
+    def isDue(self, generation: int) -> bool:
+        '''Whether a checkpoint is due after [generation].'''
+        return generation % self.interval == 0
+
+    def save(self, state: dict, rng: np.random.Generator):
+        '''Writes a checkpoint, replacing the previous one.
+
+        Args:
+            state: arrays and numbers of the optimization, like 'population',
+                'cost' and 'generation'. Dict values, like the state of a
+                search engine, are stored one entry per item.
+            rng: random number generator of the optimization.
+        '''
+        arrays = {
+            'phase': np.array(self.phase or ''),
+            'context': np.array(json.dumps(self.context)),
+            'rngState': np.array(json.dumps(rng.bit_generator.state)),
+        }
+        for name, value in state.items():
+            if isinstance(value, dict):
+                for item, itemValue in value.items():
+                    arrays['{}.{}'.format(name, item)] = np.asarray(itemValue)
+            else:
+                arrays[name] = np.asarray(value)
+
+        # Write to a temporary file first so a kill mid-write keeps the last
+        # complete checkpoint.
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporaryPath = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temporaryPath, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temporaryPath, self.path)
+
+    def clear(self):
+        '''Removes the checkpoint, once the optimization has finished.'''
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def loadCheckpoint(path: str) -> dict:
+    '''Loads a checkpoint written by Checkpoint.save.
+
+    Args:
+        path: checkpoint file.
+    Returns:
+        state (dict) - the saved state, with 'phase', 'context' and 'rngState',
+            or None if there is no checkpoint at [path]
+    '''
+    try:
+        with np.load(os.path.expanduser(path)) as data:
+            arrays = {name: data[name] for name in data.files}
+    except FileNotFoundError:
+        return None
+
+    state = {}
+    for name, value in arrays.items():
+        # Numbers and strings come back as plain Python values.
+        if value.ndim == 0:
+            value = value.item()
+        if '.' in name:
+            name, item = name.split('.', 1)
+            state.setdefault(name, {})[item] = value
+        else:
+            state[name] = value
+    state['context'] = json.loads(state['context'])
+    state['rngState'] = json.loads(state['rngState'])
+
+    return state
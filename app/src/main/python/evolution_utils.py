@@ -0,0 +1,353 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: The (mu+lambda) evolution loop shared by the filter optimizations,
+and the rules that can stop it once the population has converged.
+'''
+import checkpoint_utils
+import itertools
+import time
+import numpy as np
+import profiling_utils
+
+from typing import Callable, List, Sequence, Tuple
+
+
+INT_MAX = 2147483647
+
+
+class StoppingRules:
+    '''Convergence rules for stopping the evolution loop early.
+
+    Each rule is off when its threshold is None. After every generation:
+        'improvement' fires when the best cost improved by less than
+            [minImprovement] (relative) over the last [window] generations.
+        'stall' fires when the best cost has not decreased at all for
+            [stallGenerations] consecutive generations.
+        'spread' fires when the population's largest standard deviation
+            along any search coordinate is below [minSpread].
+    '''
+
+    def __init__(self, minImprovement: float = None, window: int = 3,
+                 stallGenerations: int = None, minSpread: float = None):
+        self.minImprovement = minImprovement
+        self.window = window
+        self.stallGenerations = stallGenerations
+        self.minSpread = minSpread
+
+    def check(self, bestCosts: list, coordinates: np.ndarray) -> str:
+        '''Checks the rules after a generation.
+
+        Args:
+            bestCosts: best cost after the initial population and after
+                each generation so far.
+            coordinates: current population in search coordinates, one
+                member per row.
+        Returns:
+            reason (str) - name of the rule that fired, or None
+        '''
+        generations = len(bestCosts) - 1
+
+        if self.minImprovement is not None and generations >= self.window:
+            previous = bestCosts[-1-self.window]
+            improvement = (previous - bestCosts[-1])/abs(previous) if previous != 0 else 0
+            if improvement < self.minImprovement:
+                return 'improvement'
+
+        if self.stallGenerations is not None and generations >= self.stallGenerations:
+            if bestCosts[-1] >= bestCosts[-1-self.stallGenerations]:
+                return 'stall'
+
+        if self.minSpread is not None:
+            if np.max(np.std(coordinates, axis=0)) < self.minSpread:
+                return 'spread'
+
+        return None
+
+
+class Deadline:
+    '''Wall-clock limit on a search, checked at generation boundaries.
+
+    A generation only starts if one as long as the last is expected to finish
+    before the limit, so the search returns in time with the best members so
+    far instead of overrunning.
+    '''
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.end = time.monotonic() + seconds
+
+    def allows(self, generationSeconds: float) -> bool:
+        '''Whether a generation of [generationSeconds] fits before the limit.'''
+        return time.monotonic() + generationSeconds <= self.end
+
+
+class Screening:
+    '''Successive-halving screening of each generation's offspring.
+
+    The offspring are first scored on the most recent [windowDays[0]] days of
+    data, and only the best [keepFraction] of them with a valid cost move on to
+    the next, longer window, and so on. The survivors of the last window are
+    scored on the full data. Screened-out members get INT_MAX, so selection
+    drops them. Windows at least as long as the data are skipped.
+    '''
+
+    def __init__(self, windowDays: Sequence[float] = (3,), keepFraction: float = 0.5):
+        self.windowDays = tuple(windowDays)
+        self.keepFraction = keepFraction
+
+    def windowLengths(self, dt: float, length: int) -> List[int]:
+        '''Gets the number of samples in each window shorter than the data.
+
+        Args:
+            dt: time step of the data in hours.
+            length: number of samples in the data.
+        Returns:
+            lengths (list) - samples in each window, shortest first
+        '''
+        lengths = [int(round(24*days/dt)) for days in sorted(self.windowDays)]
+        return [n for n in lengths if 0 < n < length]
+
+    def wrap(self, rungs: Sequence[Callable[[np.ndarray], np.ndarray]],
+             evaluate: Callable[[np.ndarray], np.ndarray],
+             stats: profiling_utils.OptimizationStats = None,
+             fractions: Sequence[float] = None) -> Callable[[np.ndarray], np.ndarray]:
+        '''Screens populations through [rungs] before [evaluate].
+
+        Args:
+            rungs: cost of a population on each window, shortest first.
+            evaluate: cost of a population on the full data.
+            stats: if given, counts the members screened out.
+            fractions: share of the full data in each window, the cost of
+                scoring a member on it in full-data evaluations. Defaults to
+                counting every rung evaluation as a full one.
+        Returns:
+            evaluate (Callable) - computes the screened cost of a population,
+                a ScreenedEvaluation if there are rungs
+        '''
+        if len(rungs) == 0:
+            return evaluate
+        if fractions is None:
+            fractions = [1]*len(rungs)
+
+        return ScreenedEvaluation(self, rungs, fractions, evaluate, stats)
+
+
+class ScreenedEvaluation:
+    '''Screened cost of populations, made by Screening.wrap.
+
+    Each call also records the evaluations it spent in [spent], counted in
+    full-data evaluations: a member scored on a window counts as the window's
+    share of the data, and a survivor scored on the full data as one. Searches
+    charge their evaluation budget with it instead of the number of members.
+    '''
+
+    def __init__(self, screening: Screening,
+                 rungs: Sequence[Callable[[np.ndarray], np.ndarray]],
+                 fractions: Sequence[float],
+                 evaluate: Callable[[np.ndarray], np.ndarray],
+                 stats: profiling_utils.OptimizationStats = None):
+        self.keepFraction = screening.keepFraction
+        self.rungs = list(rungs)
+        self.fractions = list(fractions)
+        self.evaluate = evaluate
+        self.stats = stats
+        self.spent = 0
+
+    def __call__(self, population: np.ndarray) -> np.ndarray:
+        cost = np.full(len(population), float(INT_MAX))
+        members = np.arange(len(population))
+        spent = 0
+        for rung, fraction in zip(self.rungs, self.fractions):
+            if len(members) == 0:
+                break
+            rungCost = rung(population[members])
+            spent += fraction*len(members)
+            numKept = int(np.ceil(self.keepFraction*len(members)))
+            kept = np.argsort(rungCost, kind='stable')[:numKept]
+            kept = np.sort(kept[rungCost[kept] < INT_MAX])
+            if self.stats is not None:
+                self.stats.count('screenedOut', len(members) - len(kept))
+            members = members[kept]
+
+        if len(members) > 0:
+            cost[members] = self.evaluate(population[members])
+            spent += len(members)
+        self.spent = spent
+
+        return cost
+
+    def maxSpent(self, numMembers: int) -> float:
+        '''Gets the most evaluations a call on [numMembers] members can spend,
+        when every member with a valid cost on a window is among the kept.
+        '''
+        spent = 0
+        for fraction in self.fractions:
+            spent += fraction*numMembers
+            numMembers = int(np.ceil(self.keepFraction*numMembers))
+
+        return spent + numMembers
+
+
+def spentEvaluations(evaluate: Callable[[np.ndarray], np.ndarray], numMembers: int) -> float:
+    '''Gets the evaluations the last call of [evaluate] on [numMembers] members
+    spent, in full-data evaluations.
+    '''
+    if isinstance(evaluate, ScreenedEvaluation):
+        return evaluate.spent
+    return numMembers
+
+def affordableMembers(evaluate: Callable[[np.ndarray], np.ndarray], numMembers: int,
+                      budget: float) -> int:
+    '''Gets how many of [numMembers] members [evaluate] can score without
+    spending more than [budget] full-data evaluations.
+    '''
+    if not isinstance(evaluate, ScreenedEvaluation):
+        return max(0, min(numMembers, int(np.floor(budget))))
+
+    while numMembers > 0 and evaluate.maxSpent(numMembers) > budget:
+        numMembers -= 1
+    return numMembers
+
+
+def evolve(evaluate: Callable[[np.ndarray], np.ndarray], population: np.ndarray,
+           rng: np.random.Generator, numOffspring: int, numParents: int,
+           maxIterations: int, stoppingRules: StoppingRules = None,
+           toSearchSpace: Callable[[np.ndarray], np.ndarray] = None,
+           report: dict = None,
+           stats: profiling_utils.OptimizationStats = None,
+           evaluateOffspring: Callable[[np.ndarray], np.ndarray] = None,
+           maxEvaluations: int = None, deadline: Deadline = None,
+           checkpoint: checkpoint_utils.Checkpoint = None,
+           resume: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+    '''Runs the (mu+lambda) evolution loop.
+
+    Each generation creates [numOffspring] members as the means of random,
+    non-repeating groups of [numParents] members, then keeps the best mu of
+    parents and offspring together.
+
+    Args:
+        evaluate: computes the cost of each member of a population.
+        population: initial population, one member per row.
+        rng: random number generator for choosing the parents.
+        numOffspring: lambda - offspring created per generation.
+        numParents: rho - parents averaged into each offspring.
+        maxIterations: maximum number of generations.
+        stoppingRules: rules that can end the loop early.
+        toSearchSpace: maps a population to the coordinates its spread is
+            measured in. Defaults to the parameters themselves.
+        report: if given, filled with the number of generations run and
+            members evaluated, the reason the loop stopped and the best cost.
+        stats: if given, times the evaluations and the selection, and records
+            the costs after each generation.
+        evaluateOffspring: computes the cost of each generation's offspring,
+            for example through a Screening. Defaults to [evaluate].
+        maxEvaluations: evaluation budget, in full-data evaluations. The loop
+            stops before a generation that could exceed it. Screened members
+            count as the share of the data they were scored on.
+        deadline: wall-clock limit. The loop stops before a generation that
+            is not expected to finish in time.
+        checkpoint: if given, saves the state of the loop every
+            checkpoint.interval generations, and when the deadline stops it.
+        resume: state loaded from a checkpoint of this loop. The loop
+            continues from it, in place of [population], with the same random
+            draws as if it had never stopped.
+    Returns:
+        population (np.ndarray) - final population
+        cost (np.ndarray) - cost of each member of the final population
+    '''
+    mu = len(population)
+    if evaluateOffspring is None:
+        evaluateOffspring = evaluate
+
+    # Generate sequential combinations of [1:mu]
+    combinations = np.array(list(itertools.combinations(range(0, mu), numParents)))
+
+    def saveCheckpoint():
+        checkpoint.save({
+            'population': population, 'cost': cost, 'generation': generations,
+            'evaluations': evaluations, 'bestCosts': bestCosts,
+            'generationSeconds': generationSeconds,
+        }, rng)
+
+    if resume is None:
+        # Compute costs of the initial population, and from its time, estimate
+        # how long a generation of offspring takes
+        start = time.monotonic()
+        with profiling_utils.stage(stats, 'evaluate'):
+            cost = evaluate(population)
+        if stats is not None:
+            stats.recordGeneration(cost, len(population))
+        generationSeconds = (time.monotonic() - start)*numOffspring/mu
+        evaluations = len(population)
+        bestCosts = [np.min(cost)]
+        generations = 0
+        if checkpoint is not None:
+            saveCheckpoint()
+    else:
+        population, cost = resume['population'], resume['cost']
+        generationSeconds = resume['generationSeconds']
+        evaluations = resume['evaluations']
+        bestCosts = list(resume['bestCosts'])
+        generations = resume['generation']
+        rng.bit_generator.state = resume['rngState']
+    stopReason = 'maxIterations'
+
+    # Run the optimization for maxIterations
+    for iteration in range(generations, maxIterations):
+        # A screened generation is charged the most its screening can spend.
+        if maxEvaluations is not None and affordableMembers(
+                evaluateOffspring, numOffspring, maxEvaluations - evaluations) < numOffspring:
+            stopReason = 'maxEvaluations'
+            break
+        if deadline is not None and not deadline.allows(generationSeconds):
+            stopReason = 'deadline'
+            if checkpoint is not None:
+                saveCheckpoint()
+            break
+        start = time.monotonic()
+
+        # Randomize the rows of combinations
+        labels = rng.choice(len(combinations), len(combinations), replace=False)
+
+        # Create the offspring from random groups in combinations and calculate their costs
+        newGen = np.mean(population[combinations[labels[:numOffspring], :], :], axis=1)
+        with profiling_utils.stage(stats, 'evaluate'):
+            newCost = evaluateOffspring(newGen)
+
+        with profiling_utils.stage(stats, 'selection'):
+            # Append the newGen and newCost to allow us work on one array each
+            population = np.append(population, newGen, axis=0)
+            cost = np.append(cost, newCost)
+
+            # Remove the lambda highest costs from both cost and population
+            maxIndex = np.argpartition(cost, -numOffspring)[-numOffspring:]
+
+            cost = np.delete(cost, maxIndex)
+            population = np.delete(population, maxIndex, axis=0)
+        if stats is not None:
+            stats.recordGeneration(cost, len(newGen))
+        generations = iteration + 1
+        evaluations += spentEvaluations(evaluateOffspring, len(newGen))
+        bestCosts.append(np.min(cost))
+        generationSeconds = time.monotonic() - start
+
+        if stoppingRules is not None:
+            coordinates = population if toSearchSpace is None else toSearchSpace(population)
+            reason = stoppingRules.check(bestCosts, coordinates)
+            if reason is not None:
+                stopReason = reason
+                break
+
+        if checkpoint is not None and checkpoint.isDue(generations):
+            saveCheckpoint()
+
+    if report is not None:
+        report['generations'] = generations
+        report['evaluations'] = evaluations
+        report['stopReason'] = stopReason
+        report['bestCost'] = float(bestCosts[-1])
+
+    return population, cost
@@ -1,8 +1,167 @@
 import numpy as np
 
+from functools import lru_cache
 from math import pi, floor
 from scipy.fft import fft
-from typing import Tuple
+from scipy.linalg import expm, solve_discrete_are
+from typing import Tuple, Union
+
+
+class CostPlan:
+    '''Precomputed bin weights that reduce a spectral cost to weighted sums.
+
+    np.trapz over a slice of a spectrum is a weighted sum of its bins, with
+    half weights at the ends of the slice. Each band of a cost adds its
+    trapezoidal weights to one of three vectors, applied to the squared error
+    (filtered - original), the squared filtered spectrum, and the squared
+    original spectrum.
+
+    The cost can also be computed straight from a filtered signal, since it
+    only needs exact values for the few bins in and around the bands. Those
+    come from a partial DFT, and when the bins beyond the bands carry unit
+    noise weight their energy is the signal's total energy (Parseval's
+    theorem) minus the energy of the directly computed bins.
+    '''
+
+    def __init__(self, length: int, signalLength: int):
+        '''Creates an empty plan for spectra with [length] bins computed
+        from signals of [signalLength] samples.'''
+        self.length = length
+        self.signalLength = signalLength
+        self.harmonicWeights = np.zeros(length)
+        self.noiseWeights = np.zeros(length)
+        self.originalWeights = np.zeros(length)
+        self._directBins = None
+        self._dftBasis = None
+        self._bulkWeight = None
+
+    def addHarmonicBand(self, start: int, end: int):
+        '''Adds trapz of the squared error over the slice [start:end].'''
+        self._addBand(self.harmonicWeights, start, end)
+
+    def addNoiseBand(self, start: int, end: int):
+        '''Adds trapz of the squared filtered spectrum over the slice [start:end].'''
+        self._addBand(self.noiseWeights, start, end)
+
+    def addOriginalBand(self, start: int, end: int):
+        '''Adds trapz of the squared original spectrum over the slice [start:end].'''
+        self._addBand(self.originalWeights, start, end)
+
+    def computeCost(self, originalSpectrum: np.ndarray,
+                    filteredSpectrum: np.ndarray) -> Union[float, np.ndarray]:
+        '''Computes the cost of one filtered spectrum or one per row.
+
+        Args:
+            originalSpectrum: freq spectrum of the original signal.
+            filteredSpectrum: freq spectrum of the filtered signal, or a
+                matrix with one filtered spectrum per row.
+        Returns:
+            cost - the cost of each filtered spectrum
+        '''
+        error = filteredSpectrum - originalSpectrum
+        cost = np.dot(np.square(error), self.harmonicWeights) +\
+            np.dot(np.square(filteredSpectrum), self.noiseWeights)
+        if np.any(self.originalWeights):
+            cost = cost + np.dot(np.square(originalSpectrum), self.originalWeights)
+
+        return cost
+
+    def computeSignalCost(self, originalSpectrum: np.ndarray, yHat: np.ndarray,
+                          power: np.ndarray = None) -> Union[float, np.ndarray]:
+        '''Computes the cost of one filtered signal or one per row without an FFT.
+
+        Matches [computeCost] on the single-sided spectrum of [yHat].
+
+        Args:
+            originalSpectrum: freq spectrum of the original signal.
+            yHat: filtered signal, or a matrix with one filtered signal per row.
+            power: the [partialDFTPower] of yHat, computed here if None.
+        Returns:
+            cost - the cost of each filtered signal
+        '''
+        N = self.signalLength
+        M = self.length
+        bins, _, bulkWeight = self._partialDFT()
+        if power is None:
+            power = self.partialDFTPower(yHat)
+        cost = 0
+
+        if bulkWeight:
+            # Energy of bins 1 to M-2 from Parseval's theorem: the bins pair
+            # up with their mirror images, apart from DC and the Nyquist bin.
+            pairEnergy = N*np.sum(np.square(yHat), axis=-1) - power[..., 0]
+            if N % 2 == 0:
+                pairEnergy = pairEnergy - power[..., -1]
+            pairEnergy = pairEnergy/2
+            isPaired = (bins > 0) & (2*bins < N)
+            bulkEnergy = pairEnergy - np.sum(power[..., isPaired], axis=-1)
+
+            # The remaining bins carry the bulk noise weight on the doubled spectrum.
+            cost = (4/N**2)*bulkEnergy
+
+        # The directly computed bins go through the plan's weights.
+        inSpectrum = bins < M
+        idxs = bins[inSpectrum]
+        scale = np.where((idxs > 0) & (idxs < M-1), 2, 1)/N
+        filtered = np.sqrt(power[..., inSpectrum])*scale
+        cost = cost + np.dot(np.square(filtered - originalSpectrum[idxs]), self.harmonicWeights[idxs]) +\
+            np.dot(np.square(filtered), self.noiseWeights[idxs])
+        if np.any(self.originalWeights):
+            cost = cost + np.dot(np.square(originalSpectrum), self.originalWeights)
+
+        return cost
+
+    def partialDFTPower(self, yHat: np.ndarray) -> np.ndarray:
+        '''Computes the squared magnitude of the bins [computeSignalCost]
+        computes directly.
+
+        Args:
+            yHat: filtered signal, or a matrix with one filtered signal per row.
+        Returns:
+            power (np.ndarray) - squared DFT magnitude of each direct bin
+        '''
+        bins, basis, _ = self._partialDFT()
+        parts = np.matmul(yHat, basis)
+        return np.square(parts[..., :len(bins)]) + np.square(parts[..., len(bins):])
+
+    def _partialDFT(self) -> Tuple[np.ndarray, np.ndarray, int]:
+        '''Gets the bins [computeSignalCost] computes directly and their DFT basis.
+
+        Most bins outside the bands share one noise weight (1 when the noise
+        band runs to the end of the spectrum, 0 when it stops). The other bins
+        are computed directly, and with a unit bulk weight so are DC and the
+        bins from the top of the spectrum to the Nyquist frequency.
+        '''
+        if self._directBins is None:
+            N = self.signalLength
+            M = self.length
+            interior = slice(1, M-1)
+            isBulk = (self.harmonicWeights[interior] == 0) & (self.noiseWeights[interior] == 1)
+            bulkWeight = int(2*np.sum(isBulk) > M-2)
+
+            isDirect = (self.harmonicWeights != 0) | (self.noiseWeights != bulkWeight)
+            bins = np.flatnonzero(isDirect)
+            if bulkWeight:
+                isDirect[[0, M-1]] = True
+                bins = np.union1d(np.flatnonzero(isDirect), np.arange(M-1, N//2 + 1))
+
+            # Real and imaginary parts side by side, reducing the phase index
+            # mod N before scaling for accuracy.
+            phase = 2*pi*(np.outer(np.arange(N), bins) % N)/N
+            self._dftBasis = np.concatenate((np.cos(phase), -np.sin(phase)), axis=1)
+            self._directBins = bins
+            self._bulkWeight = bulkWeight
+
+        return self._directBins, self._dftBasis, self._bulkWeight
+
+    def _addBand(self, weights: np.ndarray, start: int, end: int):
+        '''Adds trapezoidal weights over the slice [start:end] to [weights].'''
+        idxs = np.arange(self.length)[start:end]
+        if len(idxs) < 2:
+            return
+        weights[idxs] += 1
+        weights[idxs[0]] -= 0.5
+        weights[idxs[-1]] -= 0.5
 
 
 def computeSpectrum(t: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int]:
@@ -20,13 +179,280 @@ def computeSpectrum(t: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarra
     Fs = 1/T
     lent = len(t)
     Y = fft(y)
-    P2 = abs(Y / lent)
-    P = P2[0:floor(lent/2)+1]
-    P[1:-1] = 2*P[1:-1]
+    P = singleSidedSpectrum(Y[..., 0:floor(lent/2)+1], lent)
     f = Fs*np.arange(0, floor(lent/2))/lent
 
     return P, f, lent
 
+def singleSidedSpectrum(Y: np.ndarray, lent: int) -> np.ndarray:
+    '''Converts the first floor(lent/2)+1 DFT bins of a real signal to the
+    single-sided spectrum returned by [computeSpectrum].
+
+    Args:
+        Y: DFT bins 0 to floor(lent/2), or one set of bins per row.
+        lent: length of the signal.
+    Returns:
+        P (np.ndarray) - Single-sided frequency spectrum
+    '''
+    P = abs(Y / lent)
+    P[..., 1:-1] = 2*P[..., 1:-1]
+
+    return P
+
+def computeOutputDFT(A: np.ndarray, B: np.ndarray, C: np.ndarray,
+                     x0: np.ndarray, u: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Computes the DFT of the output of a linear time-invariant filter
+    without simulating it.
+
+    For x[k] = A x[k-1] + B u[k] (k >= 1) from x[0] = x0 and yHat = C x, the
+    DFT of the finite window satisfies
+        (I - A w) X(w) = B U(w) + x0 - A x[N-1] - B u[0],    w = e^(-2j pi m/N),
+    so the last term carries the initial state and the window edge exactly.
+    Each filter is diagonalized, the final state comes from a blocked sum of
+    eigenvalue powers, and the output DFT is evaluated on the FFT grid.
+
+    Args:
+        A: (numMembers, s, s) dynamics matrices.
+        B: (numMembers, s) input vectors.
+        C: output matrix shared by every member.
+        x0: initial state shared by every member.
+        u: input value applied at each step, shared by every member.
+    Returns:
+        Y (np.ndarray) - (numMembers, floor(N/2)+1) output DFT bins
+        isValid (np.ndarray) - members whose dynamics are strictly stable and
+            well-conditioned enough to diagonalize; their rows of Y are zero
+            otherwise and they should be simulated instead
+    '''
+    A = np.asarray(A, dtype=float)
+    numMembers, stateLength = A.shape[:2]
+    inputLength = len(u)
+    u = np.asarray(u, dtype=float)
+    numBins = floor(inputLength/2) + 1
+    Y = np.zeros([numMembers, numBins], dtype=complex)
+
+    lam, V = np.linalg.eig(A)
+    isValid = np.all(np.isfinite(lam), axis=1) & (np.max(abs(lam), axis=1) < 1 - 1e-9)
+    isValid[isValid] = np.linalg.cond(V[isValid]) < 1e8
+    if not np.any(isValid):
+        return Y, isValid
+
+    # Modal coordinates of the input vector, initial state and output.
+    lam = lam[isValid]
+    V = V[isValid]
+    Vinv = np.linalg.inv(V)
+    r = np.matmul(Vinv, np.reshape(B, (numMembers, stateLength, 1))[isValid])[..., 0]
+    z0 = np.matmul(Vinv, np.reshape(x0, (stateLength, 1)))[..., 0]
+    cv = np.matmul(np.reshape(C, (1, 1, stateLength)), V)[:, 0, :]
+
+    # Final state: z[N-1] = lam^(N-1) z0 + r sum_k lam^(N-1-k) u[k], summed
+    # over blocks of samples so only short power tables are needed.
+    blockSize = max(1, int(np.sqrt(inputLength)))
+    numBlocks = -(-(inputLength-1) // blockSize)
+    padded = np.zeros(numBlocks*blockSize)
+    padded[len(padded)-(inputLength-1):] = u[1:]
+    exponents = np.arange(blockSize-1, -1, -1)
+    inner = np.matmul(padded.reshape(numBlocks, blockSize),
+                      np.power(lam[:, None, :], exponents[None, :, None]))
+    outerExponents = np.arange(numBlocks-1, -1, -1)
+    outer = np.power(np.power(lam, blockSize)[:, None, :], outerExponents[None, :, None])
+    zFinal = np.power(lam, inputLength-1)*z0 + r*np.sum(inner*outer, axis=1)
+
+    # Output DFT on the single-sided FFT grid.
+    e = z0 - lam*zFinal - r*u[0]
+    U = np.fft.rfft(u)
+    w = np.exp(-2j*pi*np.arange(numBins)/inputLength)
+    resolvent = 1/(1 - lam[:, None, :]*w[None, :, None])
+    weights = np.stack([cv*r, cv*e], axis=-1)
+    terms = np.matmul(resolvent, weights)
+    Y[isValid] = U*terms[..., 0] + terms[..., 1]
+
+    return Y, isValid
+
+def expmBatch(M: np.ndarray) -> np.ndarray:
+    '''Computes the matrix exponential of each matrix in a stack.
+
+    Args:
+        M: (numMembers, s, s) stack of square matrices.
+    Returns:
+        expM (np.ndarray) - (numMembers, s, s) matrix exponentials
+    '''
+    M = np.asarray(M, dtype=float)
+    try:
+        # SciPy 1.9+ exponentiates the whole stack in one call.
+        return expm(M)
+    except ValueError:
+        return np.stack([expm(m) for m in M]) if len(M) > 0 else np.zeros(M.shape)
+
+def checkStabilityBatch(A: np.ndarray, radius: float = 1) -> np.ndarray:
+    '''Checks a stack of discrete-time dynamics matrices for stability.
+
+    A member is stable if no eigenvalue magnitude exceeds [radius]. Any induced
+    norm bounds the spectral radius, so members whose 1- or inf-norm is within
+    [radius] pass without an eigenvalue computation, and the eigenvalues of the
+    rest are computed in one batched call.
+
+    Args:
+        A: (numMembers, s, s) dynamics matrices.
+        radius: largest eigenvalue magnitude allowed.
+    Returns:
+        isStable (np.ndarray) - stability of each member
+    '''
+    A = np.asarray(A, dtype=float)
+    numMembers = len(A)
+    isStable = np.zeros(numMembers, dtype=bool)
+
+    isFinite = np.all(np.isfinite(A.reshape(numMembers, -1)), axis=1)
+    absA = np.abs(A)
+    norms = np.minimum(np.max(np.sum(absA, axis=1), axis=-1), np.max(np.sum(absA, axis=2), axis=-1))
+    isBounded = isFinite & (norms <= radius)
+    isStable[isBounded] = True
+
+    remaining = np.flatnonzero(isFinite & ~isBounded)
+    if len(remaining) > 0:
+        spectralRadius = np.max(np.abs(np.linalg.eigvals(A[remaining])), axis=-1)
+        isStable[remaining] = spectralRadius <= radius
+
+    return isStable
+
+def solveDiscreteAREBatch(a: np.ndarray, b: np.ndarray, q: np.ndarray, r: np.ndarray,
+                          method: str = 'scipy', tolerance: float = 1e-13,
+                          maxIterations: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    '''Solves a batch of discrete algebraic Riccati equations sharing (a, b).
+
+    Solves X = a'Xa - a'Xb(r + b'Xb)^-1 b'Xa + q for every (q, r) pair, the
+    same equation as scipy.linalg.solve_discrete_are, and flags the members
+    without a solution in a mask instead of raising.
+
+    With method 'scipy', each member is solved by solve_discrete_are, so the
+    solutions are exactly its. With 'doubling', the whole batch is iterated
+    together with the structure-preserving doubling algorithm (see
+    [_solveDiscreteAREDoubling]). A doubling solution is only kept if it is
+    stabilizing, with every eigenvalue of a - b(r + b'Xb)^-1 b'Xa strictly
+    inside the unit circle, and the members it fails for are solved by
+    solve_discrete_are instead. On well-conditioned problems both methods
+    agree to ~1e-13. On ill-conditioned ones, like many of the SSKF's, both
+    have tiny residuals but can differ by up to ~1e-2.
+
+    Args:
+        a: (s, s) matrix shared by every member.
+        b: (s, m) matrix shared by every member.
+        q: (numMembers, s, s) symmetric matrices.
+        r: (numMembers, m, m) symmetric positive definite matrices.
+        method: 'scipy' or 'doubling'.
+        tolerance: relative change in X below which a doubling member has
+            converged.
+        maxIterations: maximum number of doubling steps.
+    Returns:
+        X (np.ndarray) - (numMembers, s, s) stabilizing solutions
+        isSolved (np.ndarray) - members with a solution; their rows of X are
+            zero otherwise
+    '''
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    q = np.asarray(q, dtype=float)
+    r = np.asarray(r, dtype=float)
+    if method == 'scipy':
+        isPending = np.ones(len(q), dtype=bool)
+        X = np.zeros(q.shape)
+        isSolved = np.zeros(len(q), dtype=bool)
+    elif method == 'doubling':
+        X, isSolved = _solveDiscreteAREDoubling(a, b, q, r, tolerance, maxIterations)
+
+        # Keep the stabilizing solutions only.
+        members = np.flatnonzero(isSolved)
+        bT = np.broadcast_to(b.T, (len(members),) + b.T.shape)
+        XbT = np.matmul(bT, X[members])
+        K = np.linalg.solve(r[members] + np.matmul(XbT, b), np.matmul(XbT, a))
+        closedLoop = a - np.matmul(b, K)
+        isStabilizing = np.max(np.abs(np.linalg.eigvals(closedLoop)), axis=-1) < 1
+        isSolved[members[~isStabilizing]] = False
+        X[members[~isStabilizing]] = 0
+        isPending = ~isSolved
+    else:
+        raise ValueError(f"Unknown Riccati solver '{method}'")
+
+    for member in np.flatnonzero(isPending):
+        try:
+            P = solve_discrete_are(a, b, q[member], r[member])
+        except (ValueError, np.linalg.LinAlgError):
+            continue
+        if P.size == 0 or not np.all(np.isfinite(P)):
+            continue
+        X[member] = P
+        isSolved[member] = True
+
+    return X, isSolved
+
+def _solveDiscreteAREDoubling(a: np.ndarray, b: np.ndarray, q: np.ndarray, r: np.ndarray,
+                              tolerance: float,
+                              maxIterations: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Solves a batch of DAREs with the structure-preserving doubling algorithm:
+        W = I + G H
+        a <- a W^-1 a,  G <- G + a W^-1 G a',  H <- H + a' H W^-1 a
+    from a, G = b r^-1 b' and H = q. H converges quadratically to X. Every
+    member is iterated together with batched solves, and members that fail
+    to converge are flagged instead of raising.
+
+    Returns:
+        X (np.ndarray) - (numMembers, s, s) solutions
+        isSolved (np.ndarray) - members that converged to a finite solution
+    '''
+    numMembers, stateLength = q.shape[:2]
+    X = np.zeros([numMembers, stateLength, stateLength])
+    isSolved = np.zeros(numMembers, dtype=bool)
+
+    # Members with a singular r have no solution.
+    isPending = np.all(np.isfinite(r.reshape(numMembers, -1)), axis=1) &\
+                np.all(np.isfinite(q.reshape(numMembers, -1)), axis=1)
+    isPending[isPending] = np.abs(np.linalg.det(r[isPending])) > 0
+    members = np.flatnonzero(isPending)
+
+    Ak = np.broadcast_to(a, (len(members), stateLength, stateLength)).copy()
+    G = np.matmul(b, np.linalg.solve(r[members], np.broadcast_to(b.T, (len(members),) + b.T.shape)))
+    H = q[members].copy()
+    eye = np.eye(stateLength)
+
+    for iteration in range(maxIterations):
+        if len(members) == 0:
+            break
+
+        W = eye + np.matmul(G, H)
+        # Drop members whose W is singular before solving with it.
+        isRegular = np.all(np.isfinite(W.reshape(len(members), -1)), axis=1)
+        isRegular[isRegular] = np.linalg.cond(W[isRegular]) < 1/np.finfo(float).eps
+        members, Ak, G, H, W = members[isRegular], Ak[isRegular], G[isRegular],\
+                               H[isRegular], W[isRegular]
+        if len(members) == 0:
+            break
+
+        # W^-1 [a | G] in one solve; a' H W^-1 a = (W^-T H' a)' with H symmetric.
+        solved = np.linalg.solve(W, np.concatenate([Ak, G], axis=2))
+        WinvA = solved[:, :, :stateLength]
+        WinvG = solved[:, :, stateLength:]
+        AkT = np.swapaxes(Ak, 1, 2)
+
+        HNext = H + np.matmul(AkT, np.matmul(H, WinvA))
+        G = G + np.matmul(Ak, np.matmul(WinvG, AkT))
+        Ak = np.matmul(Ak, WinvA)
+
+        # Symmetrize to keep round-off from accumulating.
+        HNext = (HNext + np.swapaxes(HNext, 1, 2))/2
+        G = (G + np.swapaxes(G, 1, 2))/2
+
+        change = np.linalg.norm((HNext - H).reshape(len(members), -1), axis=1)
+        scale = np.linalg.norm(HNext.reshape(len(members), -1), axis=1)
+        H = HNext
+
+        isFinite = np.all(np.isfinite(H.reshape(len(members), -1)), axis=1)
+        isConverged = isFinite & (change <= tolerance*scale)
+        X[members[isConverged]] = H[isConverged]
+        isSolved[members[isConverged]] = True
+
+        keep = isFinite & ~isConverged
+        members, Ak, G, H = members[keep], Ak[keep], G[keep], H[keep]
+
+    return X, isSolved
+
 def computeCost(originalSpectrum: np.ndarray, filteredSpectrum: np.ndarray,
                 f: np.ndarray, order: int) -> float:
     '''Computes the cost by comparing filtered with original.
@@ -38,17 +464,12 @@ def computeCost(originalSpectrum: np.ndarray, filteredSpectrum: np.ndarray,
         order: filter order for cost computation.
     Returns:
         cost (float) - the cost of the filteredSpectrum - discrepancy from originalSpectrum
+
+    This is the reference implementation; the optimizer evaluates the same
+    cost through the plan from [createCostPlan].
     '''
-    # Get the indices of f closest to each harmonic.
-    N1 = np.argmin(abs(f - (1/24)))
-    N2 = np.argmin(abs(f - (2/24)))
-    N3 = np.argmin(abs(f - (3/24)))
-    N4 = np.argmin(abs(f - (4/24)))
-    N5 = np.argmin(abs(f - (5/24)))
-    N6 = np.argmin(abs(f - (6/24)))
-    n1 = np.argmin(abs(f - 0.0309))
-    NN = N1 - n1
-    harmonicIdxs = [N1, N2, N3, N4, N5, N6]
+    harmonicIdxs, NN = _harmonicBands(f)
+    N1 = harmonicIdxs[0]
 
     # J_harmo is the square error within the band around each specified harmonic
     # and the DC term.
@@ -77,35 +498,125 @@ def computeCost(originalSpectrum: np.ndarray, filteredSpectrum: np.ndarray,
 
     return J_harmo + J_noise
 
+def _harmonicBands(f: np.ndarray) -> Tuple[list, int]:
+    '''Gets the indices of f closest to each of the 6 harmonics of 1/24, and
+    the half width of the band around each.'''
+    harmonicIdxs = [np.argmin(abs(f - (k/24))) for k in range(1, 7)]
+    NN = harmonicIdxs[0] - np.argmin(abs(f - 0.0309))
+
+    return harmonicIdxs, NN
+
+@lru_cache(maxsize=8)
+def createCostPlan(lent: int, dt: float, order: int) -> CostPlan:
+    '''Creates the plan that evaluates [computeCost] on one frequency grid.
+
+    Args:
+        lent: length of the time vector.
+        dt: sample time.
+        order: filter order for cost computation.
+    Returns:
+        plan (CostPlan) - bin weights matching computeCost
+    '''
+    f = (1/dt)*np.arange(0, floor(lent/2))/lent
+    harmonicIdxs, NN = _harmonicBands(f)
+    N1 = harmonicIdxs[0]
+
+    # The bands of computeCost: the DC band, then the band around each
+    # harmonic and the noise between consecutive bands and beyond the last one.
+    plan = CostPlan(floor(lent/2)+1, lent)
+    plan.addHarmonicBand(0, NN)
+    plan.addNoiseBand(NN, N1-NN)
+    for i in range(order):
+        idx = harmonicIdxs[i]
+        plan.addHarmonicBand(idx-NN, idx+NN)
+        if i < order-1:
+            plan.addNoiseBand(idx+NN, harmonicIdxs[i+1]-NN)
+    plan.addNoiseBand(idx+NN, None)
+
+    return plan
+
+def decimate(t: np.ndarray, y: np.ndarray, factor: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Decimates data with gaps by [factor], averaging each block of samples.
+
+    The block mean is the anti-aliasing filter. It only averages the samples
+    that are present (non-zero), so gaps don't pull the mean down, and a block
+    with no data stays a gap. A partial block at the end is kept.
+
+    Args:
+        t: time values for the data, evenly spaced.
+        y: biometric data values, zero where missing.
+        factor: number of samples averaged into each coarse sample.
+    Returns:
+        tCoarse (np.ndarray) - time of the first sample of each block
+        yCoarse (np.ndarray) - mean of the data in each block, zero where none
+    '''
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    starts = np.arange(0, len(y), factor)
+
+    total = np.add.reduceat(y, starts)
+    count = np.add.reduceat((y != 0).astype(float), starts)
+    yCoarse = np.zeros(len(starts))
+    np.divide(total, count, out=yCoarse, where=count > 0)
+
+    return t[starts], yCoarse
+
+def fromFloat32Buffer(buffer) -> np.ndarray:
+    '''Views a buffer of native-order float32 values as an array, without copying.
+
+    Args:
+        buffer: bytes-like object, such as bytes, a bytearray or a memoryview.
+    Returns:
+        values (np.ndarray) - float32 view of the buffer
+    '''
+    return np.frombuffer(buffer, dtype=np.float32)
+
+def float32OutputBuffer(shape: Tuple[int, int], buffer=None):
+    '''Gets a contiguous float32 buffer for an output of [shape] and an array view of it.
+
+    Args:
+        shape: shape of the output.
+        buffer: writable bytes-like object to reuse. A new bytearray is
+            allocated if None.
+    Returns:
+        buffer - bytes-like object holding the output, row by row
+        view (np.ndarray) - writable float32 array of [shape] on the buffer
+    '''
+    size = int(np.prod(shape))
+    if buffer is None:
+        buffer = bytearray(4*size)
+
+    return buffer, np.frombuffer(buffer, dtype=np.float32, count=size).reshape(shape)
+
 def estimateAverageDailyPhase(xHat1: np.ndarray, xHat2: np.ndarray,
                               numDays: int, numDataPointsPerDay: int,
                               omg: float) -> np.ndarray:
-    '''Computes the frequency spectrum of the input [y] sampled according to [t].
+    '''Computes the average daily phase difference of each day from day 1.
+
+    The phase is split into one row per day and every day is unwrapped in
+    one call. Leading axes are kept, so many users' states can be stacked
+    and processed together.
 
     Args:
-        xHat (np.ndarray) - filter state 1 and 2 
-        numDays (int) - number of days 
-        numDataPointsPerDay (int) - number of data points per day - 1440 for 1-minute intervals
+        xHat1: filter state 1, with time along the last axis.
+        xHat2: filter state 2, with time along the last axis.
+        numDays: number of days.
+        numDataPointsPerDay: number of data points per day - 1440 for
+            1-minute intervals.
+        omg: frequency of the daily rhythm.
     Returns:
-        averageDailyPhase (np.ndarray) - array of average daily phase difference from day 1 in hours
+        averageDailyPhase (np.ndarray) - array of average daily phase
+            difference from day 1 in hours, shaped [..., numDays]
     '''
-    x1 = xHat1
-    x2 = xHat2
+    x1 = np.asarray(xHat1, dtype=float)
+    x2 = np.asarray(xHat2, dtype=float)
     theta = np.mod(-np.arctan2(x2, omg*x1) + pi/2, 2*pi) - pi
 
-    averageDailyPhase = np.zeros([1, numDays], dtype = float)
-    day1RangeStart = 0
-    day1RangeEnd = numDataPointsPerDay
-
-    for i in range(0, numDays):
-        day2RangeStart = (numDataPointsPerDay*i)
-        day2RangeEnd = (numDataPointsPerDay*(i+1))
+    days = theta[..., :numDays*numDataPointsPerDay]
+    days = days.reshape(theta.shape[:-1] + (numDays, numDataPointsPerDay))
+    days = np.unwrap(days, axis=-1)
 
-        averageDailyPhase[0, i] = (1/omg)*np.mean(
-            np.unwrap(theta[0, day1RangeStart:day1RangeEnd]) -\
-            np.unwrap(theta[0, day2RangeStart:day2RangeEnd]),
-            axis=0
-        )
+    averageDailyPhase = (1/omg)*np.mean(days[..., :1, :] - days, axis=-1)
 
     averageDailyPhase = np.mod(12+averageDailyPhase, 24) - 12
-    return averageDailyPhase
\ No newline at end of file
+    return averageDailyPhase
@@ -8,10 +8,18 @@ Description:
 import itertools
 import json
 import numpy as np
+import sys
 import time
 
+import cache_utils
+import checkpoint_utils
+import filter_utils
+from evolution_utils import Screening, StoppingRules
+from search_utils import Optimizer, getOptimizer
+from profiling_utils import OptimizationStats
 from ObserverBasedFilter import ObserverBasedFilter
 from datetime import datetime, timedelta
+from typing import Tuple
 
 # s = '{"id":01, "name": "Emily", "language": ["C++", "Python"]}'
 data_key = 'activities-heart-intraday'
@@ -53,12 +61,13 @@ def main(inputData: str):
     # print(type(L))
 
 
-def simulateDynamics(t: np.ndarray, y: np.ndarray, L: np.ndarray) -> np.ndarray:
+def simulateDynamics(t: np.ndarray, y: np.ndarray, L: np.ndarray, backend: str = None) -> np.ndarray:
     '''
         Simulates the system dynamics using OBF class and returns the filter output
         Parameters:
             inputData (str) - JSON formatted string containing input data
             L (np.ndarray) - optimal gain matrix to use in simulating dynamics
+            backend (str) - simulation backend (see simulation_utils)
         Returns:
             filterOutput(np.ndarray) - contains [xHat, yHat]:
                 xHat (np.ndarray) - filter states
@@ -70,21 +79,126 @@ def simulateDynamics(t: np.ndarray, y: np.ndarray, L: np.ndarray) -> np.ndarray:
     A, B, C, D = ObserverBasedFilter().createStateSpace(t, L)
     # print("Created state space")
 
-    return ObserverBasedFilter().simulateDynamics(t, y, A, B, C, D)
+    return ObserverBasedFilter().simulateDynamics(t, y, A, B, C, D, backend=backend)
 
 
-def optimizeFilter(t: np.ndarray, y: np.ndarray) -> np.ndarray:
+def simulateDynamicsBuffer(tBuffer, yBuffer, LBuffer, outBuffer=None):
+    '''
+        Simulates the system dynamics on raw float32 buffers. The same as simulateDynamics,
+        without converting arrays element by element: the inputs are viewed without copying,
+        and [xHat; yHat] is written row by row into one float32 buffer the caller can wrap directly
+        Parameters:
+            tBuffer (bytes) - time values, as native-order float32 bytes
+            yBuffer (bytes) - biometric data values, as native-order float32 bytes
+            LBuffer (bytes) - gain matrix, as native-order float32 bytes
+            outBuffer (bytearray) - writable buffer of 4*(stateLength+1)*len(y) bytes to reuse.
+                A new bytearray is allocated if None
+        Returns:
+            outBuffer (bytearray) - contains [xHat; yHat] as float32, one row after another
+    '''
+    OBF = ObserverBasedFilter()
+    t = filter_utils.fromFloat32Buffer(tBuffer).astype(float)
+    y = filter_utils.fromFloat32Buffer(yBuffer)
+    L = filter_utils.fromFloat32Buffer(LBuffer).astype(float)
+
+    outBuffer, out = filter_utils.float32OutputBuffer((OBF._stateLength+1, len(y)), outBuffer)
+
+    A, B, C, D = OBF.createStateSpace(t, L)
+    OBF.simulateDynamics(t, y, A, B, C, D, out=out)
+
+    return outBuffer
+
+
+def advance(t: np.ndarray, y: np.ndarray, L: np.ndarray, lastState: np.ndarray,
+            lastY: float) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+        Filters newly arrived data using the OBF class, continuing from the previous
+        filter state so only the new data is simulated
+        Parameters:
+            t (np.ndarray) - time values for the new data
+            y (np.ndarray) - new biometric data values
+            L (np.ndarray) - optimal gain matrix to use in simulating dynamics
+            lastState (np.ndarray) - final filter state xHat of the previous output
+            lastY (float) - last biometric data value before the new data
+        Returns:
+            newState (np.ndarray) - final filter state xHat, to pass as lastState next time
+            filterOutput(np.ndarray) - contains [xHat, yHat] for the new data
+    '''
+    A, B, C, D = ObserverBasedFilter().createStateSpace(t, L)
+    filterOutput = ObserverBasedFilter().advanceDynamics(t, y, A, B, C, D, lastState, lastY)
+
+    return filterOutput[:-1, -1], filterOutput
+
+
+def optimizeFilter(t: np.ndarray, y: np.ndarray, workers: int = None, seed: int = None,
+                   prior: np.ndarray = None, stoppingRules: StoppingRules = None,
+                   report: dict = None, stats: OptimizationStats = None,
+                   useCache: bool = True,
+                   decimation: int = None, screening: Screening = None,
+                   optimizer: Optimizer = None, maxEvaluations: int = None,
+                   deadlineSeconds: float = None, checkpointPath: str = None,
+                   checkpointInterval: int = checkpoint_utils.DEFAULT_INTERVAL,
+                   resumeFrom: str = None) -> np.ndarray:
     '''Parses the input data for the time and value vectors, then optimizes
         the filter and returns the best gain vector.
 
     Parameters:
         inputData (str) -
+        workers (int) - number of processes to evaluate candidates across
+        seed (int) - seed for the random number generator
+        prior (np.ndarray) - previous optimal gain matrix to warm start around
+        stoppingRules (StoppingRules) - convergence rules that can end the optimization early
+        report (dict) - if given, filled with how and when the optimization stopped
+        stats (OptimizationStats) - if given, collects per-stage timings, candidate counts
+            and per-generation costs. See OptimizationStats.asDict
+        useCache (bool) - whether to return a stored result for the same data and options,
+            and store new results (see cache_utils)
+        decimation (int) - if above 1, run most generations on the data decimated by this
+            factor before refining on the full data
+        screening (Screening) - if given, screen each generation's offspring on the most
+            recent days of data before the full evaluation
+        optimizer (Optimizer) - search engine to use instead of the default evolution loop,
+            an Optimizer or the name of one ('cmaes' or 'de')
+        maxEvaluations (int) - evaluation budget. Also bounds the default evolution loop when
+            given
+        deadlineSeconds (float) - wall-clock limit. The search stops at the last generation
+            boundary it can reach in time and returns the best parameters so far. Runs cut
+            short are not cached
+        checkpointPath (str) - if given, file to save the state of the optimization to every
+            checkpointInterval generations, so a run killed by the OS can be resumed. It is
+            removed once the optimization finishes
+        checkpointInterval (int) - generations between checkpoints
+        resumeFrom (str) - checkpoint of an earlier, interrupted call with the same data and
+            options. The optimization continues where it stopped, or starts over if there is
+            no file there or it is from another optimization
     Returns: 
         L (np.ndarray) - optimal gain matrix to use in simulating
     '''
-    # Optimize the filter and return the optimal gains
-    # np.array(t),np.array(y)
-    return ObserverBasedFilter().optimizeFilter(t, y)
+    OBF = ObserverBasedFilter()
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    optimizer = getOptimizer(optimizer, maxEvaluations)
+    checkpoint = None
+    if checkpointPath is not None:
+        checkpoint = checkpoint_utils.Checkpoint(checkpointPath, checkpointInterval)
+
+    # Optimize the filter and return the optimal gains, unless the same optimization
+    # is already in the cache
+    def optimize(runReport):
+        return OBF.optimizeFilter(t, y, workers=workers, seed=seed, prior=prior,
+                                  stoppingRules=stoppingRules, report=runReport, stats=stats,
+                                  decimation=decimation, screening=screening,
+                                  optimizer=optimizer, maxEvaluations=maxEvaluations,
+                                  deadlineSeconds=deadlineSeconds, checkpoint=checkpoint,
+                                  resumeFrom=resumeFrom)
+
+    return cache_utils.cachedOptimization(
+        optimize, OBF, t, y,
+        {'seed': seed, 'prior': prior, 'stoppingRules': stoppingRules, 'decimation': decimation,
+         'screening': screening,
+         'optimizer': optimizer, 'maxEvaluations': maxEvaluations},
+        cache_utils.defaultCache() if useCache else None, report, stats
+    )
 
 def estimateAverageDailyPhase(xHat1In: np.ndarray, xHat2In: np.ndarray, numDays: int,
                               numDaysOffset: int, numDataPointsPerDay: int) -> np.ndarray:
@@ -93,15 +207,16 @@ def estimateAverageDailyPhase(xHat1In: np.ndarray, xHat2In: np.ndarray, numDays:
         Returns:
             avgDailyPhase (np.ndarray) - average daily phase
     '''
-    xHat1 = np.array(xHat1In).reshape([1, numDays * numDataPointsPerDay])
-    xHat2 = np.array(xHat2In).reshape([1, numDays * numDataPointsPerDay])
+    # Views of the inputs, one user per row, without copying contiguous buffers.
+    xHat1 = np.asarray(xHat1In, dtype=float).reshape([-1, numDays * numDataPointsPerDay])
+    xHat2 = np.asarray(xHat2In, dtype=float).reshape([-1, numDays * numDataPointsPerDay])
     xHat1 = xHat1[:, numDaysOffset*numDataPointsPerDay:]
     xHat2 = xHat2[:, numDaysOffset*numDataPointsPerDay:]
 
     averageDailyPhase = ObserverBasedFilter().estimateAverageDailyPhase(xHat1, xHat2, numDays-numDaysOffset,
                                                                         numDataPointsPerDay)
 
-    idx = np.argsort(averageDailyPhase)
+    idx = np.argsort(averageDailyPhase, axis=-1)
     return np.append(averageDailyPhase, idx, axis=0)
 
 def parseUserData(inputData: str) -> np.ndarray:
@@ -139,6 +254,6 @@ def parseUserData(inputData: str) -> np.ndarray:
 
 
 if __name__ == "__main__":
-    f = open('C:/Users/chukw/Downloads/heart.json')
-
-    main(f.read())
+    # Path to a JSON file with 't' and 'y' lists. For timing, see the benchmarks package.
+    with open(sys.argv[1]) as f:
+        main(f.read())
@@ -7,12 +7,19 @@ Description:
 '''
 import numpy as np
 from scipy.linalg import solve_discrete_are
+from typing import Tuple
 
+import cache_utils
+import checkpoint_utils
 import filter_utils
+from evolution_utils import Screening, StoppingRules
+from search_utils import Optimizer, getOptimizer
+from profiling_utils import OptimizationStats
 from SteadyStateKalmanFilter import SteadyStateKalmanFilter
 
 
-def simulateDynamics(t: np.ndarray, y: np.ndarray, filterParams: np.ndarray) -> np.ndarray:
+def simulateDynamics(t: np.ndarray, y: np.ndarray, filterParams: np.ndarray,
+                     backend: str = None) -> np.ndarray:
     '''Simulates the system dynamics and returns the filter outputs.
     Args:
         t:
@@ -20,21 +27,80 @@ def simulateDynamics(t: np.ndarray, y: np.ndarray, filterParams: np.ndarray) ->
         filterParams:
             Q: [0, :-1] - state covariance matrix.
             R: [0, -1] - output covariance value. Last value in the list.
+        backend: simulation backend (see simulation_utils).
     Returns:
         filterOutput(np.ndarray) - contains [xHat; yHat]:
                 xHat (np.ndarray) - filter states.
                 yHat (np.ndarray) - filter output.
     '''
     SSKF = SteadyStateKalmanFilter()
-    print(type(t))
-    print(type(y))
-    print(type(filterParams))
 
-    # Create the state space system.
+    # Create the state space system and compute the gain.
     A, B, C, D = SSKF.createStateSpace(t)
+    L = _computeGain(SSKF, A, C, filterParams)
 
+    # Simulate the dynamics and return the result.
+    return SSKF.simulateDynamics(A, C, L, y, backend=backend)
+
+def simulateDynamicsBuffer(tBuffer, yBuffer, paramsBuffer, outBuffer=None):
+    '''Simulates the system dynamics on raw float32 buffers.
+
+    The same as simulateDynamics, without converting arrays element by
+    element. The inputs are viewed without copying, and [xHat; yHat] is
+    written row by row into one float32 buffer the caller can wrap directly.
+    Args:
+        tBuffer: time values, as native-order float32 bytes.
+        yBuffer: biometric data values, as native-order float32 bytes.
+        paramsBuffer: [Q | R] filter parameters, as native-order float32 bytes.
+        outBuffer: writable buffer of 4*(stateLength+1)*len(y) bytes to
+            reuse. A new bytearray is allocated if None.
+    Returns:
+        outBuffer - contains [xHat; yHat] as float32, one row after another.
+    '''
+    SSKF = SteadyStateKalmanFilter()
+    t = filter_utils.fromFloat32Buffer(tBuffer).astype(float)
+    y = filter_utils.fromFloat32Buffer(yBuffer)
+    filterParams = filter_utils.fromFloat32Buffer(paramsBuffer).astype(float)
+
+    outBuffer, out = filter_utils.float32OutputBuffer(
+        (SSKF._stateLength+1, len(y)), outBuffer
+    )
+
+    A, B, C, D = SSKF.createStateSpace(t)
+    L = _computeGain(SSKF, A, C, filterParams)
+    SSKF.simulateDynamics(A, C, L, y, out=out)
+
+    return outBuffer
+
+def advance(t: np.ndarray, y: np.ndarray, filterParams: np.ndarray,
+            lastState: np.ndarray, lastY: float) -> Tuple[np.ndarray, np.ndarray]:
+    '''Filters newly arrived data, continuing from the previous filter state.
+
+    Only the new data is simulated, so the daily update does not re-filter
+    the days that were already filtered.
+    Args:
+        t: time values for the new data.
+        y: new biometric data values.
+        filterParams: [Q | R] filter parameters.
+        lastState: final filter state xHat of the previous output.
+        lastY: last biometric data value before the new data.
+    Returns:
+        newState: final filter state xHat, to pass as lastState next time.
+        filterOutput(np.ndarray) - contains [xHat; yHat] for the new data.
+    '''
+    SSKF = SteadyStateKalmanFilter()
+
+    A, B, C, D = SSKF.createStateSpace(t)
+    L = _computeGain(SSKF, A, C, filterParams)
+    filterOutput = SSKF.advanceDynamics(A, C, L, lastState, lastY, y)
+
+    return filterOutput[:-1, -1], filterOutput
+
+def _computeGain(SSKF: SteadyStateKalmanFilter, A: np.ndarray, C: np.ndarray,
+                 filterParams: np.ndarray) -> np.ndarray:
+    '''Computes the steady-state Kalman gain from the [Q | R] parameters.'''
     # Convert params to an np array and extract Q and R.
-    filterParams = np.array(filterParams)
+    filterParams = np.reshape(np.array(filterParams), (-1))
 
     # Reshape Q as a matrix, then multiply by its transpose
     # to make it symmetric.
@@ -44,24 +110,77 @@ def simulateDynamics(t: np.ndarray, y: np.ndarray, filterParams: np.ndarray) ->
     R = filterParams[-1].reshape((1,1))
 
     P = solve_discrete_are(A.T, C.T, Q, R)
-    L = np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + R)
-
-    # Simulate the dynamics and return the result.
-    return SSKF.simulateDynamics(A, C, L, y)
-
-def optimizeFilter(t: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + R)
+
+def optimizeFilter(t: np.ndarray, y: np.ndarray, workers: int = None,
+                   seed: int = None, prior: np.ndarray = None,
+                   stoppingRules: StoppingRules = None, report: dict = None,
+                   stats: OptimizationStats = None, useCache: bool = True,
+                   decimation: int = None, screening: Screening = None,
+                   optimizer: Optimizer = None, maxEvaluations: int = None,
+                   deadlineSeconds: float = None, checkpointPath: str = None,
+                   checkpointInterval: int = checkpoint_utils.DEFAULT_INTERVAL,
+                   resumeFrom: str = None) -> np.ndarray:
     '''Optimizes the filter and returns the best parameters.
 
     Parameters:
         t:
+        workers: number of processes to evaluate candidates across.
+        seed: seed for the random number generator.
+        prior: previous optimal parameters to warm start around.
+        stoppingRules: convergence rules that can end the optimization early.
+        report: if given, filled with how and when the optimization stopped.
+        stats: if given, collects per-stage timings, candidate counts and
+            per-generation costs. See OptimizationStats.asDict.
+        useCache: whether to return a stored result for the same data and
+            options, and store new results (see cache_utils).
+        decimation: if above 1, run most generations on the data decimated
+            by this factor before refining on the full data.
+        screening: if given, screen each generation's offspring on the most
+            recent days of data before the full evaluation.
+        optimizer: search engine to use instead of the default evolution
+            loop, an Optimizer or the name of one ('cmaes' or 'de').
+        maxEvaluations: evaluation budget. Also bounds the default evolution
+            loop when given.
+        deadlineSeconds: wall-clock limit. The search stops at the last
+            generation boundary it can reach in time and returns the best
+            parameters so far. Runs cut short are not cached.
+        checkpointPath: if given, file to save the state of the optimization
+            to every checkpointInterval generations, so a run killed by the
+            OS can be resumed. It is removed once the optimization finishes.
+        checkpointInterval: generations between checkpoints.
+        resumeFrom: checkpoint of an earlier, interrupted call with the same
+            data and options. The optimization continues where it stopped,
+            or starts over if there is no file there or it is from another
+            optimization.
     Returns: 
         filterParams: vector containing optimal Q and R values.
     '''
     SSKF = SteadyStateKalmanFilter()
-    print(type(t))
-    print(type(y))
-
-    return SSKF.optimizeFilter(t, y)
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    optimizer = getOptimizer(optimizer, maxEvaluations)
+    checkpoint = None
+    if checkpointPath is not None:
+        checkpoint = checkpoint_utils.Checkpoint(checkpointPath, checkpointInterval)
+
+    def optimize(runReport):
+        return SSKF.optimizeFilter(
+            t, y, workers=workers, seed=seed, prior=prior,
+            stoppingRules=stoppingRules, report=runReport, stats=stats,
+            decimation=decimation, screening=screening,
+            optimizer=optimizer, maxEvaluations=maxEvaluations,
+            deadlineSeconds=deadlineSeconds, checkpoint=checkpoint,
+            resumeFrom=resumeFrom
+        )
+
+    return cache_utils.cachedOptimization(
+        optimize, SSKF, t, y,
+        {'seed': seed, 'prior': prior, 'stoppingRules': stoppingRules,
+         'decimation': decimation, 'screening': screening,
+         'optimizer': optimizer, 'maxEvaluations': maxEvaluations},
+        cache_utils.defaultCache() if useCache else None, report, stats
+    )
 
 def estimateAverageDailyPhase(
         xHat1In: np.ndarray, xHat2In: np.ndarray, numDays: int,
@@ -72,8 +191,9 @@ def estimateAverageDailyPhase(
         Returns:
             avgDailyPhase (np.ndarray) - average daily phase
     '''
-    xHat1 = np.array(xHat1In).reshape([1, numDays * numDataPointsPerDay])
-    xHat2 = np.array(xHat2In).reshape([1, numDays * numDataPointsPerDay])
+    # Views of the inputs, one user per row, without copying contiguous buffers.
+    xHat1 = np.asarray(xHat1In, dtype=float).reshape([-1, numDays * numDataPointsPerDay])
+    xHat2 = np.asarray(xHat2In, dtype=float).reshape([-1, numDays * numDataPointsPerDay])
     xHat1 = xHat1[:, numDaysOffset*numDataPointsPerDay:]
     xHat2 = xHat2[:, numDaysOffset*numDataPointsPerDay:]
 
@@ -82,5 +202,5 @@ def estimateAverageDailyPhase(
         SteadyStateKalmanFilter()._omg
     )
 
-    idx = np.argsort(averageDailyPhase)
+    idx = np.argsort(averageDailyPhase, axis=-1)
     return np.append(averageDailyPhase, idx, axis=0)
\ No newline at end of file
@@ -0,0 +1,157 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Population evaluation for the filter optimizations, either in this
+process or across a process pool. In the pool, the data every candidate is
+scored against lives in shared memory, so each task only carries its slice of
+the population.
+'''
+import multiprocessing
+import numpy as np
+
+from typing import Dict
+
+
+# Filter object of each worker process, and the shared arrays it has attached
+# to by block name.
+_workerFilter = None
+_workerBlocks = {}
+
+
+class WorkerPool:
+    '''Process pool shared by every evaluator of one optimization.
+
+    Use it as a context manager around the whole optimization, so the worker
+    processes start once, however many data windows and phases are evaluated.
+    Each worker holds a copy of the filter object as it was when the pool
+    started. With one worker or None, or where the platform has no shared
+    memory (like Android, without shm_open), no processes are started and the
+    evaluators run in this process.
+    '''
+
+    def __init__(self, filterObject, workers: int = None):
+        self.filter = filterObject
+        self.workers = workers
+        self.pool = None
+
+    def __enter__(self):
+        if self.workers is not None and self.workers > 1:
+            try:
+                from multiprocessing import resource_tracker, shared_memory
+
+                # Start the tracker of shared memory blocks first, so the
+                # workers share it instead of each starting one that unlinks
+                # the blocks they attached to when it exits.
+                resource_tracker.ensure_running()
+                self.pool = multiprocessing.get_context().Pool(
+                    self.workers, initializer=_initWorker, initargs=(self.filter,)
+                )
+            except (ImportError, OSError):
+                # Evaluate serially where there are no shared memory blocks
+                # or process pools.
+                self.pool = None
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+class PopulationEvaluator:
+    '''Evaluates populations with a filter's _evaluatePopulation.
+
+    Use it as a context manager around the evaluations on one series of data.
+    The named arrays are passed to _evaluatePopulation by keyword along with
+    the population. With a worker pool, they are copied once into shared
+    memory and the population is split into one chunk per worker process.
+    '''
+
+    def __init__(self, filterObject, pool: WorkerPool = None, **arrays: np.ndarray):
+        self._filter = filterObject
+        self._pool = pool if pool is not None and pool.pool is not None else None
+        self._arrays = arrays
+        self._blocks = []
+        self._spec = None
+
+    def __enter__(self):
+        if self._pool is None:
+            return self
+
+        from multiprocessing import shared_memory
+        self._spec = {}
+        for key, value in self._arrays.items():
+            value = np.ascontiguousarray(value, dtype=float)
+            block = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+            np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)[...] = value
+            self._blocks.append(block)
+            self._spec[key] = (block.name, value.shape, value.dtype.str)
+
+        return self
+
+    def __exit__(self, *exc):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        self._spec = None
+
+    def evaluate(self, population: np.ndarray) -> np.ndarray:
+        '''Evaluates the population, keeping the members in order.
+
+        Args:
+            population: members to evaluate, one per row.
+        Returns:
+            cost (np.ndarray) - cost of each member
+        '''
+        if self._pool is None:
+            return self._filter._evaluatePopulation(population=population, **self._arrays)
+
+        chunks = np.array_split(population, min(self._pool.workers, len(population)))
+        results = self._pool.pool.map(_evaluateChunk, [(self._spec, chunk) for chunk in chunks])
+
+        # Fold the workers' profiling stats into the filter's collector.
+        stats = getattr(self._filter, '_stats', None)
+        if stats is not None:
+            for _, workerStats in results:
+                stats.merge(workerStats)
+
+        return np.concatenate([cost for cost, _ in results])
+
+
+def _initWorker(filterObject):
+    '''Sets the filter object of a worker process.'''
+    global _workerFilter
+    _workerFilter = filterObject
+
+    # A forked worker starts with a copy of the stats collected so far, which
+    # the parent already has.
+    stats = getattr(filterObject, '_stats', None)
+    if stats is not None:
+        stats.drain()
+
+def _attach(spec: Dict[str, tuple]) -> Dict[str, np.ndarray]:
+    '''Gets the shared arrays of [spec], attaching to new blocks once.'''
+    from multiprocessing import shared_memory
+    arrays = {}
+    for key, (name, shape, dtype) in spec.items():
+        if name not in _workerBlocks:
+            block = shared_memory.SharedMemory(name=name)
+            _workerBlocks[name] = (block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+        arrays[key] = _workerBlocks[name][1]
+
+    return arrays
+
+def _evaluateChunk(task: tuple) -> tuple:
+    '''Evaluates one chunk of the population in a worker process.
+
+    The task is the spec of the shared arrays and the chunk. Returns the costs
+    with the profiling stats collected for the chunk, if any.
+    '''
+    spec, population = task
+    cost = _workerFilter._evaluatePopulation(population=population, **_attach(spec))
+    stats = getattr(_workerFilter, '_stats', None)
+    return cost, None if stats is None else stats.drain()
@@ -0,0 +1,109 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Opt-in profiling of the filter optimizations. An OptimizationStats
+collector passed to optimizeFilter records the time and calls of each stage of
+the population evaluation, candidate counts and the cost of each generation.
+Without one, the stages run under a shared no-op context.
+'''
+import time
+import numpy as np
+
+from contextlib import contextmanager, nullcontext
+
+
+INT_MAX = 2147483647
+
+# Context used for the stages when profiling is off.
+_noStats = nullcontext()
+
+
+class OptimizationStats:
+    '''Collects per-stage timings, candidate counts and per-generation costs.
+
+    Stage times are cumulative wall time. With worker processes, the stages
+    inside the population evaluation are summed over the workers, so they can
+    add up to more than the 'evaluate' stage timed in the main process. Copies
+    sent to worker processes start empty.
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+        self.generations = []
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    @contextmanager
+    def stage(self, name: str):
+        '''Times the enclosed block as one call of the stage [name].'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._addStage(name, time.perf_counter() - start, 1)
+
+    def count(self, name: str, number: int = 1):
+        '''Adds [number] to the counter [name].'''
+        self.counts[name] = self.counts.get(name, 0) + int(number)
+
+    def recordGeneration(self, cost: np.ndarray, numEvaluations: int):
+        '''Records the costs of the population after a generation.
+
+        Args:
+            cost: cost of each member of the population.
+            numEvaluations: number of candidates evaluated in the generation.
+        '''
+        cost = np.asarray(cost, dtype=float)
+        isValid = cost < INT_MAX
+        self.generations.append({
+            'generation': len(self.generations),
+            'evaluations': int(numEvaluations),
+            'bestCost': float(np.min(cost)) if len(cost) > 0 else None,
+            'meanCost': float(np.mean(cost[isValid])) if np.any(isValid) else None,
+            'invalidMembers': int(np.sum(~isValid)),
+        })
+
+    def merge(self, other: dict):
+        '''Adds the stages and counts of another collector's [asDict].'''
+        for name, stage in other.get('stages', {}).items():
+            self._addStage(name, stage['seconds'], stage['calls'])
+        for name, number in other.get('counts', {}).items():
+            self.count(name, number)
+
+    def drain(self) -> dict:
+        '''Returns [asDict] and resets the collector.'''
+        result = self.asDict()
+        self.__init__()
+        return result
+
+    def asDict(self) -> dict:
+        '''Gets the collected statistics as plain, JSON-serializable values.
+
+        Returns:
+            stats (dict) - 'stages' maps each stage to its total 'seconds' and
+                'calls', 'counts' maps each counter to its value, and
+                'generations' lists the costs after each generation, starting
+                with the initial population
+        '''
+        return {
+            'stages': {name: dict(stage) for name, stage in self.stages.items()},
+            'counts': dict(self.counts),
+            'generations': [dict(generation) for generation in self.generations],
+        }
+
+    def _addStage(self, name: str, seconds: float, calls: int):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += calls
+
+
+def stage(stats: OptimizationStats, name: str):
+    '''Gets the context timing stage [name], or a no-op one if [stats] is None.'''
+    return _noStats if stats is None else stats.stage(name)
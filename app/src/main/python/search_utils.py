@@ -0,0 +1,427 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Alternative search engines for the filter optimizations, next to
+the (mu+lambda) loop in evolution_utils. The engines search the same log-scale
+box the initial populations are drawn from, propose a whole generation at a
+time so the batched evaluation applies, and stop at an evaluation budget.
+'''
+import checkpoint_utils
+import time
+import numpy as np
+import profiling_utils
+
+from typing import Callable, Tuple
+
+from evolution_utils import Deadline, StoppingRules, affordableMembers, spentEvaluations
+
+
+INT_MAX = 2147483647
+
+# Evaluations an engine runs by default, against the 1,350 of the default
+# (mu+lambda) loop.
+DEFAULT_MAX_EVALUATIONS = 400
+
+
+class SearchSpace:
+    '''Box of log-scale coordinates and the maps between them and the filter
+    parameters.
+
+    Args:
+        toParameters: maps coordinates, one member per row, to parameters.
+        toCoordinates: maps parameters, one member per row, to coordinates.
+        lower: lower bound of each coordinate.
+        upper: upper bound of each coordinate.
+    '''
+
+    def __init__(self, toParameters: Callable[[np.ndarray], np.ndarray],
+                 toCoordinates: Callable[[np.ndarray], np.ndarray],
+                 lower: np.ndarray, upper: np.ndarray):
+        self.toParameters = toParameters
+        self.toCoordinates = toCoordinates
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+
+    def normalize(self, population: np.ndarray) -> np.ndarray:
+        '''Maps parameters to coordinates scaled to the unit box.'''
+        return (self.toCoordinates(population) - self.lower)/(self.upper - self.lower)
+
+    def denormalize(self, X: np.ndarray) -> np.ndarray:
+        '''Maps unit-box coordinates to parameters.'''
+        return self.toParameters(self.lower + X*(self.upper - self.lower))
+
+
+class Optimizer:
+    '''Base of the search engines.
+
+    Subclasses implement [_start], [_ask] and [_tell] on unit-box coordinates.
+    The base class runs the generations, keeps the best members evaluated so
+    far, and handles the budget, stopping rules, report and stats.
+    '''
+    name = None
+
+    def __init__(self, maxEvaluations: int = DEFAULT_MAX_EVALUATIONS):
+        self.maxEvaluations = maxEvaluations
+
+    def optimize(self, evaluate: Callable[[np.ndarray], np.ndarray], population: np.ndarray,
+                 space: SearchSpace, rng: np.random.Generator, maxIterations: int = None,
+                 maxEvaluations: int = None, stoppingRules: StoppingRules = None,
+                 report: dict = None, stats: profiling_utils.OptimizationStats = None,
+                 evaluateOffspring: Callable[[np.ndarray], np.ndarray] = None,
+                 deadline: Deadline = None, checkpoint: checkpoint_utils.Checkpoint = None,
+                 resume: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''Searches for the parameters with the lowest cost.
+
+        Args:
+            evaluate: computes the cost of each member of a population.
+            population: initial population, one member per row. The engine
+                starts from its spread and, if it needs one, evaluates a
+                sample of it.
+            space: log-scale box to search in.
+            rng: random number generator.
+            maxIterations: maximum number of generations, if any.
+            maxEvaluations: evaluation budget, in full-data evaluations, with
+                screened members counted as the share of the data they were
+                scored on. Defaults to the engine's.
+            stoppingRules: rules that can end the search early.
+            report: if given, filled with the number of generations and
+                evaluations run, the reason the search stopped and the best cost.
+            stats: if given, times the evaluations and the updates, and records
+                the best costs after each generation.
+            evaluateOffspring: computes the cost of proposed members, for
+                example through a Screening. Defaults to [evaluate].
+            deadline: wall-clock limit. The search stops before a generation
+                that is not expected to finish in time.
+            checkpoint: if given, saves the engine state and the best members
+                every checkpoint.interval generations, and when the deadline
+                stops the search.
+            resume: state loaded from a checkpoint of this engine. The search
+                continues from it with the same random draws as if it had
+                never stopped.
+        Returns:
+            population (np.ndarray) - best members evaluated, at most as many
+                as the initial population, best first
+            cost (np.ndarray) - cost of each member
+        '''
+        if maxEvaluations is None:
+            maxEvaluations = self.maxEvaluations
+        if evaluateOffspring is None:
+            evaluateOffspring = evaluate
+
+        archive = _Archive(len(population), np.shape(population)[1])
+
+        def saveCheckpoint():
+            checkpoint.save({
+                'engine': self.name, 'engineState': state,
+                'members': archive.members, 'cost': archive.costs,
+                'evaluations': archive.evaluations, 'generation': generations,
+                'bestCosts': bestCosts, 'generationSeconds': generationSeconds,
+            }, rng)
+
+        if resume is None:
+            X0 = np.clip(space.normalize(population), 0, 1)
+
+            with profiling_utils.stage(stats, 'search'):
+                state = self._start(X0, rng)
+            generationSeconds = 0
+            X = self._initialSample(state, X0)
+            if X is not None:
+                start = time.monotonic()
+                with profiling_utils.stage(stats, 'evaluate'):
+                    cost = archive.evaluate(evaluate, space, X[:maxEvaluations])
+                with profiling_utils.stage(stats, 'search'):
+                    state = self._tell(state, X[:maxEvaluations], cost)
+                if stats is not None:
+                    stats.recordGeneration(archive.costs, len(cost))
+                generationSeconds = time.monotonic() - start
+
+            bestCosts = [np.min(archive.costs) if len(archive.costs) > 0 else float(INT_MAX)]
+            generations = 0
+            if checkpoint is not None:
+                saveCheckpoint()
+        else:
+            if resume.get('engine') != self.name:
+                raise ValueError('The checkpoint is not from a {} search'.format(self.name))
+            state = resume['engineState']
+            archive.members, archive.costs = resume['members'], resume['cost']
+            archive.evaluations = resume['evaluations']
+            generationSeconds = resume['generationSeconds']
+            bestCosts = list(resume['bestCosts'])
+            generations = resume['generation']
+            rng.bit_generator.state = resume['rngState']
+        stopReason = 'maxEvaluations'
+        while maxIterations is None or generations < maxIterations:
+            # Screened proposals are charged what their screening can spend.
+            remaining = maxEvaluations - archive.evaluations
+            if affordableMembers(evaluateOffspring, 1, remaining) == 0:
+                break
+            if deadline is not None and not deadline.allows(generationSeconds):
+                stopReason = 'deadline'
+                if checkpoint is not None:
+                    saveCheckpoint()
+                break
+            start = time.monotonic()
+
+            with profiling_utils.stage(stats, 'search'):
+                X = self._ask(state, rng)
+                X = X[:affordableMembers(evaluateOffspring, len(X), remaining)]
+            with profiling_utils.stage(stats, 'evaluate'):
+                cost = archive.evaluate(evaluateOffspring, space, X)
+            with profiling_utils.stage(stats, 'search'):
+                state = self._tell(state, X, cost)
+            if stats is not None:
+                stats.recordGeneration(archive.costs, len(cost))
+            generations += 1
+            bestCosts.append(np.min(archive.costs))
+            generationSeconds = time.monotonic() - start
+
+            if stoppingRules is not None:
+                reason = stoppingRules.check(bestCosts, space.toCoordinates(archive.members))
+                if reason is not None:
+                    stopReason = reason
+                    break
+
+            if checkpoint is not None and checkpoint.isDue(generations):
+                saveCheckpoint()
+        else:
+            stopReason = 'maxIterations'
+
+        if report is not None:
+            report['generations'] = generations
+            report['evaluations'] = archive.evaluations
+            report['stopReason'] = stopReason
+            report['bestCost'] = float(bestCosts[-1])
+
+        return archive.members, archive.costs
+
+    def _start(self, X0: np.ndarray, rng: np.random.Generator):
+        '''Creates the engine state from the initial unit-box population.'''
+        raise NotImplementedError
+
+    def _initialSample(self, state, X0: np.ndarray) -> np.ndarray:
+        '''Gets the members to evaluate before the first generation, if any.'''
+        return None
+
+    def _ask(self, state, rng: np.random.Generator) -> np.ndarray:
+        '''Proposes the next generation in the unit box.'''
+        raise NotImplementedError
+
+    def _tell(self, state, X: np.ndarray, cost: np.ndarray):
+        '''Updates the engine state with the costs of the proposed members.'''
+        raise NotImplementedError
+
+
+class CMAES(Optimizer):
+    '''Covariance matrix adaptation evolution strategy, (mu/mu_w, lambda).
+
+    The search starts at the coordinate-wise median of the initial population
+    with a step size of its mean spread, so it contracts around a warm start.
+    Samples outside the box are clipped onto it and used as clipped.
+
+    Args:
+        maxEvaluations: evaluation budget.
+        popSize: lambda, members sampled per generation. Above the usual
+            4 + 3*ln(dimension), so each batched evaluation carries more
+            members and the OBF needs fewer simulation passes.
+        minSigma: smallest initial step size, in unit-box coordinates.
+    '''
+    name = 'cmaes'
+
+    def __init__(self, maxEvaluations: int = DEFAULT_MAX_EVALUATIONS,
+                 popSize: int = 16, minSigma: float = 0.05):
+        super().__init__(maxEvaluations)
+        self.popSize = popSize
+        self.minSigma = minSigma
+
+    def _start(self, X0: np.ndarray, rng: np.random.Generator) -> dict:
+        n = X0.shape[1]
+        lam = self.popSize
+        mu = lam//2
+        weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+        weights /= np.sum(weights)
+        mueff = 1/np.sum(weights**2)
+
+        cc = (4 + mueff/n)/(n + 4 + 2*mueff/n)
+        cs = (mueff + 2)/(n + mueff + 5)
+        c1 = 2/((n + 1.3)**2 + mueff)
+        cmu = min(1 - c1, 2*(mueff - 2 + 1/mueff)/((n + 2)**2 + mueff))
+
+        return {
+            'lambda': lam, 'weights': weights, 'mueff': mueff,
+            'cc': cc, 'cs': cs, 'c1': c1, 'cmu': cmu,
+            'damps': 1 + 2*max(0, np.sqrt((mueff - 1)/(n + 1)) - 1) + cs,
+            'chiN': np.sqrt(n)*(1 - 1/(4*n) + 1/(21*n**2)),
+            'mean': np.median(X0, axis=0),
+            'sigma': max(float(np.mean(np.std(X0, axis=0))), self.minSigma),
+            'C': np.eye(n), 'B': np.eye(n), 'D': np.ones(n), 'invsqrtC': np.eye(n),
+            'pc': np.zeros(n), 'ps': np.zeros(n), 'generation': 0,
+        }
+
+    def _ask(self, state: dict, rng: np.random.Generator) -> np.ndarray:
+        Z = rng.standard_normal((state['lambda'], len(state['mean'])))
+        Y = np.matmul(Z*state['D'], state['B'].T)
+        return np.clip(state['mean'] + state['sigma']*Y, 0, 1)
+
+    def _tell(self, state: dict, X: np.ndarray, cost: np.ndarray) -> dict:
+        weights = state['weights'][:len(X)]
+        weights = weights/np.sum(weights)
+        mueff = 1/np.sum(weights**2)
+        cc, cs, c1, cmu = state['cc'], state['cs'], state['c1'], state['cmu']
+        mean, sigma = state['mean'], state['sigma']
+        n = len(mean)
+
+        # Recombine the best members, from the clipped samples actually evaluated.
+        best = np.argsort(cost, kind='stable')[:len(weights)]
+        Y = (X[best] - mean)/sigma
+        yw = np.dot(weights, Y)
+        state['mean'] = mean + sigma*yw
+
+        # Update the evolution paths, covariance and step size.
+        state['generation'] += 1
+        state['ps'] = (1 - cs)*state['ps'] +\
+            np.sqrt(cs*(2 - cs)*mueff)*np.dot(state['invsqrtC'], yw)
+        psNorm = np.linalg.norm(state['ps'])
+        hsig = psNorm/np.sqrt(1 - (1 - cs)**(2*state['generation']))/state['chiN'] <\
+            1.4 + 2/(n + 1)
+        state['pc'] = (1 - cc)*state['pc'] + hsig*np.sqrt(cc*(2 - cc)*mueff)*yw
+
+        C = (1 - c1 - cmu)*state['C'] +\
+            c1*(np.outer(state['pc'], state['pc']) + (1 - hsig)*cc*(2 - cc)*state['C']) +\
+            cmu*np.matmul(Y.T*weights, Y)
+        state['sigma'] = sigma*np.exp((cs/state['damps'])*(psNorm/state['chiN'] - 1))
+
+        C = (C + C.T)/2
+        eigenvalues, B = np.linalg.eigh(C)
+        D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+        state['C'], state['B'], state['D'] = C, B, D
+        state['invsqrtC'] = np.matmul(B/D, B.T)
+
+        return state
+
+
+class DifferentialEvolution(Optimizer):
+    '''Differential evolution, current-to-best/1/bin.
+
+    The first generation is an evenly spaced sample of the initial population,
+    which keeps a warm start's prior (its first member). Each generation
+    proposes one trial per member and keeps the better of the two. Trials
+    outside the box bounce back halfway between the member and the bound.
+
+    Args:
+        maxEvaluations: evaluation budget.
+        popSize: members of the differential evolution population.
+        F: differential weight.
+        CR: crossover probability.
+    '''
+    name = 'de'
+
+    def __init__(self, maxEvaluations: int = DEFAULT_MAX_EVALUATIONS,
+                 popSize: int = 20, F: float = 0.7, CR: float = 0.9):
+        super().__init__(maxEvaluations)
+        self.popSize = popSize
+        self.F = F
+        self.CR = CR
+
+    def _start(self, X0: np.ndarray, rng: np.random.Generator) -> dict:
+        size = min(self.popSize, len(X0))
+        sample = np.round(np.linspace(0, len(X0) - 1, size)).astype(int)
+        return {'X': X0[sample], 'cost': None}
+
+    def _initialSample(self, state: dict, X0: np.ndarray) -> np.ndarray:
+        return state['X']
+
+    def _ask(self, state: dict, rng: np.random.Generator) -> np.ndarray:
+        X = state['X']
+        size, n = X.shape
+        best = X[np.argmin(state['cost'])]
+
+        # Two distinct partners per member, neither the member itself.
+        keys = rng.random((size, size))
+        np.fill_diagonal(keys, np.inf)
+        partners = np.argsort(keys, axis=1)[:, :2]
+
+        V = X + self.F*(best - X) + self.F*(X[partners[:, 0]] - X[partners[:, 1]])
+        V = np.where(V < 0, X/2, V)
+        V = np.where(V > 1, (X + 1)/2, V)
+
+        # Binomial crossover, always taking at least one coordinate from V.
+        isCrossed = rng.random((size, n)) < self.CR
+        isCrossed[np.arange(size), rng.integers(0, n, size)] = True
+
+        return np.where(isCrossed, V, X)
+
+    def _tell(self, state: dict, X: np.ndarray, cost: np.ndarray) -> dict:
+        if state['cost'] is None:
+            state['X'], state['cost'] = X, cost
+            return state
+
+        isBetter = cost <= state['cost'][:len(X)]
+        state['X'][:len(X)][isBetter] = X[isBetter]
+        state['cost'][:len(X)][isBetter] = cost[isBetter]
+
+        return state
+
+
+class _Archive:
+    '''Best members evaluated during a search, best first.'''
+
+    def __init__(self, size: int, numParameters: int):
+        self.size = size
+        self.members = np.empty((0, numParameters))
+        self.costs = np.empty(0)
+        self.evaluations = 0
+
+    def evaluate(self, evaluate, space: SearchSpace, X: np.ndarray) -> np.ndarray:
+        '''Evaluates unit-box members and keeps the best.'''
+        population = space.denormalize(X)
+        cost = np.asarray(evaluate(population), dtype=float)
+        self.evaluations += spentEvaluations(evaluate, len(X))
+
+        members = np.append(self.members, population, axis=0)
+        costs = np.append(self.costs, cost)
+        order = np.argsort(costs, kind='stable')[:self.size]
+        self.members = members[order]
+        self.costs = costs[order]
+
+        return cost
+
+
+# Engines by name, for callers that pass a string.
+OPTIMIZERS = {optimizer.name: optimizer for optimizer in (CMAES, DifferentialEvolution)}
+
+
+def getOptimizer(optimizer, maxEvaluations: int = None) -> Optimizer:
+    '''Gets a search engine.
+
+    Args:
+        optimizer: an Optimizer, the name of one in OPTIMIZERS, or None for
+            the default (mu+lambda) loop.
+        maxEvaluations: evaluation budget of an engine created by name.
+    Returns:
+        optimizer (Optimizer) - the engine, or None for the default loop
+    '''
+    if optimizer is None or isinstance(optimizer, Optimizer):
+        return optimizer
+    if optimizer not in OPTIMIZERS:
+        raise ValueError(
+            "Unknown optimizer '{}'. Choose from {}.".format(optimizer, sorted(OPTIMIZERS))
+        )
+    if maxEvaluations is None:
+        return OPTIMIZERS[optimizer]()
+
+    return OPTIMIZERS[optimizer](maxEvaluations)
+
+def splitBudget(value: int, share: float) -> Tuple[int, int]:
+    '''Splits a number of generations or evaluations into two phases.
+
+    Returns:
+        first (int) - [share] of [value], or None if [value] is None
+        rest (int) - the remainder, or None if [value] is None
+    '''
+    if value is None:
+        return None, None
+
+    first = int(round(share*value))
+    return first, value - first
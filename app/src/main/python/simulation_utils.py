@@ -0,0 +1,546 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Simulation engines for the switched linear recurrences used by the
+filters. While data is available the filter state follows one set of dynamics
+driven by the input, and across gaps (zero samples) it runs autonomously.
+
+The engines are registered as backends: 'loop' (the NumPy reference loop),
+'segment' (the vectorized segment engine) and 'numba' (a compiled kernel, which
+falls back to 'segment' when Numba is not installed). [simulate] and
+[simulateOutput] pick one per call, or from the SENSE_SIMULATION_BACKEND
+environment variable.
+'''
+import os
+import numpy as np
+
+from math import ceil
+from typing import Callable, Tuple
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Number of samples advanced together by the segment engine.
+BLOCK_SIZE = 128
+
+# Environment variable naming the default simulation backend, and the backend
+# used when it is not set.
+BACKEND_VARIABLE = 'SENSE_SIMULATION_BACKEND'
+DEFAULT_BACKEND = 'segment'
+
+# Matrix powers of recently used gap dynamics, keyed by the matrix bytes, and
+# the most bytes they may take together. A stack is n*s*s doubles for a gap of
+# n samples, so a few long gaps on fine sampling can reach tens of megabytes.
+_powerCache = {}
+_POWER_CACHE_BYTES = 32 * 2**20
+
+
+class OutputBuffer:
+    '''Reusable output array for simulations, grown only when a larger one is needed.'''
+
+    def __init__(self):
+        self._data = None
+
+    def get(self, shape) -> np.ndarray:
+        '''Gets an uninitialized array of [shape] on the buffer.'''
+        size = int(np.prod(shape))
+        if self._data is None or self._data.size < size:
+            self._data = np.empty(size)
+
+        return self._data[:size].reshape(shape)
+
+
+def findRuns(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Splits a boolean mask into runs of equal consecutive values.
+
+    Args:
+        mask: boolean mask.
+    Returns:
+        starts: index of the first sample of each run.
+        ends: index one past the last sample of each run.
+        values: mask value shared by the samples of each run.
+    '''
+    mask = np.asarray(mask, dtype=bool)
+    if mask.size == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, np.zeros(0, dtype=bool)
+
+    edges = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    starts = np.concatenate(([0], edges))
+    ends = np.concatenate((edges, [mask.size]))
+
+    return starts, ends, mask[starts]
+
+def matrixPowers(M: np.ndarray, n: int) -> np.ndarray:
+    '''Computes the powers M^0 to M^n by repeated doubling.
+
+    Args:
+        M: square matrix.
+        n: highest power to compute.
+    Returns:
+        powers (np.ndarray) - (n+1, s, s) stack where powers[k] = M^k
+    '''
+    s = M.shape[0]
+    powers = np.empty([n+1, s, s])
+    powers[0] = np.eye(s)
+
+    # powers[:filled] is known and step holds M^filled.
+    filled = 1
+    step = np.array(M, dtype=float)
+    while filled <= n:
+        count = min(filled, n+1 - filled)
+        powers[filled:filled+count] = np.matmul(powers[:count], step)
+        filled = filled + count
+        step = np.matmul(step, step)
+
+    return powers
+
+def cachedMatrixPowers(M: np.ndarray, n: int) -> np.ndarray:
+    '''Gets the powers M^0 to at least M^n, reusing those of earlier calls.
+
+    The gap dynamics are shared by every member and every simulation on the
+    same sampling time, so their powers are computed once and extended only
+    when a longer gap comes along.
+
+    Args:
+        M: square matrix.
+        n: highest power needed.
+    Returns:
+        powers (np.ndarray) - read-only stack where powers[k] = M^k
+    '''
+    M = np.ascontiguousarray(M, dtype=float)
+    key = (M.shape, M.tobytes())
+    powers = _powerCache.pop(key, None)
+    if powers is None or len(powers) <= n:
+        powers = matrixPowers(M, n)
+        powers.setflags(write=False)
+
+    # Keep the most recently used matrices that fit in _POWER_CACHE_BYTES. A
+    # stack larger than that on its own is not kept at all.
+    if powers.nbytes <= _POWER_CACHE_BYTES:
+        _powerCache[key] = powers
+    while sum(cached.nbytes for cached in _powerCache.values()) > _POWER_CACHE_BYTES:
+        del _powerCache[next(iter(_powerCache))]
+
+    return powers
+
+def clearPowerCache():
+    '''Releases the cached matrix powers, once an optimization is done.'''
+    _powerCache.clear()
+
+def simulateSwitchedLoop(x0: np.ndarray, dataMatrix: np.ndarray,
+                         dataInput: np.ndarray, gapMatrix: np.ndarray,
+                         u: np.ndarray, isData: np.ndarray) -> np.ndarray:
+    '''Reference step-by-step implementation of [simulateSwitched].
+
+    Args:
+        x0: initial state.
+        dataMatrix: dynamics matrix used when data is available.
+        dataInput: input vector used when data is available.
+        gapMatrix: autonomous dynamics matrix used across gaps.
+        u: input value applied at each step.
+        isData: whether data is available at each step.
+    Returns:
+        x (np.ndarray) - (stateLength, len(u)) state history
+    '''
+    stateLength = len(x0)
+    dataInput = np.reshape(dataInput, (-1))
+    x = np.zeros([stateLength, len(u)])
+    x[:, 0] = np.reshape(x0, (-1))
+
+    for k in range(1, len(u)):
+        if isData[k]:
+            x[:, k] = np.dot(dataMatrix, x[:, k-1]) + dataInput*u[k]
+        else:
+            x[:, k] = np.dot(gapMatrix, x[:, k-1])
+
+    return x
+
+def simulateSwitched(x0: np.ndarray, dataMatrix: np.ndarray,
+                     dataInput: np.ndarray, gapMatrix: np.ndarray,
+                     u: np.ndarray, isData: np.ndarray,
+                     blockSize: int = BLOCK_SIZE) -> np.ndarray:
+    '''Simulates the switched recurrence one run of data or gap at a time.
+
+    For k >= 1, x[k] = dataMatrix x[k-1] + dataInput u[k] where isData[k],
+    and x[k] = gapMatrix x[k-1] elsewhere. Each run is a linear time-invariant
+    recurrence, so it is advanced in blocks of [blockSize] samples: the states
+    within a block are the block's start state propagated through precomputed
+    matrix powers plus a Toeplitz convolution of the inputs with the impulse
+    response. Only the block start states are chained in Python. Gap runs are
+    autonomous, so each is produced at once from cached powers of gapMatrix.
+
+    Args:
+        x0: initial state.
+        dataMatrix: dynamics matrix used when data is available.
+        dataInput: input vector used when data is available.
+        gapMatrix: autonomous dynamics matrix used across gaps.
+        u: input value applied at each step.
+        isData: whether data is available at each step.
+        blockSize: number of samples advanced together.
+    Returns:
+        x (np.ndarray) - (stateLength, len(u)) state history
+    '''
+    stateLength = len(x0)
+    inputLength = len(u)
+    u = np.asarray(u, dtype=float)
+    x = np.zeros([stateLength, inputLength])
+    x[:, 0] = np.reshape(x0, (-1))
+    if inputLength < 2:
+        return x
+
+    blockSize = max(1, min(blockSize, inputLength-1))
+    starts, ends, values = findRuns(np.asarray(isData)[1:] != 0)
+    starts = starts + 1
+    ends = ends + 1
+
+    dataPowers = None
+    toeplitz = None
+    gapPowers = _gapPowers(gapMatrix, starts, ends, values)
+    for start, end, value in zip(starts, ends, values):
+        if value:
+            if dataPowers is None:
+                dataPowers = matrixPowers(dataMatrix, blockSize)
+                toeplitz = _impulseToeplitz(dataPowers, dataInput, blockSize)
+            x[:, start:end] = _advanceRun(
+                dataPowers, toeplitz, x[:, start-1], u[start:end], blockSize
+            )
+        else:
+            # Fast-forward the whole gap with one product.
+            x[:, start:end] = np.matmul(gapPowers[1:end-start+1], x[:, start-1]).T
+
+    return x
+
+def simulateSwitchedOutput(x0: np.ndarray, dataMatrix: np.ndarray,
+                           dataInput: np.ndarray, gapMatrix: np.ndarray,
+                           u: np.ndarray, isData: np.ndarray, C: np.ndarray,
+                           out: np.ndarray = None,
+                           blockSize: int = BLOCK_SIZE) -> np.ndarray:
+    '''Simulates the switched recurrence, keeping only the output C x.
+
+    Works like [simulateSwitched], but no state history is stored. Each block's
+    outputs come straight from its start state and inputs through C times the
+    matrix powers and the impulse response, and only the current state is
+    carried from block to block.
+
+    Args:
+        x0: initial state.
+        dataMatrix: dynamics matrix used when data is available.
+        dataInput: input vector used when data is available.
+        gapMatrix: autonomous dynamics matrix used across gaps.
+        u: input value applied at each step.
+        isData: whether data is available at each step.
+        C: output matrix.
+        out: optional array of len(u) values to write the output into.
+        blockSize: number of samples advanced together.
+    Returns:
+        yHat (np.ndarray) - output history
+    '''
+    inputLength = len(u)
+    u = np.asarray(u, dtype=float)
+    C = np.reshape(np.asarray(C, dtype=float), (-1))
+    state = np.array(np.reshape(x0, (-1)), dtype=float)
+    if out is None:
+        out = np.empty(inputLength)
+    if inputLength == 0:
+        return out
+    out[0] = np.dot(C, state)
+    if inputLength < 2:
+        return out
+
+    blockSize = max(1, min(blockSize, inputLength-1))
+    starts, ends, values = findRuns(np.asarray(isData)[1:] != 0)
+    starts = starts + 1
+    ends = ends + 1
+
+    outputPowers = None
+    gapPowers = _gapPowers(gapMatrix, starts, ends, values)
+    for start, end, value in zip(starts, ends, values):
+        if value:
+            if outputPowers is None:
+                dataPowers = matrixPowers(dataMatrix, blockSize)
+                toeplitz = _impulseToeplitz(dataPowers, dataInput, blockSize)
+                toeplitz = toeplitz.reshape(blockSize, blockSize, -1)
+                blockPower = dataPowers[blockSize]
+                # C M^k for k = 1..blockSize, C times the forced response of
+                # each sample, and the forced state at the end of a block.
+                outputPowers = np.matmul(C, dataPowers[1:])
+                outputToeplitz = np.matmul(toeplitz, C)
+                endForcing = toeplitz[:, -1, :]
+
+            for blockStart in range(start, end, blockSize):
+                length = min(blockSize, end - blockStart)
+                uBlock = u[blockStart:blockStart+length]
+                out[blockStart:blockStart+length] = np.dot(outputPowers[:length], state) +\
+                    np.dot(uBlock, outputToeplitz[:length, :length])
+                if length == blockSize:
+                    state = np.dot(blockPower, state) + np.dot(uBlock, endForcing)
+                else:
+                    state = np.dot(dataPowers[length], state) +\
+                        np.dot(uBlock, toeplitz[:length, length-1, :])
+        else:
+            # Fast-forward the whole gap.
+            length = end - start
+            out[start:end] = np.dot(np.matmul(C, gapPowers[1:length+1]), state)
+            state = np.dot(gapPowers[length], state)
+
+    return out
+
+def _gapPowers(gapMatrix: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+               values: np.ndarray) -> np.ndarray:
+    '''Gets the powers of the gap dynamics needed for the longest gap run.'''
+    isGap = ~np.asarray(values, dtype=bool)
+    if not np.any(isGap):
+        return None
+
+    return cachedMatrixPowers(gapMatrix, int(np.max(ends[isGap] - starts[isGap])))
+
+def _impulseToeplitz(powers: np.ndarray, dataInput: np.ndarray,
+                     blockSize: int) -> np.ndarray:
+    '''Builds the block convolution matrix of the impulse response M^k b.
+
+    Args:
+        powers: matrix powers M^0 to M^blockSize.
+        dataInput: input vector b.
+        blockSize: number of samples in a block.
+    Returns:
+        toeplitz (np.ndarray) - (blockSize, blockSize*s) matrix so that
+            inputs @ toeplitz gives the forced response of each block
+    '''
+    stateLength = powers.shape[1]
+    impulse = np.matmul(powers[:blockSize], np.reshape(dataInput, (-1)))
+
+    lag = np.arange(blockSize)[None, :] - np.arange(blockSize)[:, None]
+    toeplitz = impulse[np.maximum(lag, 0)]
+    toeplitz[lag < 0] = 0
+
+    return toeplitz.reshape(blockSize, blockSize*stateLength)
+
+def _advanceRun(powers: np.ndarray, toeplitz: np.ndarray, state: np.ndarray,
+                u: np.ndarray, blockSize: int) -> np.ndarray:
+    '''Advances one time-invariant run with inputs from [state].
+
+    Args:
+        powers: matrix powers M^0 to M^blockSize of the run's dynamics.
+        toeplitz: block convolution matrix of the run's impulse response.
+        state: state before the first sample of the run.
+        u: inputs of the run.
+        blockSize: number of samples in a block.
+    Returns:
+        x (np.ndarray) - (stateLength, runLength) states of the run
+    '''
+    stateLength = len(state)
+    runLength = len(u)
+    numBlocks = ceil(runLength/blockSize)
+
+    padded = np.zeros(numBlocks*blockSize)
+    padded[:runLength] = u
+    forced = np.matmul(padded.reshape(numBlocks, blockSize), toeplitz)
+    forced = forced.reshape(numBlocks, blockSize, stateLength)
+
+    # Chain the state at the start of each block.
+    blockStarts = np.empty([numBlocks, stateLength])
+    blockStarts[0] = state
+    blockPower = powers[blockSize]
+    for b in range(1, numBlocks):
+        blockStarts[b] = np.dot(blockPower, blockStarts[b-1]) + forced[b-1, -1]
+
+    # Propagate every block start through M^1 to M^blockSize at once.
+    propagator = powers[1:].transpose(2, 0, 1).reshape(stateLength, -1)
+    x = np.matmul(blockStarts, propagator).reshape(numBlocks, blockSize, stateLength)
+    x += forced
+
+    return x.reshape(-1, stateLength)[:runLength].T
+
+def simulateSwitchedBatch(x0: np.ndarray, dataMatrices: np.ndarray,
+                          dataInputs: np.ndarray, gapMatrix: np.ndarray,
+                          u: np.ndarray, isData: np.ndarray,
+                          C: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    '''Simulates the switched recurrence for a population of filters at once.
+
+    Every member shares the gap dynamics, input and output matrix, so the
+    whole population is advanced with one stacked matmul per time step, and
+    each gap run is fast-forwarded at once from cached powers of gapMatrix.
+
+    Args:
+        x0: initial state shared by every member.
+        dataMatrices: (numMembers, s, s) dynamics matrices used when data
+            is available.
+        dataInputs: (numMembers, s) input vectors used when data is available.
+        gapMatrix: autonomous dynamics matrix used across gaps.
+        u: input value applied at each step.
+        isData: whether data is available at each step.
+        C: output matrix shared by every member.
+        out: optional (numMembers, len(u)) array to write the output into.
+    Returns:
+        yHat (np.ndarray) - (numMembers, len(u)) output history
+    '''
+    numMembers, stateLength = np.shape(dataInputs)[:2]
+    inputLength = len(u)
+    dataInputs = np.reshape(dataInputs, (numMembers, stateLength, 1))
+    C = np.reshape(C, (-1))
+
+    x = np.empty([numMembers, stateLength, 1])
+    x[:] = np.reshape(x0, (stateLength, 1))
+    yHat = np.empty([numMembers, inputLength]) if out is None else out
+    yHat[:, 0] = np.dot(x[:, :, 0], C)
+
+    starts, ends, values = findRuns(np.asarray(isData)[1:] != 0)
+    starts = starts + 1
+    ends = ends + 1
+    gapPowers = _gapPowers(gapMatrix, starts, ends, values)
+
+    for start, end, value in zip(starts, ends, values):
+        if value:
+            for k in range(start, end):
+                x = np.matmul(dataMatrices, x)
+                x += dataInputs*u[k]
+                yHat[:, k] = np.dot(x[:, :, 0], C)
+        else:
+            # Fast-forward the gap: yHat[k] = C M^(k-start+1) x for the whole run.
+            outputs = np.matmul(C, gapPowers[1:end-start+1])
+            yHat[:, start:end] = np.matmul(x[:, :, 0], outputs.T)
+            x = np.matmul(gapPowers[end-start], x)
+
+    return yHat
+
+def _switchedKernel(x0: np.ndarray, dataMatrix: np.ndarray, dataInput: np.ndarray,
+                    gapMatrix: np.ndarray, u: np.ndarray, isData: np.ndarray,
+                    x: np.ndarray):
+    '''Scalar loop of the switched recurrence, filling x with one state per row.
+
+    Written in plain loops over scalars for Numba to compile.
+    '''
+    stateLength = x0.shape[0]
+    for i in range(stateLength):
+        x[0, i] = x0[i]
+
+    for k in range(1, u.shape[0]):
+        if isData[k]:
+            for i in range(stateLength):
+                total = dataInput[i]*u[k]
+                for j in range(stateLength):
+                    total += dataMatrix[i, j]*x[k-1, j]
+                x[k, i] = total
+        else:
+            for i in range(stateLength):
+                total = 0.0
+                for j in range(stateLength):
+                    total += gapMatrix[i, j]*x[k-1, j]
+                x[k, i] = total
+
+_compiledKernel = None if numba is None else numba.njit(cache=True, nogil=True)(_switchedKernel)
+
+def simulateSwitchedCompiled(x0: np.ndarray, dataMatrix: np.ndarray,
+                             dataInput: np.ndarray, gapMatrix: np.ndarray,
+                             u: np.ndarray, isData: np.ndarray) -> np.ndarray:
+    '''Runs [simulateSwitched] through the Numba-compiled kernel.
+
+    Falls back to [simulateSwitched] when Numba is not installed.
+
+    Args:
+        x0: initial state.
+        dataMatrix: dynamics matrix used when data is available.
+        dataInput: input vector used when data is available.
+        gapMatrix: autonomous dynamics matrix used across gaps.
+        u: input value applied at each step.
+        isData: whether data is available at each step.
+    Returns:
+        x (np.ndarray) - (stateLength, len(u)) state history
+    '''
+    if _compiledKernel is None:
+        return simulateSwitched(x0, dataMatrix, dataInput, gapMatrix, u, isData)
+
+    x0 = np.ascontiguousarray(np.reshape(x0, (-1)), dtype=float)
+    x = np.empty([len(u), len(x0)])
+    _compiledKernel(
+        x0, np.ascontiguousarray(dataMatrix, dtype=float),
+        np.ascontiguousarray(np.reshape(dataInput, (-1)), dtype=float),
+        np.ascontiguousarray(gapMatrix, dtype=float),
+        np.ascontiguousarray(u, dtype=float), np.asarray(isData) != 0, x
+    )
+
+    return x.T
+
+
+# Simulation backends by name: (state history engine, output-only engine or
+# None to apply C to the state history).
+_backends = {}
+
+def registerBackend(name: str, simulateStates: Callable[..., np.ndarray],
+                    simulateOutputs: Callable[..., np.ndarray] = None):
+    '''Registers a simulation backend.
+
+    Args:
+        name: name to select the backend by.
+        simulateStates: engine with the signature of [simulateSwitched].
+        simulateOutputs: optional output-only engine with the signature of
+            [simulateSwitchedOutput], without blockSize.
+    '''
+    _backends[name] = (simulateStates, simulateOutputs)
+
+def availableBackends() -> Tuple[str, ...]:
+    '''Names of the registered simulation backends.'''
+    return tuple(_backends)
+
+def _getBackend(backend: str = None):
+    '''Looks up a backend by name, defaulting to the environment variable.'''
+    if backend is None:
+        backend = os.environ.get(BACKEND_VARIABLE) or DEFAULT_BACKEND
+    if backend not in _backends:
+        raise ValueError(
+            "Unknown simulation backend '{}'. Choose from {}.".format(backend, availableBackends())
+        )
+
+    return _backends[backend]
+
+def simulate(x0: np.ndarray, dataMatrix: np.ndarray, dataInput: np.ndarray,
+             gapMatrix: np.ndarray, u: np.ndarray, isData: np.ndarray,
+             backend: str = None) -> np.ndarray:
+    '''Simulates the switched recurrence with the chosen backend.
+
+    Args:
+        x0, dataMatrix, dataInput, gapMatrix, u, isData: as in [simulateSwitched].
+        backend: backend name. Defaults to the SENSE_SIMULATION_BACKEND
+            environment variable, or 'segment' if it is not set.
+    Returns:
+        x (np.ndarray) - (stateLength, len(u)) state history
+    '''
+    simulateStates, _ = _getBackend(backend)
+    return simulateStates(x0, dataMatrix, dataInput, gapMatrix, u, isData)
+
+def simulateOutput(x0: np.ndarray, dataMatrix: np.ndarray, dataInput: np.ndarray,
+                   gapMatrix: np.ndarray, u: np.ndarray, isData: np.ndarray,
+                   C: np.ndarray, out: np.ndarray = None,
+                   backend: str = None) -> np.ndarray:
+    '''Simulates only the output C x of the switched recurrence with the chosen backend.
+
+    Args:
+        x0, dataMatrix, dataInput, gapMatrix, u, isData, C, out: as in
+            [simulateSwitchedOutput].
+        backend: backend name, as in [simulate].
+    Returns:
+        yHat (np.ndarray) - output history
+    '''
+    simulateStates, simulateOutputs = _getBackend(backend)
+    if simulateOutputs is not None:
+        return simulateOutputs(x0, dataMatrix, dataInput, gapMatrix, u, isData, C, out)
+
+    x = simulateStates(x0, dataMatrix, dataInput, gapMatrix, u, isData)
+    if out is None:
+        out = np.empty(len(u))
+    out[...] = np.dot(np.reshape(C, (-1)), x)
+
+    return out
+
+registerBackend('loop', simulateSwitchedLoop)
+registerBackend('segment', simulateSwitched, simulateSwitchedOutput)
+if _compiledKernel is None:
+    registerBackend('numba', simulateSwitched, simulateSwitchedOutput)
+else:
+    registerBackend('numba', simulateSwitchedCompiled)
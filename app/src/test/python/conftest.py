@@ -0,0 +1,31 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Shared setup of the tests of the Python filters. The modules are
+imported the way Chaquopy loads them, from the flat source directory.
+'''
+import os
+import sys
+import numpy as np
+import pytest
+
+
+PYTHON_SOURCE_DIR = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, 'main', 'python'
+))
+if PYTHON_SOURCE_DIR not in sys.path:
+    sys.path.insert(0, PYTHON_SOURCE_DIR)
+
+
+@pytest.fixture
+def heartRate():
+    '''Three days of gap-free heart rate with a circadian rhythm, sampled
+    every 5 minutes, as (t, y).
+    '''
+    rng = np.random.default_rng(3)
+    t = np.arange(0, 72, 1/12)
+    y = 70 + 8*np.sin(2*np.pi*t/24) + 3*np.sin(4*np.pi*t/24 + 1) + rng.normal(0, 5, len(t))
+
+    return t, y
@@ -0,0 +1,55 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests that the key of an optimization changes with every setting
+that changes its result, on the filter class or on the instance.
+'''
+import pytest
+
+import cache_utils
+from ObserverBasedFilter import ObserverBasedFilter
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+@pytest.mark.parametrize('filterClass, name, value', [
+    (SteadyStateKalmanFilter, '_spectralCost', 'parseval'),
+    (SteadyStateKalmanFilter, '_riccatiSolver', 'doubling'),
+    (SteadyStateKalmanFilter, '_coarseShare', 0.5),
+    (ObserverBasedFilter, '_spectralCost', 'parseval'),
+    (ObserverBasedFilter, '_mu', 50),
+])
+def testInstanceSettingChangesKey(filterClass, name, value, heartRate):
+    t, y = heartRate
+    options = {'seed': 1}
+    default = cache_utils.optimizationKey(filterClass(), t, y, options)
+
+    changed = filterClass()
+    setattr(changed, name, value)
+
+    assert cache_utils.optimizationKey(changed, t, y, options) != default
+    assert cache_utils.optimizationKey(filterClass(), t, y, options) == default
+
+def testKeyIgnoresInstanceStateThatIsNotASetting(heartRate):
+    t, y = heartRate
+    default = cache_utils.optimizationKey(SteadyStateKalmanFilter(), t, y, {})
+
+    # Like the stats and outputs set on the filter during an optimization.
+    filterObject = SteadyStateKalmanFilter()
+    filterObject._stats = object()
+    filterObject._outputs = {'yHat': y}
+
+    assert cache_utils.optimizationKey(filterObject, t, y, {}) == default
+
+def testInstanceSettingMissesCachedResult(heartRate, tmp_path):
+    t, y = heartRate
+    cache = cache_utils.OptimizationCache(str(tmp_path))
+    default = SteadyStateKalmanFilter()
+    cache.put(cache.key(default, t, y, {'seed': 1}), [[1.0]], {'bestCost': 1.0})
+
+    changed = SteadyStateKalmanFilter()
+    changed._riccatiSolver = 'doubling'
+
+    assert cache.get(cache.key(default, t, y, {'seed': 1})) is not None
+    assert cache.get(cache.key(changed, t, y, {'seed': 1})) is None
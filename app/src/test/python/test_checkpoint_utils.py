@@ -0,0 +1,139 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests of resuming an interrupted optimization from its
+checkpoint, and of ignoring checkpoints of other optimizations.
+'''
+import numpy as np
+import pytest
+
+from checkpoint_utils import Checkpoint, loadCheckpoint
+from ObserverBasedFilter import ObserverBasedFilter
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+class _KeptCheckpoint(Checkpoint):
+    '''Checkpoint left on disk after the optimization, like one killed mid-run.'''
+
+    def clear(self):
+        pass
+
+
+class _Interrupted(Exception):
+    pass
+
+
+class _InterruptingCheckpoint(Checkpoint):
+    '''Checkpoint that stops the optimization right after its Nth save, like
+    the OS killing it mid-run.
+    '''
+
+    def __init__(self, path, saves):
+        super().__init__(path)
+        self.saves = saves
+
+    def save(self, state, rng):
+        super().save(state, rng)
+        self.saves -= 1
+        if self.saves == 0:
+            raise _Interrupted()
+
+
+def _interruptedRun(filterObject, t, y, path, seed=1, **options):
+    '''Runs a short optimization and leaves its last checkpoint at [path].'''
+    filterObject.optimizeFilter(t, y, seed=seed, maxIterations=2,
+                                checkpoint=_KeptCheckpoint(path), **options)
+
+
+def testResumeOfFinishedRunReturnsSameResult(heartRate, tmp_path):
+    t, y = heartRate
+    path = str(tmp_path/'checkpoint.npz')
+    _interruptedRun(SteadyStateKalmanFilter(), t, y, path, decimation=4)
+
+    resumed = SteadyStateKalmanFilter().optimizeFilter(
+        t, y, seed=1, maxIterations=2, decimation=4, resumeFrom=path
+    )
+    uninterrupted = SteadyStateKalmanFilter().optimizeFilter(
+        t, y, seed=1, maxIterations=2, decimation=4
+    )
+
+    assert loadCheckpoint(path)['phase'] == 'full'
+    np.testing.assert_array_equal(resumed, uninterrupted)
+
+# With 6 generations, 5 of them coarse, the run saves checkpoints after coarse
+# generations 0-5, then after full generations 0 and 1.
+@pytest.mark.parametrize('filterClass', [SteadyStateKalmanFilter, ObserverBasedFilter])
+@pytest.mark.parametrize('saves, phase', [(3, 'coarse'), (6, 'coarse'), (7, 'full')])
+def testResumeOfInterruptedRunMatchesUninterruptedRun(filterClass, saves, phase,
+                                                      heartRate, tmp_path, monkeypatch):
+    t, y = heartRate
+    path = str(tmp_path/'checkpoint.npz')
+    options = {'seed': 1, 'maxIterations': 6, 'decimation': 4}
+
+    # Count the members evaluated, to tell a resumed run from a restarted one.
+    evaluated = []
+    evaluatePopulation = filterClass._evaluatePopulation
+    def countingEvaluation(self, population, **arrays):
+        evaluated.append(len(population))
+        return evaluatePopulation(self, population=population, **arrays)
+    monkeypatch.setattr(filterClass, '_evaluatePopulation', countingEvaluation)
+
+    with pytest.raises(_Interrupted):
+        filterClass().optimizeFilter(
+            t, y, checkpoint=_InterruptingCheckpoint(path, saves), **options
+        )
+    assert loadCheckpoint(path)['phase'] == phase
+
+    resumedReport, uninterruptedReport = {}, {}
+    evaluated.clear()
+    resumed = filterClass().optimizeFilter(t, y, resumeFrom=path, report=resumedReport,
+                                           **options)
+    resumedEvaluations = sum(evaluated)
+    evaluated.clear()
+    uninterrupted = filterClass().optimizeFilter(t, y, report=uninterruptedReport,
+                                                 **options)
+
+    assert resumedEvaluations < sum(evaluated)
+    np.testing.assert_array_equal(resumed, uninterrupted)
+    assert resumedReport['bestCost'] == uninterruptedReport['bestCost']
+    assert resumedReport['generations'] == uninterruptedReport['generations']
+
+def testResumeIgnoresCheckpointOfOtherData(heartRate, tmp_path):
+    t, y = heartRate
+    path = str(tmp_path/'checkpoint.npz')
+    _interruptedRun(SteadyStateKalmanFilter(), t[:576], y[:576], path)
+
+    report = {}
+    resumed = SteadyStateKalmanFilter().optimizeFilter(
+        t, y, seed=1, maxIterations=2, resumeFrom=path, report=report
+    )
+    fresh = SteadyStateKalmanFilter().optimizeFilter(t, y, seed=1, maxIterations=2)
+
+    np.testing.assert_array_equal(resumed, fresh)
+    assert report['evaluations'] > 0
+
+def testResumeIgnoresCheckpointOfOtherOptions(heartRate, tmp_path):
+    t, y = heartRate
+    path = str(tmp_path/'checkpoint.npz')
+    _interruptedRun(SteadyStateKalmanFilter(), t, y, path, seed=2)
+
+    resumed = SteadyStateKalmanFilter().optimizeFilter(
+        t, y, seed=1, maxIterations=2, resumeFrom=path
+    )
+    fresh = SteadyStateKalmanFilter().optimizeFilter(t, y, seed=1, maxIterations=2)
+
+    np.testing.assert_array_equal(resumed, fresh)
+
+def testResumeIgnoresCheckpointOfOtherFilter(heartRate, tmp_path):
+    t, y = heartRate
+    path = str(tmp_path/'checkpoint.npz')
+    _interruptedRun(SteadyStateKalmanFilter(), t, y, path)
+
+    resumed = ObserverBasedFilter().optimizeFilter(
+        t, y, seed=1, maxIterations=2, resumeFrom=path
+    )
+    fresh = ObserverBasedFilter().optimizeFilter(t, y, seed=1, maxIterations=2)
+
+    np.testing.assert_array_equal(resumed, fresh)
@@ -0,0 +1,127 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests that screened searches charge their evaluation budget with
+the evaluations they actually spend, and that a search cut short by its
+deadline reports the data its best cost was computed on.
+'''
+import numpy as np
+import pytest
+
+import evolution_utils
+import search_utils
+from evolution_utils import INT_MAX, Screening
+from ObserverBasedFilter import ObserverBasedFilter
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+def _sphere(population: np.ndarray) -> np.ndarray:
+    return np.sum(population**2, axis=1)
+
+def _screenedSphere(fractions=(0.25, 0.5)):
+    '''Screens the sphere cost through two windows, with a cost that is
+    invalid on the first window for members with a negative first parameter.
+    '''
+    def firstRung(population):
+        return np.where(population[:, 0] < 0, float(INT_MAX), _sphere(population))
+
+    return Screening(windowDays=(1, 2), keepFraction=0.5).wrap(
+        [firstRung, _sphere], _sphere, fractions=fractions
+    )
+
+
+def testScreenedEvaluationCountsWindowShares():
+    evaluate = _screenedSphere()
+    population = np.abs(np.random.default_rng(0).normal(size=(10, 2)))
+
+    cost = evaluate(population)
+
+    # 10 members on a quarter of the data, 5 on half of it, 3 on all of it.
+    assert evaluate.spent == pytest.approx(10*0.25 + 5*0.5 + 3)
+    assert evaluate.maxSpent(10) == pytest.approx(evaluate.spent)
+    assert np.sum(cost < INT_MAX) == 3
+    np.testing.assert_array_equal(cost[cost < INT_MAX], _sphere(population)[cost < INT_MAX])
+
+def testScreenedEvaluationCountsOnlyValidSurvivors():
+    evaluate = _screenedSphere()
+    population = np.abs(np.random.default_rng(1).normal(size=(10, 2)))
+    population[:8, 0] *= -1
+
+    evaluate(population)
+
+    # Only the 2 members with a valid first-window cost move on.
+    assert evaluate.spent == pytest.approx(10*0.25 + 2*0.5 + 1)
+    assert evaluate.spent < evaluate.maxSpent(10)
+
+def testEvolveWithScreeningUsesItsWholeBudget():
+    rng = np.random.default_rng(2)
+    population = rng.normal(size=(10, 2))
+    evaluate = _screenedSphere()
+    report = {}
+
+    evolution_utils.evolve(_sphere, population, rng, numOffspring=8, numParents=2,
+                           maxIterations=100, report=report, evaluateOffspring=evaluate,
+                           maxEvaluations=60)
+
+    # Each generation spends at most 8*0.25 + 4*0.5 + 2 = 6 evaluations, so
+    # the 50 left after the initial population run at least 8 generations, not
+    # the 6 of counting every offspring as a full evaluation.
+    assert report['stopReason'] == 'maxEvaluations'
+    assert report['generations'] >= 8
+    assert report['evaluations'] <= 60
+    assert 60 - report['evaluations'] < evaluate.maxSpent(8)
+
+@pytest.mark.parametrize('optimizer', [search_utils.CMAES, search_utils.DifferentialEvolution])
+def testEnginesWithScreeningStayWithinBudget(optimizer):
+    rng = np.random.default_rng(3)
+    population = rng.uniform(-1, 1, size=(10, 2))
+    space = search_utils.SearchSpace(lambda X: X, lambda X: X, np.full(2, -1.0), np.full(2, 1.0))
+    evaluate = _screenedSphere()
+    report = {}
+
+    optimizer(maxEvaluations=60).optimize(_sphere, population, space, rng, None,
+                                          report=report, evaluateOffspring=evaluate)
+
+    assert report['stopReason'] == 'maxEvaluations'
+    assert report['evaluations'] <= 60
+    assert 60 - report['evaluations'] < evaluate.maxSpent(1)
+
+def testScreenedOptimizationRunsMoreGenerationsOnItsBudget(heartRate):
+    t, y = heartRate
+    report = {}
+
+    SteadyStateKalmanFilter().optimizeFilter(
+        t, y, seed=1, maxIterations=100, maxEvaluations=300,
+        screening=Screening(windowDays=(1,), keepFraction=0.2), report=report
+    )
+
+    # The 200 evaluations after the initial population fit 4 generations of
+    # 50 offspring counted in full. Screened on a third of the data with a
+    # fifth kept, a generation spends at most 50/3 + 10, so 7 of them fit.
+    assert report['stopReason'] == 'maxEvaluations'
+    assert report['generations'] >= 7
+    assert report['evaluations'] <= 300
+
+@pytest.mark.parametrize('filterClass', [SteadyStateKalmanFilter, ObserverBasedFilter])
+def testDeadlineBeforeFullDataReportsCoarseCost(filterClass, heartRate):
+    t, y = heartRate
+    report = {}
+
+    # No time is left after the coarse generations for the full data.
+    filterClass().optimizeFilter(t, y, seed=1, maxIterations=4, decimation=4,
+                                 deadlineSeconds=1e-9, report=report)
+
+    assert report['stopReason'] == 'deadline'
+    assert report['costResolution'] == 'coarse'
+    assert report['bestCost'] == report['coarseBestCost']
+
+@pytest.mark.parametrize('filterClass', [SteadyStateKalmanFilter, ObserverBasedFilter])
+def testFullDataRunReportsFullCost(filterClass, heartRate):
+    t, y = heartRate
+    report = {}
+
+    filterClass().optimizeFilter(t, y, seed=1, maxIterations=4, decimation=4, report=report)
+
+    assert report['costResolution'] == 'full'
@@ -0,0 +1,285 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests of the vectorized filter utilities against the reference
+simulations and solvers they replace.
+'''
+import numpy as np
+import scipy.linalg
+import scipy.signal
+
+import filter_utils
+from evolution_utils import INT_MAX
+from ObserverBasedFilter import ObserverBasedFilter
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+def _shiftedInput(y: np.ndarray) -> np.ndarray:
+    '''Gets the input the filters apply at each step, the previous y value.'''
+    u = np.zeros(len(y))
+    u[1:] = y[:-1]
+    return u
+
+def _assertSpectraClose(Y: np.ndarray, yHat: np.ndarray):
+    '''Checks the output DFT bins [Y] against the FFT of a simulated yHat.'''
+    expected = np.fft.rfft(yHat)
+    np.testing.assert_allclose(Y, expected, rtol=0, atol=1e-9*np.max(np.abs(expected)))
+
+
+def testOutputDFTMatchesSSKFSimulation(heartRate):
+    t, y = heartRate
+    SSKF = SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(t)
+    Q = 1e-3*np.eye(SSKF._stateLength)
+    R = np.array([[10.0]])
+    P = scipy.linalg.solve_discrete_are(A.T, C.T, Q, R)
+    L = np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + R)
+
+    yHat = SSKF.simulateDynamics(A, C, L, y)[-1]
+
+    # The initial state's bias is the mean of y, far from zero, so its
+    # transient is part of the comparison.
+    Y, isComputed = filter_utils.computeOutputDFT(
+        (A - L*C)[None], L.T, C, SSKF._initialState(y), _shiftedInput(y)
+    )
+    assert isComputed.all()
+    _assertSpectraClose(Y[0], yHat)
+
+def testOutputDFTMatchesOBFSimulation(heartRate):
+    t, y = heartRate
+    OBF = ObserverBasedFilter()
+    population = OBF._initializePopulation(np.random.default_rng(0))
+    A, B, C, D = OBF.createStateSpaceBatch(t, population)
+    member = np.flatnonzero(filter_utils.checkStabilityBatch(A))[0]
+
+    yHat = OBF.simulateDynamics(t, y, A[member], B[member].reshape(-1, 1), C, D)[-1]
+
+    # simulateDynamics starts from a bias of 70, away from the data's mean.
+    x0 = np.zeros(OBF._stateLength)
+    x0[-1] = 70
+    Y, isComputed = filter_utils.computeOutputDFT(
+        A[member][None], B[member][None], C, x0, _shiftedInput(y)
+    )
+    assert isComputed.all()
+    _assertSpectraClose(Y[0], yHat)
+
+def testOutputDFTFlagsUnstableMembers(heartRate):
+    t, y = heartRate
+    A = np.array([[[1.01]], [[0.5]]])
+    B = np.ones((2, 1))
+    Y, isComputed = filter_utils.computeOutputDFT(A, B, np.ones((1, 1)), np.zeros(1), y)
+
+    np.testing.assert_array_equal(isComputed, [False, True])
+    assert not np.any(Y[0])
+
+def testCostPlanMatchesComputeCost():
+    rng = np.random.default_rng(4)
+    for lent, dt in ((577, 1/12), (864, 1/12), (2016, 1/60), (720, 1/2)):
+        t = dt*np.arange(lent)
+        originalSpectrum, f, _ = filter_utils.computeSpectrum(t, 70 + rng.normal(0, 5, lent))
+        yHat = 70 + rng.normal(0, 5, (3, lent))
+        filteredSpectra = np.array([filter_utils.computeSpectrum(t, row)[0] for row in yHat])
+        for order in range(1, 7):
+            plan = filter_utils.createCostPlan(lent, dt, order)
+            expected = [filter_utils.computeCost(originalSpectrum, filteredSpectrum, f, order)
+                        for filteredSpectrum in filteredSpectra]
+
+            np.testing.assert_allclose(
+                plan.computeCost(originalSpectrum, filteredSpectra), expected, rtol=1e-12
+            )
+            np.testing.assert_allclose(
+                plan.computeSignalCost(originalSpectrum, yHat), expected, rtol=1e-9
+            )
+
+def _populationCosts(filterObject, t: np.ndarray, y: np.ndarray, population: np.ndarray,
+                     spectralCost: str) -> np.ndarray:
+    '''Evaluates a population with the given spectral cost.'''
+    filterObject._spectralCost = spectralCost
+    computeSpectrum = getattr(filterObject, '_computeSpectrum', filter_utils.computeSpectrum)
+    originalSpectrum, f, _ = computeSpectrum(t, y)
+    return filterObject._evaluatePopulation(t, y, population, originalSpectrum, f)
+
+def testParsevalCostMatchesFFTCost(heartRate):
+    t, y = heartRate
+    # A gap makes both filters simulate their output instead of using the
+    # transfer function, so the selected spectral cost is used.
+    y = y.copy()
+    y[200:320] = 0
+
+    rng = np.random.default_rng(1)
+    SSKF = SteadyStateKalmanFilter()
+    Q_pop, R_pop = SSKF.initializePopulation(rng)
+    OBF = ObserverBasedFilter()
+    for filterObject, population in ((SSKF, np.append(Q_pop, R_pop, axis=1)),
+                                     (OBF, OBF._initializePopulation(rng))):
+        fftCost = _populationCosts(filterObject, t, y, population, 'fft')
+        parsevalCost = _populationCosts(filterObject, t, y, population, 'parseval')
+
+        isValid = fftCost < INT_MAX
+        assert np.count_nonzero(isValid) > 0
+        np.testing.assert_array_equal(parsevalCost < INT_MAX, isValid)
+        np.testing.assert_allclose(parsevalCost[isValid], fftCost[isValid], rtol=1e-9)
+
+def _riccatiProblems(seed: int):
+    '''Gets the SSKF's (A, C) and the (Q, R) of a random initial population.'''
+    SSKF = SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(np.arange(0, 48, 1/60))
+    Q_pop, R_pop = SSKF.initializePopulation(np.random.default_rng(seed))
+    M = Q_pop.reshape(len(Q_pop), SSKF._stateLength, -1)
+    return A, C, np.matmul(M, np.swapaxes(M, 1, 2)), R_pop.reshape(-1, 1, 1)
+
+def _scipySolutions(a, b, q, r):
+    '''Solves each member with solve_discrete_are, None where it raises.'''
+    solutions = []
+    for member in range(len(q)):
+        try:
+            solutions.append(scipy.linalg.solve_discrete_are(a, b, q[member], r[member]))
+        except (ValueError, np.linalg.LinAlgError):
+            solutions.append(None)
+    return solutions
+
+def _spectralRadius(A: np.ndarray, C: np.ndarray, P: np.ndarray, R: np.ndarray) -> float:
+    '''Gets the spectral radius of the filter dynamics A - LC for solution P.'''
+    L = np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + R)
+    return np.max(np.abs(np.linalg.eigvals(A - L*C)))
+
+def testRiccatiBatchMatchesScipy():
+    for seed in range(3):
+        A, C, Q, R = _riccatiProblems(seed)
+        P, isSolved = filter_utils.solveDiscreteAREBatch(A.T, C.T, Q, R)
+        expected = _scipySolutions(A.T, C.T, Q, R)
+
+        np.testing.assert_array_equal(isSolved, [X is not None for X in expected])
+        for member in np.flatnonzero(isSolved):
+            np.testing.assert_allclose(P[member], expected[member], rtol=1e-12, atol=0)
+
+def _referenceSSKFCosts(t: np.ndarray, y: np.ndarray, population: np.ndarray) -> np.ndarray:
+    '''Scores each [Q | R] member on its own, the way the original loop did:
+    solve_discrete_are, reject unstable filter dynamics, simulate and compute
+    the cost from the full spectrum.'''
+    SSKF = SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(t)
+    originalSpectrum, f, _ = filter_utils.computeSpectrum(t, y)
+    cost = np.full(len(population), float(INT_MAX))
+    for member, params in enumerate(population):
+        Q = params[:-1].reshape(SSKF._stateLength, -1)
+        Q = np.matmul(Q, Q.T)
+        R = params[-1].reshape(1, 1)
+        try:
+            P = scipy.linalg.solve_discrete_are(A.T, C.T, Q, R)
+        except (ValueError, np.linalg.LinAlgError):
+            continue
+        L = np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + R)
+        if np.max(np.abs(np.linalg.eigvals(A - L*C))) > 1:
+            continue
+        yHat = SSKF.simulateDynamics(A, C, L, y, backend='loop')[-1, :]
+        filteredSpectrum, _, _ = filter_utils.computeSpectrum(t, yHat)
+        cost[member] = filter_utils.computeCost(originalSpectrum, filteredSpectrum, f, SSKF._order)
+
+    return cost
+
+def testSSKFPopulationCostsMatchScipyMemberByMember(heartRate):
+    t, y = heartRate
+    gappy = y.copy()
+    gappy[200:320] = 0
+
+    SSKF = SteadyStateKalmanFilter()
+    for seed, data in ((0, y), (1, y), (2, gappy)):
+        Q_pop, R_pop = SSKF.initializePopulation(np.random.default_rng(seed))
+        population = np.append(Q_pop, R_pop, axis=1)
+        expected = _referenceSSKFCosts(t, data, population)
+        cost = _populationCosts(SSKF, t, data, population, 'fft')
+
+        # The same members are rejected, and the rest score the same.
+        isValid = expected < INT_MAX
+        np.testing.assert_array_equal(cost < INT_MAX, isValid)
+        np.testing.assert_allclose(cost[isValid], expected[isValid], rtol=1e-9)
+
+def testDoublingRiccatiMatchesScipyOnWellConditionedProblems():
+    rng = np.random.default_rng(4)
+    a = rng.normal(size=(3, 3))
+    a *= 0.9/np.max(np.abs(np.linalg.eigvals(a)))
+    b = rng.normal(size=(3, 1))
+    M = rng.normal(size=(20, 3, 3))
+    q = np.matmul(M, np.swapaxes(M, 1, 2)) + np.eye(3)
+    r = rng.uniform(0.5, 2, (20, 1, 1))
+
+    X, isSolved = filter_utils.solveDiscreteAREBatch(a, b, q, r, 'doubling')
+    assert isSolved.all()
+    for member, expected in enumerate(_scipySolutions(a, b, q, r)):
+        np.testing.assert_allclose(X[member], expected, rtol=1e-10, atol=0)
+
+def testDoublingRiccatiKeepsStrictlyStabilizingSolutions():
+    for seed in range(3):
+        A, C, Q, R = _riccatiProblems(seed)
+        P, isSolved = filter_utils.solveDiscreteAREBatch(A.T, C.T, Q, R, 'doubling')
+        expected = _scipySolutions(A.T, C.T, Q, R)
+
+        # Members scipy solves are never rejected, and the doubling solutions
+        # kept are strictly stabilizing. The rest come from scipy.
+        for member, X in enumerate(expected):
+            assert isSolved[member] or X is None
+            if isSolved[member] and not (X is not None and np.array_equal(P[member], X)):
+                assert _spectralRadius(A, C, P[member], R[member]) < 1
+
+def testDoublingRiccatiFallsBackToScipy():
+    # Q leaves the marginally stable oscillator unexcited, so the doubling
+    # iteration converges to a solution that is not strictly stabilizing.
+    A, C, _, _ = _riccatiProblems(0)
+    Q = np.diag([0.0, 0.0, 1.0])[None]
+    R = np.array([[[1e4]]])
+    P, isSolved = filter_utils.solveDiscreteAREBatch(A.T, C.T, Q, R, 'doubling')
+
+    assert isSolved[0]
+    np.testing.assert_array_equal(P[0], scipy.linalg.solve_discrete_are(A.T, C.T, Q[0], R[0]))
+
+def _scipyStateSpace(OBF: ObserverBasedFilter, dt: float, L: np.ndarray) -> tuple:
+    '''The original ObserverBasedFilter.createStateSpace, through scipy's StateSpace.'''
+    L = np.array(L).reshape(OBF._stateLength, 1)
+    Ac = np.zeros([OBF._stateLength, OBF._stateLength])
+    Cc = np.zeros([1, OBF._stateLength])
+    for k in range(OBF._order):
+        i = (1 + k) * 2
+        k = k + 1
+        Ac[i - 2:i, i - 2:i] = [[0, 1], [float(-(k * OBF._omg) ** 2), 0]]
+        Cc[0][i-1] = (2 * OBF._zeta) / (k * OBF._omg)
+    Cc[0][len(Cc[0])-1] = 1
+
+    discSystem = scipy.signal.StateSpace(Ac - L*Cc, L, Cc, 0).to_discrete(dt)
+    return discSystem.A, discSystem.B, discSystem.C, discSystem.D
+
+def _assertStateSpacesMatchScipy(order: int):
+    for dt in (1/60, 1/12, 1.0):
+        OBF = ObserverBasedFilter()
+        OBF._order, OBF._stateLength = order, 2*order + 1
+        t = np.arange(0, 72, dt)
+        population = OBF._initializePopulation(np.random.default_rng(order))[:40]
+
+        A, B, C, D = OBF.createStateSpaceBatch(t, population)
+        for member, L in enumerate(population):
+            expected = _scipyStateSpace(OBF, dt, L)
+            np.testing.assert_allclose(A[member], expected[0], rtol=1e-10, atol=1e-12)
+            np.testing.assert_allclose(B[member], expected[1].ravel(), rtol=1e-10, atol=1e-12)
+            np.testing.assert_array_equal(C, expected[2])
+            np.testing.assert_array_equal(D, expected[3])
+
+        # Across gaps, the filter runs the dynamics without a gain.
+        autonomous = _scipyStateSpace(OBF, dt, np.zeros(OBF._stateLength))[0]
+        np.testing.assert_allclose(OBF.autonomousDynamics(t), autonomous, rtol=1e-10, atol=1e-12)
+
+def testOBFStateSpacesMatchScipyMemberByMember():
+    for order in (1, 3):
+        _assertStateSpacesMatchScipy(order)
+
+def testOBFStateSpacesMatchScipyWithoutStackedExpm(monkeypatch):
+    # SciPy before 1.9 only exponentiates one matrix per call.
+    expm = filter_utils.expm
+    def singleExpm(M):
+        if np.ndim(M) != 2:
+            raise ValueError('expected a square matrix')
+        return expm(M)
+    monkeypatch.setattr(filter_utils, 'expm', singleExpm)
+
+    _assertStateSpacesMatchScipy(3)
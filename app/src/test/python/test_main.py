@@ -0,0 +1,207 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests of the entry points the app calls, against the original
+implementations they replace.
+'''
+import numpy as np
+import pytest
+from numpy import pi
+
+import filter_utils
+import main_obf
+import main_sskf
+from ObserverBasedFilter import ObserverBasedFilter
+
+
+# Five-minute sampling.
+POINTS_PER_DAY = 288
+
+
+def _referenceDailyPhase(xHat1: np.ndarray, xHat2: np.ndarray, numDays: int,
+                         numDataPointsPerDay: int, omg: float) -> np.ndarray:
+    '''The original per-day loop of filter_utils.estimateAverageDailyPhase.'''
+    theta = np.mod(-np.arctan2(xHat2, omg*xHat1) + pi/2, 2*pi) - pi
+
+    averageDailyPhase = np.zeros([1, numDays], dtype=float)
+    for i in range(0, numDays):
+        day2RangeStart = (numDataPointsPerDay*i)
+        day2RangeEnd = (numDataPointsPerDay*(i+1))
+        averageDailyPhase[0, i] = (1/omg)*np.mean(
+            np.unwrap(theta[0, 0:numDataPointsPerDay]) -
+            np.unwrap(theta[0, day2RangeStart:day2RangeEnd]),
+            axis=0
+        )
+
+    return np.mod(12+averageDailyPhase, 24) - 12
+
+def _referenceMainPhase(xHat1In: np.ndarray, xHat2In: np.ndarray, numDays: int,
+                        numDaysOffset: int, numDataPointsPerDay: int, omg: float) -> np.ndarray:
+    '''The original estimateAverageDailyPhase of main_sskf and main_obf.'''
+    xHat1 = np.array(xHat1In).reshape([1, numDays * numDataPointsPerDay])
+    xHat2 = np.array(xHat2In).reshape([1, numDays * numDataPointsPerDay])
+    xHat1 = xHat1[:, numDaysOffset*numDataPointsPerDay:]
+    xHat2 = xHat2[:, numDaysOffset*numDataPointsPerDay:]
+
+    averageDailyPhase = _referenceDailyPhase(xHat1, xHat2, numDays-numDaysOffset,
+                                             numDataPointsPerDay, omg)
+
+    idx = np.argsort(averageDailyPhase)
+    return np.append(averageDailyPhase, idx, axis=0)
+
+def _heartRateDays(numDays: float, seed: int, shift: float = 0) -> tuple:
+    '''Heart rate over [numDays] days, with its rhythm drifting by [shift]
+    hours a day and with gaps, as (t, y).
+    '''
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(round(numDays*POINTS_PER_DAY)))*24/POINTS_PER_DAY
+    phase = 2*pi*(t - shift*t/24)/24
+    y = 70 + 8*np.sin(phase) + 3*np.sin(2*phase + 1) + rng.normal(0, 5, len(t))
+
+    # A missing afternoon, scattered missing samples, and a missing last hour.
+    y[POINTS_PER_DAY + 150:POINTS_PER_DAY + 200] = 0
+    y[rng.choice(len(y), len(y)//50, replace=False)] = 0
+    y[-12:] = 0
+
+    return t, y
+
+def _obfStates(t: np.ndarray, y: np.ndarray) -> tuple:
+    '''Gets the first two states of the OBF on the data.'''
+    L = ObserverBasedFilter()._initializePopulation(np.random.default_rng(0))[0]
+    xHat = main_obf.simulateDynamics(t, y, L, backend='loop')
+    return xHat[0], xHat[1]
+
+
+@pytest.mark.parametrize('numDays', [1, 2, 5])
+def testDailyPhaseMatchesReferenceLoop(numDays):
+    omg = ObserverBasedFilter()._omg
+    t, y = _heartRateDays(5, seed=numDays, shift=0.5)
+    xHat1, xHat2 = _obfStates(t, y)
+
+    expected = _referenceDailyPhase(xHat1[None], xHat2[None], numDays, POINTS_PER_DAY, omg)
+    averageDailyPhase = filter_utils.estimateAverageDailyPhase(
+        xHat1[None], xHat2[None], numDays, POINTS_PER_DAY, omg
+    )
+
+    assert averageDailyPhase.shape == expected.shape
+    np.testing.assert_allclose(averageDailyPhase, expected, rtol=0, atol=1e-12)
+
+def testDailyPhaseIgnoresTrailingPartialDay():
+    omg = ObserverBasedFilter()._omg
+    t, y = _heartRateDays(4.4, seed=1, shift=-1)
+    xHat1, xHat2 = _obfStates(t, y)
+
+    # The samples after the last whole day are left out, as by the loop.
+    expected = _referenceDailyPhase(xHat1[None], xHat2[None], 4, POINTS_PER_DAY, omg)
+    averageDailyPhase = filter_utils.estimateAverageDailyPhase(
+        xHat1[None], xHat2[None], 4, POINTS_PER_DAY, omg
+    )
+
+    np.testing.assert_allclose(averageDailyPhase, expected, rtol=0, atol=1e-12)
+
+def testDailyPhaseOfZeroStates():
+    # A day of zero states, like one filtered from no data at all, has zero phase.
+    omg = ObserverBasedFilter()._omg
+    t, y = _heartRateDays(3, seed=2)
+    xHat1, xHat2 = _obfStates(t, y)
+    xHat1[POINTS_PER_DAY:2*POINTS_PER_DAY] = 0
+    xHat2[POINTS_PER_DAY:2*POINTS_PER_DAY] = 0
+
+    expected = _referenceDailyPhase(xHat1[None], xHat2[None], 3, POINTS_PER_DAY, omg)
+    averageDailyPhase = filter_utils.estimateAverageDailyPhase(
+        xHat1[None], xHat2[None], 3, POINTS_PER_DAY, omg
+    )
+
+    np.testing.assert_allclose(averageDailyPhase, expected, rtol=0, atol=1e-12)
+
+def testDailyPhaseOfStackedUsersMatchesEachUser():
+    omg = ObserverBasedFilter()._omg
+    states = [_obfStates(*_heartRateDays(4, seed=seed, shift=seed - 1)) for seed in range(3)]
+    xHat1 = np.stack([x1 for x1, _ in states])
+    xHat2 = np.stack([x2 for _, x2 in states])
+
+    averageDailyPhase = filter_utils.estimateAverageDailyPhase(xHat1, xHat2, 4, POINTS_PER_DAY, omg)
+
+    assert averageDailyPhase.shape == (3, 4)
+    for user, (x1, x2) in enumerate(states):
+        expected = _referenceDailyPhase(x1[None], x2[None], 4, POINTS_PER_DAY, omg)
+        np.testing.assert_allclose(averageDailyPhase[user], expected[0], rtol=0, atol=1e-12)
+
+@pytest.mark.parametrize('main', [main_sskf, main_obf])
+@pytest.mark.parametrize('numDaysOffset', [0, 2])
+def testMainDailyPhaseMatchesReference(main, numDaysOffset):
+    omg = ObserverBasedFilter()._omg
+    t, y = _heartRateDays(5, seed=3, shift=1)
+    xHat1, xHat2 = _obfStates(t, y)
+
+    expected = _referenceMainPhase(xHat1, xHat2, 5, numDaysOffset, POINTS_PER_DAY, omg)
+    averageDailyPhase = main.estimateAverageDailyPhase(xHat1, xHat2, 5, numDaysOffset,
+                                                       POINTS_PER_DAY)
+
+    np.testing.assert_allclose(averageDailyPhase[0], expected[0], rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(averageDailyPhase[1], expected[1])
+
+def _referenceSSKFSimulation(t: np.ndarray, y: np.ndarray, filterParams: np.ndarray,
+                             xHat0: np.ndarray) -> np.ndarray:
+    '''The original per-sample loop of SteadyStateKalmanFilter.simulateDynamics.'''
+    SSKF = main_sskf.SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(t)
+    L = main_sskf._computeGain(SSKF, A, C, filterParams)
+
+    xHat = np.zeros([SSKF._stateLength, len(y)])
+    xHat[:, 0] = xHat0
+    for i in range(1, len(y)):
+        if y[i] == 0:
+            xHat[:, i] = np.dot(A, xHat[:, i-1])
+        else:
+            xHat[:, i] = np.dot(A - np.dot(L, C), xHat[:, i-1]) + np.reshape(L*y[i-1], (-1))
+
+    return np.append(xHat, np.matmul(C, xHat), axis=0)
+
+def _advanceDaily(main, t: np.ndarray, y: np.ndarray, params: np.ndarray,
+                  days: list) -> tuple:
+    '''Filters the first chunk, then advances over each following one.
+
+    Returns the first chunk's output and the outputs of every chunk.
+    '''
+    bounds = [day*POINTS_PER_DAY for day in days] + [len(y)]
+    first = main.simulateDynamics(t[:bounds[0]], y[:bounds[0]], params)
+    outputs = [first]
+    state = first[:-1, -1]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        state, filterOutput = main.advance(t[start:end], y[start:end], params, state, y[start-1])
+        np.testing.assert_array_equal(state, filterOutput[:-1, -1])
+        outputs.append(filterOutput)
+
+    return first, np.concatenate(outputs, axis=1)
+
+def _sskfParams() -> np.ndarray:
+    '''Gets [Q | R] parameters of a typical SSKF.'''
+    return np.append(np.diag([0.03, 0.03, 0.01]).ravel(), 1e3)[None]
+
+def testSSKFAdvanceMatchesWholeHistory():
+    t, y = _heartRateDays(6, seed=4, shift=0.5)
+    # A new day that starts on a gap, after a day that ends on one.
+    y[3*POINTS_PER_DAY - 5:3*POINTS_PER_DAY + 7] = 0
+    params = _sskfParams()
+
+    first, advanced = _advanceDaily(main_sskf, t, y, params, [2, 3, 4, 5])
+
+    # The SSKF starts from the mean of the first chunk, so the whole history is
+    # re-simulated from the same state.
+    expected = _referenceSSKFSimulation(t, y, params, first[:-1, 0])
+    assert advanced.shape == expected.shape
+    np.testing.assert_allclose(advanced, expected, rtol=0, atol=1e-10*np.max(np.abs(expected)))
+
+def testOBFAdvanceMatchesWholeHistory():
+    t, y = _heartRateDays(6, seed=5, shift=-0.5)
+    y[3*POINTS_PER_DAY - 5:3*POINTS_PER_DAY + 7] = 0
+    L = ObserverBasedFilter()._initializePopulation(np.random.default_rng(1))[0]
+
+    first, advanced = _advanceDaily(main_obf, t, y, L, [2, 3, 4, 5])
+    expected = main_obf.simulateDynamics(t, y, L, backend='loop')
+
+    assert advanced.shape == expected.shape
+    np.testing.assert_allclose(advanced, expected, rtol=0, atol=1e-10*np.max(np.abs(expected)))
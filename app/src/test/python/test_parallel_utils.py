@@ -0,0 +1,43 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests that evaluating the population across worker processes
+gives the same optimization as evaluating it in this process.
+'''
+import multiprocessing
+import sys
+import numpy as np
+import pytest
+
+import parallel_utils
+from ObserverBasedFilter import ObserverBasedFilter
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+@pytest.mark.parametrize('filterClass', [SteadyStateKalmanFilter, ObserverBasedFilter])
+def testWorkersMatchSerialEvaluation(filterClass, heartRate):
+    t, y = heartRate
+    y = y.copy()
+    y[300:340] = 0
+
+    serialReport, parallelReport = {}, {}
+    serial = filterClass().optimizeFilter(t, y, seed=5, maxIterations=3, report=serialReport)
+    parallel = filterClass().optimizeFilter(t, y, workers=2, seed=5, maxIterations=3,
+                                            report=parallelReport)
+
+    np.testing.assert_array_equal(parallel, serial)
+    assert parallelReport['bestCost'] == serialReport['bestCost']
+
+def testPoolFallsBackToSerialWithoutSharedMemory(monkeypatch):
+    # Importing a module set to None in sys.modules raises ImportError, like
+    # on a platform without shm_open.
+    monkeypatch.setitem(sys.modules, 'multiprocessing.shared_memory', None)
+    monkeypatch.delattr(multiprocessing, 'shared_memory', raising=False)
+    filterObject = SteadyStateKalmanFilter()
+
+    with parallel_utils.WorkerPool(filterObject, workers=2) as pool:
+        assert pool.pool is None
+        with parallel_utils.PopulationEvaluator(filterObject, pool) as evaluator:
+            assert evaluator._pool is None
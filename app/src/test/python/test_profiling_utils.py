@@ -0,0 +1,44 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests that the profiling stages of the population evaluation time
+the transforms of the filter outputs apart from the cost.
+'''
+import pytest
+
+from ObserverBasedFilter import ObserverBasedFilter
+from profiling_utils import OptimizationStats
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+@pytest.mark.parametrize('filterClass', [SteadyStateKalmanFilter, ObserverBasedFilter])
+@pytest.mark.parametrize('spectralCost', ['fft', 'parseval'])
+def testTransformsAreTimedApartFromCost(filterClass, spectralCost, heartRate):
+    t, y = heartRate
+    y = y.copy()
+    # Gaps make every member go through a simulation and its transform.
+    y[300:340] = 0
+    filterObject = filterClass()
+    filterObject._spectralCost = spectralCost
+    stats = OptimizationStats()
+
+    filterObject.optimizeFilter(t, y, seed=1, maxIterations=2, stats=stats)
+
+    stages = stats.asDict()['stages']
+    assert stages['fft']['calls'] > 0
+    assert stages['fft']['calls'] == stages['cost']['calls']
+    assert stages['simulation']['calls'] == stages['fft']['calls']
+
+@pytest.mark.parametrize('filterClass', [SteadyStateKalmanFilter, ObserverBasedFilter])
+def testGapFreeDataSkipsTransforms(filterClass, heartRate):
+    t, y = heartRate
+    stats = OptimizationStats()
+
+    # The output spectra come from the transfer functions instead.
+    filterClass().optimizeFilter(t, y, seed=1, maxIterations=2, stats=stats)
+
+    stages = stats.asDict()['stages']
+    assert 'fft' not in stages
+    assert stages['transferFunction']['calls'] > 0
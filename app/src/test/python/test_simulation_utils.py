@@ -0,0 +1,254 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Tests of the simulation backends against the original
+step-by-step loop of the filters, on data with and without gaps.
+'''
+import numpy as np
+import pytest
+import scipy.linalg
+
+import simulation_utils
+from ObserverBasedFilter import ObserverBasedFilter
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+def _gapPatterns(length: int) -> dict:
+    '''Gets masks of the samples to zero out, by name.'''
+    isGap = {name: np.zeros(length, dtype=bool) for name in
+             ('noGaps', 'leading', 'trailing', 'backToBack', 'long', 'allGaps')}
+    isGap['leading'][:37] = True
+    isGap['trailing'][-53:] = True
+    # Gaps separated by single data samples, and runs of one sample.
+    for start in range(100, 400, 7):
+        isGap['backToBack'][start:start+6] = True
+    isGap['backToBack'][500] = True
+    isGap['backToBack'][502] = True
+    # Longer than a block of the segment engine.
+    isGap['long'][200:200 + 3*simulation_utils.BLOCK_SIZE + 5] = True
+    isGap['allGaps'][:] = True
+
+    return isGap
+
+def _referenceSimulation(A: np.ndarray, C: np.ndarray, L: np.ndarray,
+                         y: np.ndarray, xHat0: np.ndarray) -> np.ndarray:
+    '''The original per-sample loop of SteadyStateKalmanFilter.simulateDynamics.'''
+    stateLength = A.shape[0]
+    xHat = np.zeros([stateLength, len(y)])
+    xHat[:, 0] = xHat0
+    for i in range(1, len(y)):
+        if y[i] == 0:
+            xHat[:, i] = np.reshape(np.dot(A, xHat[:, i-1]), (stateLength))
+        else:
+            xHat[:, i] = np.reshape(np.dot((A - np.dot(L, C)), xHat[:, i-1]), (-1)) +\
+                np.reshape(L*y[i-1], (-1))
+
+    return np.append(xHat, np.matmul(C, xHat), axis=0)
+
+def _gain(SSKF: SteadyStateKalmanFilter, A: np.ndarray, C: np.ndarray) -> np.ndarray:
+    '''Gets the steady-state gain of a typical [Q | R] member.'''
+    Q = np.diag([1e-3, 1e-3, 1e-4])
+    P = scipy.linalg.solve_discrete_are(A.T, C.T, Q, np.array([[1e3]]))
+    return np.dot(A, np.dot(P, C.T))/(np.dot(C, np.dot(P, C.T)) + 1e3)
+
+
+@pytest.mark.parametrize('backend', ['loop', 'segment', 'numba'])
+def testBackendsMatchReferenceLoop(backend, heartRate):
+    t, y = heartRate
+    SSKF = SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(t)
+    L = _gain(SSKF, A, C)
+
+    for name, isGap in _gapPatterns(len(y)).items():
+        data = np.where(isGap, 0, y)
+        expected = _referenceSimulation(A, C, L, data, SSKF._initialState(data))
+        filterOutput = SSKF.simulateDynamics(A, C, L, data, backend=backend)
+
+        np.testing.assert_allclose(filterOutput, expected, rtol=0,
+                                   atol=1e-10*np.max(np.abs(expected)), err_msg=name)
+
+@pytest.mark.parametrize('backend', ['loop', 'segment', 'numba'])
+def testBackendsFastForwardAllGapsFromInitialState(backend):
+    # All gaps from a nonzero state: only the autonomous dynamics run.
+    SSKF = SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(np.arange(0, 72, 1/12))
+    L = _gain(SSKF, A, C)
+    xHat0 = np.array([3.0, -2.0, 70.0])
+    y = np.zeros(600)
+
+    expected = _referenceSimulation(A, C, L, y, xHat0)[:-1]
+    xHat = simulation_utils.simulate(xHat0, A - np.dot(L, C), L, A, np.zeros(len(y)), y, backend)
+
+    np.testing.assert_allclose(xHat, expected, rtol=0, atol=1e-10*np.max(np.abs(expected)))
+
+def testBatchMatchesLoopMemberByMember(heartRate):
+    t, y = heartRate
+    OBF = ObserverBasedFilter()
+    population = OBF._initializePopulation(np.random.default_rng(4))[:20]
+    A, B, C, D = OBF.createStateSpaceBatch(t, population)
+    gapMatrix = OBF.autonomousDynamics(t)
+    x0 = np.zeros(OBF._stateLength)
+    x0[-1] = 70
+    outputs = simulation_utils.OutputBuffer()
+
+    for name, isGap in _gapPatterns(len(y)).items():
+        u = np.append(0, np.where(isGap, 0, y)[:-1])
+        isData = u != 0
+        yHat = simulation_utils.simulateSwitchedBatch(
+            x0, A, B, gapMatrix, u, isData, C, out=outputs.get((len(population), len(u)))
+        )
+
+        for member in range(len(population)):
+            expected = np.dot(C, simulation_utils.simulateSwitchedLoop(
+                x0, A[member], B[member], gapMatrix, u, isData))[0]
+            # Unstable members grow, so compare finite outputs on their own scale.
+            if not np.all(np.isfinite(expected)):
+                continue
+            np.testing.assert_allclose(yHat[member], expected, rtol=0,
+                                       atol=1e-9*np.max(np.abs(expected)),
+                                       err_msg='{} member {}'.format(name, member))
+
+def testPowerCacheMatchesPowersAndStaysWithinLimit(monkeypatch):
+    simulation_utils.clearPowerCache()
+    rng = np.random.default_rng(6)
+    matrices = [np.eye(3) + 0.01*rng.normal(size=(3, 3)) for _ in range(6)]
+    # Room for three stacks of 101 powers of a 3x3 matrix.
+    stackBytes = 101*3*3*8
+    monkeypatch.setattr(simulation_utils, '_POWER_CACHE_BYTES', 3*stackBytes + stackBytes//2)
+
+    for M in matrices:
+        powers = simulation_utils.cachedMatrixPowers(M, 100)
+        np.testing.assert_allclose(powers, simulation_utils.matrixPowers(M, 100), rtol=1e-12)
+        assert not powers.flags.writeable
+        cachedBytes = sum(cached.nbytes for cached in simulation_utils._powerCache.values())
+        assert cachedBytes <= simulation_utils._POWER_CACHE_BYTES
+
+    # Only the three most recently used are left.
+    assert len(simulation_utils._powerCache) == 3
+    assert simulation_utils.cachedMatrixPowers(matrices[-1], 50) is powers
+
+    # Using one again makes it the most recent, so the next eviction skips it.
+    simulation_utils.cachedMatrixPowers(matrices[3], 100)
+    simulation_utils.cachedMatrixPowers(matrices[0], 100)
+    keys = [key[1] for key in simulation_utils._powerCache]
+    assert matrices[4].tobytes() not in keys
+    assert matrices[3].tobytes() in keys
+
+    # A longer gap extends the stack; one too large to keep is not cached.
+    assert len(simulation_utils.cachedMatrixPowers(matrices[0], 120)) == 121
+    simulation_utils.cachedMatrixPowers(matrices[1], 1000)
+    assert matrices[1].tobytes() not in [key[1] for key in simulation_utils._powerCache]
+    cachedBytes = sum(cached.nbytes for cached in simulation_utils._powerCache.values())
+    assert cachedBytes <= simulation_utils._POWER_CACHE_BYTES
+
+    simulation_utils.clearPowerCache()
+    assert len(simulation_utils._powerCache) == 0
+
+def testPowerCacheStaysWithinDefaultLimit():
+    simulation_utils.clearPowerCache()
+    # 9 stacks of 7x7 powers over a 12-day gap at one sample a minute, 6.5 MiB each.
+    rng = np.random.default_rng(7)
+    for _ in range(9):
+        simulation_utils.cachedMatrixPowers(np.eye(7) + 1e-3*rng.normal(size=(7, 7)), 17280)
+        cachedBytes = sum(cached.nbytes for cached in simulation_utils._powerCache.values())
+        assert cachedBytes <= 32 * 2**20
+
+    assert len(simulation_utils._powerCache) == 4
+    simulation_utils.clearPowerCache()
+
+@pytest.mark.parametrize('backend', ['loop', 'segment', 'numba'])
+def testOutputOnlyMatchesFullSimulation(backend, heartRate):
+    t, y = heartRate
+    SSKF = SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(t)
+    L = _gain(SSKF, A, C)
+    buffer = np.empty(len(y))
+
+    for name, isGap in _gapPatterns(len(y)).items():
+        data = np.where(isGap, 0, y)
+        expected = SSKF.simulateDynamics(A, C, L, data, backend='loop')[-1]
+
+        yHat = SSKF.simulateDynamics(A, C, L, data, yHatOnly=True, backend=backend)
+        np.testing.assert_allclose(yHat, expected, rtol=0,
+                                   atol=1e-10*np.max(np.abs(expected)), err_msg=name)
+
+        # Written into the buffer it is given, over the previous pattern's output.
+        yHat = SSKF.simulateDynamics(A, C, L, data, out=buffer, yHatOnly=True, backend=backend)
+        assert yHat is buffer
+        np.testing.assert_allclose(buffer, expected, rtol=0,
+                                   atol=1e-10*np.max(np.abs(expected)), err_msg=name)
+
+def testSegmentOutputMatchesLoopForEveryBlockSize(heartRate):
+    t, y = heartRate
+    SSKF = SteadyStateKalmanFilter()
+    A, B, C, D = SSKF.createStateSpace(t)
+    L = _gain(SSKF, A, C)
+    xHat0 = np.array([0.0, 0.0, np.mean(y)])
+
+    for name, isGap in _gapPatterns(len(y)).items():
+        u = np.append(0, np.where(isGap, 0, y)[:-1])
+        isData = ~isGap
+        expected = np.dot(C, simulation_utils.simulateSwitchedLoop(
+            xHat0, A - np.dot(L, C), L, A, u, isData))[0]
+
+        for blockSize in (1, 5, simulation_utils.BLOCK_SIZE, 10*len(y)):
+            yHat = simulation_utils.simulateSwitchedOutput(
+                xHat0, A - np.dot(L, C), L, A, u, isData, C, blockSize=blockSize
+            )
+            np.testing.assert_allclose(yHat, expected, rtol=0,
+                                       atol=1e-10*np.max(np.abs(expected)),
+                                       err_msg='{} {}'.format(name, blockSize))
+
+def testOutputBufferGrowsOnlyWhenNeeded():
+    outputs = simulation_utils.OutputBuffer()
+    large = outputs.get((4, 100))
+    small = outputs.get((3, 50))
+    assert large.shape == (4, 100) and small.shape == (3, 50)
+    assert np.shares_memory(large, small)
+
+    larger = outputs.get((5, 100))
+    assert not np.shares_memory(large, larger)
+    assert np.shares_memory(larger, outputs.get((4, 100)))
+
+def testBackendDefaultsToEnvironmentVariable(monkeypatch):
+    calls = []
+    def recordingLoop(*args):
+        calls.append('loop')
+        return simulation_utils.simulateSwitchedLoop(*args)
+    monkeypatch.setattr(simulation_utils, '_backends', dict(simulation_utils._backends))
+    simulation_utils.registerBackend('recording', recordingLoop)
+    monkeypatch.setenv(simulation_utils.BACKEND_VARIABLE, 'recording')
+
+    A = np.array([[0.9, 0.1], [0.0, 0.8]])
+    u = np.arange(1.0, 11.0)
+    isData = np.ones(10, dtype=bool)
+    expected = simulation_utils.simulateSwitchedLoop(np.ones(2), A, np.ones(2), A, u, isData)
+
+    np.testing.assert_array_equal(
+        simulation_utils.simulate(np.ones(2), A, np.ones(2), A, u, isData), expected
+    )
+    assert calls == ['loop']
+    assert 'recording' in simulation_utils.availableBackends()
+
+def testBackendWithoutOutputEngineAppliesOutputMatrix(monkeypatch):
+    monkeypatch.setattr(simulation_utils, '_backends', dict(simulation_utils._backends))
+    simulation_utils.registerBackend('statesOnly', simulation_utils.simulateSwitchedLoop)
+
+    A = np.array([[0.9, 0.1], [0.0, 0.8]])
+    C = np.array([[1.0, 2.0]])
+    u = np.arange(1.0, 11.0)
+    isData = u % 3 != 0
+    expected = np.dot(C, simulation_utils.simulateSwitchedLoop(np.ones(2), A, np.ones(2), A, u, isData))[0]
+    out = np.empty(10)
+
+    yHat = simulation_utils.simulateOutput(np.ones(2), A, np.ones(2), A, u, isData, C, out,
+                                           backend='statesOnly')
+    assert yHat is out
+    np.testing.assert_allclose(yHat, expected, rtol=1e-14)
+
+def testUnknownBackendIsRejected():
+    with pytest.raises(ValueError, match='Unknown simulation backend'):
+        simulation_utils.simulate(np.ones(2), np.eye(2), np.ones(2), np.eye(2),
+                                  np.ones(3), np.ones(3), backend='fortran')
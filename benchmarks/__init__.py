@@ -0,0 +1,23 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Benchmarks for the Python filter code in app/src/main/python. Run
+them from the repository root with
+
+    python -m benchmarks --output results.json
+
+The filter modules are flat modules packaged by Chaquopy, so their directory
+is put on the import path here.
+'''
+import os
+import sys
+
+
+PYTHON_SOURCE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'app', 'src', 'main', 'python'
+)
+if PYTHON_SOURCE_DIR not in sys.path:
+    sys.path.insert(0, PYTHON_SOURCE_DIR)
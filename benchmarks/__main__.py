@@ -0,0 +1,83 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Command line entry point of the benchmarks. Runs the scenarios and
+writes the results, with the environment they ran in, as JSON.
+'''
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import numpy as np
+import scipy
+
+from datetime import datetime, timezone
+
+from benchmarks.scenarios import FILTERS, SCENARIOS, runScenarios
+from benchmarks.synthetic import GAP_PATTERNS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Times the SenSE filters on synthetic heart rate data.'
+    )
+    parser.add_argument('--filters', nargs='+', choices=FILTERS, default=list(FILTERS))
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--days', nargs='+', type=int, default=[1, 7, 30, 90],
+                        help='days of data for every scenario but optimizeFilter')
+    parser.add_argument('--optimize-days', nargs='+', type=int, default=[1, 7],
+                        help='days of data for the optimization scenarios')
+    parser.add_argument('--repeats', type=int, default=5, help='timed calls per measurement')
+    parser.add_argument('--gap-pattern', choices=GAP_PATTERNS, default='random')
+    parser.add_argument('--gap-fraction', type=float, default=0.25)
+    parser.add_argument('--phase-drift', type=float, default=0.25,
+                        help='hours the circadian phase shifts by each day')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write; printed if omitted')
+    args = parser.parse_args(argv)
+
+    # Keep anything the filter code prints out of the JSON on stdout.
+    with contextlib.redirect_stdout(sys.stderr):
+        results = runScenarios(
+            filters=args.filters, scenarios=args.scenarios, days=args.days,
+            optimizeDays=args.optimize_days, repeats=args.repeats,
+            gapPattern=args.gap_pattern, gapFraction=args.gap_fraction,
+            phaseDrift=args.phase_drift, seed=args.seed
+        )
+
+    document = {
+        'environment': _environment(),
+        'configuration': vars(args),
+        'results': results,
+    }
+    text = json.dumps(document, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+def _environment() -> dict:
+    '''Describes where the benchmarks ran, to compare results across hardware.'''
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpuCount': os.cpu_count(),
+        'simulationBackend': os.environ.get('SENSE_SIMULATION_BACKEND'),
+        'argv': sys.argv,
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Timed benchmark scenarios for both filters. Each scenario prepares
+its inputs outside the timed region, then times the same entry points the app
+calls (the main_sskf and main_obf module functions) on synthetic data.
+'''
+import time
+import numpy as np
+
+from typing import Callable, Dict, List
+
+import filter_utils
+import main_obf
+import main_sskf
+from benchmarks.synthetic import generateHeartRate
+from evolution_utils import Screening
+from ObserverBasedFilter import ObserverBasedFilter
+from SteadyStateKalmanFilter import SteadyStateKalmanFilter
+
+
+FILTERS = ('sskf', 'obf')
+SCENARIOS = ('simulateDynamics', 'optimizeFilter', 'multiResolution', 'screening',
+             'cmaes', 'differentialEvolution', 'spectrumCost', 'averageDailyPhase')
+OPTIMIZATION_SCENARIOS = ('optimizeFilter', 'multiResolution', 'screening', 'cmaes',
+                          'differentialEvolution')
+
+# Filter parameters for the scenarios that need them come from a short
+# optimization on this many days of data.
+_PARAMETER_DAYS = 2
+
+# Decimation factor of the multi-resolution optimizations.
+_DECIMATION = 10
+
+# Screening windows in days and the share of offspring kept at each.
+_SCREENING_DAYS = (3,)
+_SCREENING_KEEP = 0.5
+
+
+def timeCall(function: Callable[[], object], repeats: int, warmup: int = 1) -> Dict[str, float]:
+    '''Times repeated calls of [function].
+
+    Args:
+        function: function to call without arguments.
+        repeats: number of timed calls.
+        warmup: number of untimed calls first, to fill caches.
+    Returns:
+        timings (dict) - best, median and mean time per call in seconds, and
+            the number of timed calls
+    '''
+    for _ in range(warmup):
+        function()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {
+        'repeats': repeats,
+        'best': float(np.min(times)),
+        'median': float(np.median(times)),
+        'mean': float(np.mean(times)),
+    }
+
+def runScenarios(filters=FILTERS, scenarios=SCENARIOS, days=(1, 7, 30, 90),
+                 optimizeDays=(1, 7), repeats: int = 5, gapPattern: str = 'random',
+                 gapFraction: float = 0.25, phaseDrift: float = 0.25,
+                 seed: int = 0) -> List[dict]:
+    '''Runs the selected scenarios for each filter and number of days.
+
+    Args:
+        filters: filters to benchmark, from FILTERS.
+        scenarios: scenarios to run, from SCENARIOS.
+        days: numbers of days of data for every scenario but optimizeFilter.
+        optimizeDays: numbers of days of data for the OPTIMIZATION_SCENARIOS,
+            which are much slower than the rest.
+        repeats: number of timed calls per measurement.
+        gapPattern: missing data pattern of the synthetic data.
+        gapFraction: approximate share of missing samples.
+        phaseDrift: hours the circadian phase shifts by each day.
+        seed: seed for the synthetic data and the optimizations.
+    Returns:
+        results (list) - one record per filter, scenario and number of days
+    '''
+    for name in filters:
+        if name not in FILTERS:
+            raise ValueError("Unknown filter '{}'. Choose from {}.".format(name, FILTERS))
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise ValueError("Unknown scenario '{}'. Choose from {}.".format(name, SCENARIOS))
+
+    def generate(numDays):
+        return generateHeartRate(
+            numDays, phaseDrift=phaseDrift, gapPattern=gapPattern,
+            gapFraction=gapFraction, seed=seed
+        )
+
+    results = []
+    for filterName in filters:
+        module = main_sskf if filterName == 'sskf' else main_obf
+        t, y = generate(_PARAMETER_DAYS)
+        params = module.optimizeFilter(t, y, seed=seed, useCache=False)
+
+        for scenario in scenarios:
+            scenarioDays = optimizeDays if scenario in OPTIMIZATION_SCENARIOS else days
+            for numDays in scenarioDays:
+                t, y = generate(numDays)
+                timings, details = _SCENARIO_FUNCTIONS[scenario](
+                    filterName, module, t, y, params, numDays, repeats, seed
+                )
+                results.append({
+                    'filter': filterName,
+                    'scenario': scenario,
+                    'days': numDays,
+                    'samples': len(y),
+                    'missingShare': float(np.mean(y == 0)),
+                    'timings': timings,
+                    'samplesPerSecond': len(y)/timings['median'],
+                    'details': details,
+                })
+
+    return results
+
+def _simulateDynamics(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times filtering the data with fixed parameters.'''
+    return timeCall(lambda: module.simulateDynamics(t, y, params), repeats), {}
+
+def _optimizeFilter(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times a full optimization, reporting how it ended.'''
+    report = {}
+    timings = timeCall(
+        lambda: module.optimizeFilter(t, y, seed=seed, report=report, useCache=False),
+        repeats, warmup=0
+    )
+
+    return timings, report
+
+def _multiResolution(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times a multi-resolution optimization against a full-resolution one.'''
+    timings, details = _compareOptimization(
+        module, t, y, repeats, seed, decimation=_DECIMATION
+    )
+    details['decimation'] = _DECIMATION
+
+    return timings, details
+
+def _screening(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times an optimization with screening against an exhaustive one.'''
+    screening = Screening(_SCREENING_DAYS, _SCREENING_KEEP)
+    timings, details = _compareOptimization(module, t, y, repeats, seed, screening=screening)
+    details['windowDays'] = list(screening.windowDays)
+    details['keepFraction'] = screening.keepFraction
+
+    return timings, details
+
+def _cmaes(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times a CMA-ES search against the default (mu+lambda) loop.'''
+    return _compareOptimization(module, t, y, repeats, seed, optimizer='cmaes')
+
+def _differentialEvolution(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times a differential evolution search against the default (mu+lambda) loop.'''
+    return _compareOptimization(module, t, y, repeats, seed, optimizer='de')
+
+def _compareOptimization(module, t, y, repeats, seed, **options):
+    '''Times an optimization with [options], comparing its final cost and time
+    with a default optimization with the same seed.'''
+    report = {}
+    timings = timeCall(
+        lambda: module.optimizeFilter(
+            t, y, seed=seed, report=report, useCache=False, **options
+        ),
+        repeats, warmup=0
+    )
+
+    defaultReport = {}
+    defaultTimings = timeCall(
+        lambda: module.optimizeFilter(t, y, seed=seed, report=defaultReport, useCache=False),
+        1, warmup=0
+    )
+
+    details = dict(report)
+    details['defaultCost'] = defaultReport['bestCost']
+    details['relativeCostDifference'] = (
+        (report['bestCost'] - defaultReport['bestCost'])/abs(defaultReport['bestCost'])
+    )
+    details['speedup'] = defaultTimings['median']/timings['median']
+
+    return timings, details
+
+def _spectrumCost(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times the spectrum and cost of one filter output, as done per candidate.'''
+    yHat = module.simulateDynamics(t, y, params)[-1]
+    dt = t[1] - t[0]
+
+    if filterName == 'sskf':
+        originalSpectrum, _, _ = filter_utils.computeSpectrum(t, y)
+        costPlan = filter_utils.createCostPlan(len(t), dt, SteadyStateKalmanFilter._order)
+
+        def spectrumCost():
+            filteredSpectrum, _, _ = filter_utils.computeSpectrum(t, yHat)
+            return costPlan.computeCost(originalSpectrum, filteredSpectrum)
+    else:
+        OBF = ObserverBasedFilter()
+        originalSpectrum, _, _ = OBF._computeSpectrum(t, y)
+        costPlan = OBF._createCostPlan(len(t), dt)
+
+        def spectrumCost():
+            filteredSpectrum, _, _ = OBF._computeSpectrum(t, yHat)
+            return costPlan.computeCost(originalSpectrum, filteredSpectrum)
+
+    signalCost = timeCall(lambda: costPlan.computeSignalCost(originalSpectrum, yHat), repeats)
+
+    return timeCall(spectrumCost, repeats), {'signalCostMedian': signalCost['median']}
+
+def _averageDailyPhase(filterName, module, t, y, params, numDays, repeats, seed):
+    '''Times the average daily phase estimate from the filter states.'''
+    filterOutput = module.simulateDynamics(t, y, params)
+    xHat1 = np.ascontiguousarray(filterOutput[0])
+    xHat2 = np.ascontiguousarray(filterOutput[1])
+    numDaysOffset = 0
+
+    return timeCall(
+        lambda: module.estimateAverageDailyPhase(
+            xHat1, xHat2, numDays, numDaysOffset, 24*60
+        ),
+        repeats
+    ), {}
+
+
+_SCENARIO_FUNCTIONS = {
+    'simulateDynamics': _simulateDynamics,
+    'optimizeFilter': _optimizeFilter,
+    'multiResolution': _multiResolution,
+    'screening': _screening,
+    'cmaes': _cmaes,
+    'differentialEvolution': _differentialEvolution,
+    'spectrumCost': _spectrumCost,
+    'averageDailyPhase': _averageDailyPhase,
+}
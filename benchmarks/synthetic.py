@@ -0,0 +1,103 @@
+'''
+Rensselaer Polytechnic Institute - Julius Lab
+SenSE Project
+Author - Chukwuemeka Osaretin Ike
+
+Description: Synthetic circadian heart rate data for the benchmarks. The signal
+is a sum of harmonics of the daily rhythm plus noise, at 1-minute resolution,
+with an optional drift of the circadian phase and missing samples (zeros, as in
+the Fitbit data) in one of a few gap patterns.
+'''
+import numpy as np
+
+from math import pi
+from typing import Sequence, Tuple
+
+
+# Samples per hour at 1-minute resolution.
+SAMPLES_PER_HOUR = 60
+
+# Patterns of missing data generateHeartRate can add.
+GAP_PATTERNS = ('none', 'random', 'nightly', 'mixed')
+
+
+def generateHeartRate(numDays: int = 14, meanRate: float = 70,
+                      amplitudes: Sequence[float] = (8, 3, 1),
+                      noiseStd: float = 5, phaseDrift: float = 0,
+                      gapPattern: str = 'random', gapFraction: float = 0.25,
+                      seed: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    '''Generates synthetic heart rate data with a circadian rhythm.
+
+    Args:
+        numDays: number of days, 1 to 90 in the benchmarks.
+        meanRate: mean heart rate in beats per minute.
+        amplitudes: amplitude of each harmonic of the 2*pi/24 rhythm, starting
+            with the fundamental.
+        noiseStd: standard deviation of the white measurement noise.
+        phaseDrift: hours the circadian phase shifts by each day.
+        gapPattern: missing data pattern, one of GAP_PATTERNS:
+            'none' - no gaps.
+            'random' - gaps of up to 5 hours at random times.
+            'nightly' - the device is off (charging) for a few hours every night.
+            'mixed' - both nightly and random gaps.
+        gapFraction: approximate share of the samples that are missing.
+        seed: seed for the random number generator, for repeatable data.
+    Returns:
+        t (np.ndarray) - time in hours from the first sample
+        y (np.ndarray) - heart rate, zero where the data is missing
+    '''
+    if gapPattern not in GAP_PATTERNS:
+        raise ValueError(
+            "Unknown gap pattern '{}'. Choose from {}.".format(gapPattern, GAP_PATTERNS)
+        )
+
+    rng = np.random.default_rng(seed)
+    numSamples = numDays*24*SAMPLES_PER_HOUR
+    t = np.arange(numSamples)/SAMPLES_PER_HOUR
+
+    # Harmonics of the daily rhythm with a phase that drifts linearly in time.
+    omg = 2*pi/24
+    phase = omg*t - omg*phaseDrift*t/24
+    y = np.full(numSamples, float(meanRate))
+    for k, amplitude in enumerate(amplitudes):
+        y += amplitude*np.cos((k+1)*phase + rng.uniform(0, 2*pi))
+    y += noiseStd*rng.standard_normal(numSamples)
+
+    isMissing = np.zeros(numSamples, dtype=bool)
+    if gapPattern in ('nightly', 'mixed'):
+        nightlyShare = gapFraction if gapPattern == 'nightly' else gapFraction/2
+        isMissing |= _nightlyGaps(t, nightlyShare, rng)
+    if gapPattern in ('random', 'mixed'):
+        randomShare = gapFraction if gapPattern == 'random' else gapFraction/2
+        isMissing |= _randomGaps(numSamples, randomShare, rng)
+
+    # The filters need data at the start to initialize from.
+    isMissing[0] = False
+    y[isMissing] = 0
+
+    return t, y
+
+def _nightlyGaps(t: np.ndarray, share: float, rng: np.random.Generator) -> np.ndarray:
+    '''Marks a block around 3am of each day, [share] of the day long on average.'''
+    isMissing = np.zeros(len(t), dtype=bool)
+    meanLength = 24*share
+    numDays = int(np.ceil(len(t)/(24*SAMPLES_PER_HOUR)))
+    for day in range(numDays):
+        length = max(0, meanLength + rng.normal(0, meanLength/4))
+        start = 24*day + 3 - length/2 + rng.normal(0, 0.5)
+        startIdx = max(0, int(round(start*SAMPLES_PER_HOUR)))
+        endIdx = max(0, int(round((start + length)*SAMPLES_PER_HOUR)))
+        isMissing[startIdx:endIdx] = True
+
+    return isMissing
+
+def _randomGaps(numSamples: int, share: float, rng: np.random.Generator) -> np.ndarray:
+    '''Marks gaps of 1 minute to 5 hours at random until about [share] of the samples are missing.'''
+    isMissing = np.zeros(numSamples, dtype=bool)
+    target = int(share*numSamples)
+    while np.count_nonzero(isMissing) < target:
+        length = int(rng.integers(1, 5*SAMPLES_PER_HOUR + 1))
+        start = int(rng.integers(0, numSamples))
+        isMissing[start:start+length] = True
+
+    return isMissing